@@ -50,7 +50,8 @@ def do(args):
         default_dep_types = ["runtime"]
     cmake_builder = qibuild.parsers.get_cmake_builder(
                                     args, default_dep_types=default_dep_types)
-    for url in urls:
-        cmake_builder.deploy(url, split_debug=args.split_debug,
-                             with_tests=args.with_tests,
-                             install_tc_packages=args.install_tc_packages)
+    cmake_builder.deploy_to_urls(urls, split_debug=args.split_debug,
+                                 with_tests=args.with_tests,
+                                 install_tc_packages=args.install_tc_packages,
+                                 checksum=args.checksum,
+                                 num_workers=args.num_workers)
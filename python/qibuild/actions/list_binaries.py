@@ -7,9 +7,8 @@
 """
 # Mainly useful to auto-complete ``qibuild run``
 
-import os
-
 from qisys import ui
+import qibuild.find
 import qibuild.parsers
 
 def configure_parser(parser):
@@ -20,19 +19,6 @@ def do(args):
     """ Main entry point """
     build_worktree = qibuild.parsers.get_build_worktree(args)
     sdk_dirs = [x.sdk_directory for x in build_worktree.build_projects]
-    bin_dirs = [os.path.join(x, "bin") for x in sdk_dirs]
-    res = list()
-    for bin_dir in bin_dirs:
-        if os.path.exists(bin_dir):
-            binaries = os.listdir(bin_dir)
-        else:
-            binaries = list()
-        if os.name == 'nt':
-            binaries = [x for x in binaries if x.endswith(".exe")]
-            binaries = [x.replace("_d.exe", "") for x in binaries]
-            binaries = [x.replace(".exe", "") for x in binaries]
-        res.extend(binaries)
-
-    res.sort()
-    for binary in res:
+    binaries = qibuild.find.get_binaries(sdk_dirs)
+    for binary in sorted(binaries):
         ui.info(binary)
@@ -94,10 +94,8 @@ def do(args):
     if breakpad:
         symbols_archive_name = archive_name + "-symbols.zip"
         symbols_archive = os.path.join(package_dir, symbols_archive_name)
-        with qisys.sh.TempDir() as tmp:
-            pool_dir = os.path.join(tmp, "symbols")
-            qibuild.breakpad.dump_symbols_from_directory(destdir, pool_dir)
-            qisys.archive.compress(pool_dir, flat=True, output=symbols_archive)
+        qibuild.breakpad.gen_symbol_archive(base_dir=destdir,
+                                            output=symbols_archive)
 
 
     ui.info(ui.blue, "::", ui.reset, ui.bold, "Compressing package ...")
@@ -2,32 +2,54 @@
 ## Use of this source code is governed by a BSD-style license that can be
 ## found in the COPYING file.
 
+import hashlib
 import os
+import posixpath
 import subprocess
 import sys
 import stat
+import tempfile
+import threading
+import time
+import zipfile
 
 from qisys import ui
-import qisys.archive
+import qisys.command
+import qisys.cpu
+import qisys.parallel
 import qisys.sh
 import qibuild.cmake
+import qibuild.elf
 
+ELF_MAGIC = "\x7fELF"
+MACHO_MAGIC = "\xcf\xfa"
+# Maximum size of the symbol cache, in bytes
+SYMBOL_CACHE_SIZE = 2 * 1024 * 1024 * 1024
+
+def get_binary_format(filename):
+    """ Read the header of the file once, and return
+    "elf", "macho" or None
+
+    """
+    with open(filename, "rb") as fp:
+        header = fp.read(4)
+    if header == ELF_MAGIC:
+        return "elf"
+    if header[:2] == MACHO_MAGIC:
+        return "macho"
+    return None
 
 def is_elf(filename):
     """ Check that a file is in the elf format
 
     """
-    with open(filename, "rb") as fp:
-        data = fp.read(4)
-    return data == "\x7fELF"
+    return get_binary_format(filename) == "elf"
 
 def is_macho(filename):
     """ Check that a file is in the Mach-O format
 
     """
-    with open(filename, "rb") as fp:
-        data = fp.read(2)
-    return data == '\xcf\xfa'
+    return get_binary_format(filename) == "macho"
 
 def is_exe(filename):
     """ Check that a file is a Windows executable """
@@ -45,19 +67,30 @@ def can_be_dumped(filename):
         return False
     # File must be an executable
     if sys.platform.startswith("linux"):
-        return is_elf(filename)
+        return get_binary_format(filename) == "elf"
     if sys.platform == "darwin":
-        return is_macho(filename)
+        return get_binary_format(filename) == "macho"
     if os.name == "nt":
         return is_exe(filename)
 
-def dump_symbols_from_binary(binary, pool_dir):
-    """ Dump sympobls from the binary.
-    Results can be found in
-    <pool_dir>/<binary name>/<id>/<binary name>.sym
+def dump_symbols(binary, dump_syms=None, cache=None):
+    """ Dump symbols from the binary.
+    Return a tuple (path, contents), where path looks like
+    <binary name>/<id>/<binary name>.sym, or None if dump_syms failed
+
+    If a :py:class:`SymbolCache` is given, dump_syms is only
+    called when the binary is not in the cache
 
     """
-    dump_syms = qisys.command.find_program("dump_syms", raises=True)
+    key = None
+    if cache:
+        key = cache.get_key(binary)
+        out = cache.get(key)
+        if out is not None:
+            ui.debug("Using cached symbols for", binary)
+            return (get_symbols_path(out), out)
+    if not dump_syms:
+        dump_syms = qisys.command.find_program("dump_syms", raises=True)
     if sys.platform == "darwin":
         dsym = gen_dsym(binary)
         cmd = [dump_syms, dsym]
@@ -80,28 +113,44 @@ def dump_symbols_from_binary(binary, pool_dir):
         qisys.sh.rm(dsym)
 
     if not dump_ok:
-        return
+        return None
+    if cache:
+        cache.put(key, out)
+    return (get_symbols_path(out), out)
+
+def get_symbols_path(contents):
+    """ Get the path of a symbol file, from the first line of its contents
 
+    """
     # First line looks like:
     # MODULE Linux x86_64  ID  foo on linux
     # MODULE windows x86 ID foo.pdb on windows
     # path should be
-    # pool/foo.pdb/ID/foo.sym on windows,
-    # pool/foo/ID/foo.sym on linux
-    lines = out.splitlines()
-    first_line = lines[0]
+    # foo.pdb/ID/foo.sym on windows,
+    # foo/ID/foo.sym on linux
+    first_line = contents.split("\n", 1)[0]
     uuid = first_line.split()[3]
     name = first_line.split()[4]
     if os.name == "nt":
         basename = name.replace(".pdb", "")
     else:
         basename = name
+    return posixpath.join(name, uuid, basename + ".sym")
 
-    to_make = os.path.join(pool_dir, name, uuid)
-    qisys.sh.mkdir(to_make, recursive=True)
+def dump_symbols_from_binary(binary, pool_dir, cache=None):
+    """ Dump sympobls from the binary.
+    Results can be found in
+    <pool_dir>/<binary name>/<id>/<binary name>.sym
 
-    with open(os.path.join(to_make, basename + ".sym"), "w") as fp:
-        fp.write(out)
+    """
+    res = dump_symbols(binary, cache=cache)
+    if not res:
+        return
+    (rel_path, contents) = res
+    sym_path = os.path.join(pool_dir, *rel_path.split("/"))
+    qisys.sh.mkdir(os.path.dirname(sym_path), recursive=True)
+    with open(sym_path, "w") as fp:
+        fp.write(contents)
 
 def strip_binary(binary, strip_executable=None, strip_args=None):
     if not strip_executable:
@@ -117,41 +166,251 @@ def strip_binary(binary, strip_executable=None, strip_args=None):
     if rc != 0:
         ui.warning("Failed to strip symbols for", binary)
 
+class SymbolCache(object):
+    """ A persistent cache of symbol files, so that dump_syms is not run
+    again on binaries that did not change.
+
+    Binaries are identified by their GNU build-id, or by a hash of their
+    contents when they have none. Whether the binary has debug information
+    is part of the key, since stripping a binary keeps its build-id.
+    When the cache gets bigger than ``max_size`` bytes, the least
+    recently used files are removed by :py:meth:`trim`
+
+    """
+    def __init__(self, path=None, max_size=SYMBOL_CACHE_SIZE):
+        if path is None:
+            path = qisys.sh.get_cache_path("qi", "breakpad")
+        qisys.sh.mkdir(path, recursive=True)
+        self.path = path
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def get_key(self, binary):
+        """ Get the key of the binary in the cache """
+        hasher = hashlib.sha1()
+        # The name of the binary is in the symbol file
+        hasher.update(os.path.basename(binary) + "\0")
+        build_id = None
+        if get_binary_format(binary) == "elf":
+            sections = qibuild.elf.read_sections(binary) or list()
+            build_id = qibuild.elf.get_build_id(binary, sections=sections)
+            if any(x.name == ".debug_info" for x in sections):
+                hasher.update("debug-info\0")
+        if build_id:
+            hasher.update("build-id:" + build_id)
+        else:
+            with open(binary, "rb") as fp:
+                while True:
+                    chunk = fp.read(1024 * 1024)
+                    if not chunk:
+                        break
+                    hasher.update(chunk)
+        return hasher.hexdigest()
+
+    def get(self, key):
+        """ Get the contents of a symbol file, or None if it
+        is not in the cache
+
+        """
+        sym_path = self._get_path(key)
+        try:
+            with open(sym_path, "rb") as fp:
+                res = fp.read()
+            # Used to find the least recently used files
+            os.utime(sym_path, None)
+        except (IOError, OSError):
+            res = None
+        with self._lock:
+            if res is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return res
+
+    def put(self, key, contents):
+        """ Add a symbol file in the cache """
+        sym_path = self._get_path(key)
+        dirname = os.path.dirname(sym_path)
+        with self._lock:
+            qisys.sh.mkdir(dirname, recursive=True)
+        # Write in a temporary file first, so that a symbol file
+        # is never read while being written
+        (fd, tmp_path) = tempfile.mkstemp(dir=dirname, suffix=".tmp")
+        with os.fdopen(fd, "wb") as fp:
+            fp.write(contents)
+        try:
+            os.rename(tmp_path, sym_path)
+        except OSError:
+            qisys.sh.rm(tmp_path)
+
+    def trim(self):
+        """ Remove the least recently used files until the size
+        of the cache is less than ``max_size``
+
+        """
+        entries = list()
+        total_size = 0
+        for (root, directories, filenames) in os.walk(self.path):
+            for filename in filenames:
+                full_path = os.path.join(root, filename)
+                st = os.stat(full_path)
+                entries.append((st.st_mtime, st.st_size, full_path))
+                total_size += st.st_size
+        entries.sort()
+        for (_, size, full_path) in entries:
+            if total_size <= self.max_size:
+                break
+            qisys.sh.rm(full_path)
+            total_size -= size
+
+    def _get_path(self, key):
+        return os.path.join(self.path, key[:2], key + ".sym")
+
+
 def gen_dsym(binary):
     cmd = ["dsymutil", binary]
     qisys.command.call(cmd)
     return binary + ".dSYM"
 
-def dump_symbols_from_directory(root_dir, pool_dir, strip=True):
-    """ Dump symbols for every binary in the root dir.
-    Assumes that dump_syms is in $PATH.
-    If strip is True, also strip the binaries. (assumes that strip is
-    in $PATH)
-
-    """
+def find_binaries(root_dir):
+    """ Find all the binaries symbols can be dumped from in the root dir """
+    res = list()
     for (root, directories, filenames) in os.walk(root_dir):
         for filename in filenames:
             full_path = os.path.join(root_dir, root, filename)
             if os.path.islink(full_path):
                 continue
             if can_be_dumped(full_path):
-                ui.info("dumping", full_path)
-                dump_symbols_from_binary(full_path, pool_dir)
-                if strip and os.name == "posix":
-                    if sys.platform == "darwin":
-                        strip_args = ["-u", "-r"]
-                    else:
-                        strip_args = list()
-                    ui.info("stripping", full_path)
-                    strip_binary(full_path, strip_args=strip_args)
+                res.append(full_path)
+    res.sort()
+    return res
+
+def process_binaries(binaries, on_symbols, strip=True, num_workers=None,
+                     cache=None):
+    """ Dump the symbols of the binaries, and strip them if strip is True.
+
+    Binaries are processed in parallel, using one thread by CPU
+    by default. ``on_symbols(path, contents)`` is called with the
+    result of :py:func:`dump_symbols` as soon as it is ready, from
+    the worker threads
+
+    """
+    if not binaries:
+        return
+    dumper = _SymbolsDumper(on_symbols, strip=strip, cache=cache)
+    if num_workers is None:
+        num_workers = qisys.cpu.cpu_count()
+    num_workers = max(1, min(num_workers, len(binaries)))
+    qisys.parallel.foreach(binaries, dumper.process, n_jobs=num_workers)
+    if dumper.errors:
+        raise dumper.errors[0]
+    if cache:
+        ui.info("Symbols of", cache.hits, "binaries found in cache,",
+                cache.misses, "dumped")
+        cache.trim()
+
+
+class _SymbolsDumper(object):
+    """ Dump and strip binaries from several threads.
+
+    Errors are stored in ``self.errors``, because they cannot be
+    raised from the worker threads
+
+    """
+    def __init__(self, on_symbols, strip=True, cache=None):
+        self.on_symbols = on_symbols
+        self.cache = cache
+        self.strip = strip and os.name == "posix"
+        self.dump_syms = qisys.command.find_program("dump_syms", raises=True)
+        self.strip_executable = None
+        if self.strip:
+            self.strip_executable = qisys.command.find_program("strip",
+                                                               raises=True)
+        if sys.platform == "darwin":
+            self.strip_args = ["-u", "-r"]
+        else:
+            self.strip_args = list()
+        self.errors = list()
+        self._lock = threading.Lock()
+
+    def process(self, binary):
+        if self.errors:
+            return
+        try:
+            ui.info("dumping", binary)
+            res = dump_symbols(binary, dump_syms=self.dump_syms,
+                               cache=self.cache)
+            if res:
+                self.on_symbols(*res)
+            if self.strip:
+                ui.info("stripping", binary)
+                strip_binary(binary, strip_executable=self.strip_executable,
+                             strip_args=self.strip_args)
+        except Exception as e:
+            with self._lock:
+                self.errors.append(e)
+
+
+def dump_symbols_from_directory(root_dir, pool_dir, strip=True,
+                                num_workers=None, use_cache=True):
+    """ Dump symbols for every binary in the root dir.
+    Assumes that dump_syms is in $PATH.
+    If strip is True, also strip the binaries. (assumes that strip is
+    in $PATH)
+    If use_cache is True, use the default :py:class:`SymbolCache`
+
+    """
+    lock = threading.Lock()
+    def on_symbols(rel_path, contents):
+        sym_path = os.path.join(pool_dir, *rel_path.split("/"))
+        with lock:
+            qisys.sh.mkdir(os.path.dirname(sym_path), recursive=True)
+        with open(sym_path, "w") as fp:
+            fp.write(contents)
+
+    cache = None
+    if use_cache:
+        cache = SymbolCache()
+    binaries = find_binaries(root_dir)
+    process_binaries(binaries, on_symbols, strip=strip,
+                     num_workers=num_workers, cache=cache)
     return pool_dir
 
-def gen_symbol_archive(base_dir=None, output=None, strip=True):
+def gen_symbol_archive(base_dir=None, output=None, strip=True,
+                       num_workers=None, use_cache=True):
     """ Generate a symbol archive from all the
     binaries in the base_dir
 
+    The symbol files are written in the archive as soon as
+    they are dumped, without using a temporary directory.
+    When several binaries have the same symbol file path, only
+    the first one is written.
+    If use_cache is True, use the default :py:class:`SymbolCache`
+
     """
-    with qisys.sh.TempDir() as pool_dir:
-        dump_symbols_from_directory(base_dir, pool_dir, strip=strip)
-        qisys.archive.compress(pool_dir, output=output, flat=True)
+    cache = None
+    if use_cache:
+        cache = SymbolCache()
+    lock = threading.Lock()
+    archive = zipfile.ZipFile(output, "w", zipfile.ZIP_DEFLATED)
+    written = set()
+    def on_symbols(rel_path, contents):
+        zinfo = zipfile.ZipInfo(rel_path, time.localtime()[0:6])
+        zinfo.external_attr = (stat.S_IFREG | 0644) << 16L
+        zinfo.compress_type = zipfile.ZIP_DEFLATED
+        with lock:
+            if rel_path in written:
+                ui.debug("Skipping duplicate symbol file", rel_path)
+                return
+            written.add(rel_path)
+            archive.writestr(zinfo, contents)
+
+    try:
+        binaries = find_binaries(base_dir)
+        process_binaries(binaries, on_symbols, strip=strip,
+                         num_workers=num_workers, cache=cache)
+    finally:
+        archive.close()
     return output
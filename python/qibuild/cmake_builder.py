@@ -5,9 +5,11 @@
 import os
 import functools
 import operator
+import threading
 
 from qisys import ui
 import qisys.error
+import qisys.parallel
 import qisys.sh
 import qisys.remote
 import qisrc.worktree
@@ -261,14 +263,9 @@ Or configure the project with no config
         release = build_type == "Release"
         if packages:
             ui.info(ui.green, ":: ", "installing packages")
-        for i, package in enumerate(packages):
-            ui.info_count(i, len(packages),
-                          ui.green, "Installing",
-                          ui.blue, package.name,
-                          update_title=True)
-            files = package.install(real_dest, components=components,
-                                    release=release)
-            installed.extend(files)
+        files = self._install_packages(packages, real_dest,
+                                       components=components, release=release)
+        installed.extend(files)
 
         # Remove qitest.json so that we don't append tests twice
         # when running qibuild install --with-tests twice
@@ -277,22 +274,108 @@ Or configure the project with no config
 
         if projects:
             ui.info(ui.green, ":: ", "installing projects")
-            for i, project in enumerate(projects):
+            files = self._install_projects(projects, dest_dir, **kwargs)
+            installed.extend(files)
+        return installed
+
+    def _install_packages(self, packages, dest, components=None, release=True,
+                          verb="Installing"):
+        """ Install the packages, running at most ``-j`` installs
+        at the same time
+
+        """
+        jobs = list()
+        for i, package in enumerate(packages):
+            def install_package(i=i, package=package):
+                ui.info_count(i, len(packages),
+                              ui.green, verb, ui.blue, package.name,
+                              update_title=True)
+                return package.install(dest, components=components,
+                                       release=release)
+            files = package.get_install_files(components=components,
+                                              release=release)
+            jobs.append((package.name, install_package, files))
+        results = install_in_parallel(jobs, num_jobs=self.build_config.num_jobs,
+                                      dest_dir=dest)
+        return [x for files in results for x in files]
+
+    def _install_projects(self, projects, dest_dir, prefix="/",
+                          components=None, split_debug=False,
+                          verb="Installing"):
+        """ Install the projects, running at most ``-j`` installs at the
+        same time.
+
+        Each component of each project is installed separately, once
+        all the projects are ready to be installed. Tests and debug
+        symbols are then handled in order, one project after the other
+
+        """
+        num_jobs = self.build_config.num_jobs
+        to_install = list()
+        prepare_jobs = list()
+        for i, project in enumerate(projects):
+            if project.meta:
+                ui.info_count(i, len(projects),
+                              ui.green, verb, ui.blue, project.name)
+                ui.info("Meta project, skipping install")
+                continue
+            def prepare(i=i, project=project):
                 ui.info_count(i, len(projects),
-                            ui.green, "Installing",
-                            ui.blue, project.name,
-                            update_title=True)
-                if project.meta:
-                    ui.info("Meta project, skipping install")
-                    continue
-                files = project.install(dest_dir, **kwargs)
-                installed.extend(files)
+                              ui.green, verb, ui.blue, project.name,
+                              update_title=True)
+                project.prepare_install(dest_dir, prefix=prefix)
+                return list()
+            to_install.append(project)
+            prepare_jobs.append((project.name, prepare, list()))
+        install_in_parallel(prepare_jobs, num_jobs=num_jobs)
+
+        jobs = list()
+        for project in to_install:
+            for component in components or [None]:
+                name = project.name
+                if component:
+                    name += " (%s)" % component
+                install_component = functools.partial(
+                    project.install_component, dest_dir, component)
+                # Guess the installed files from the previous install
+                files = project.get_install_manifest(component)
+                jobs.append((name, install_component, files))
+        results = install_in_parallel(jobs, num_jobs=num_jobs,
+                                      dest_dir=dest_dir)
+
+        installed = list()
+        for project in to_install:
+            project_files = list()
+            for _ in components or [None]:
+                project_files.extend(results.pop(0))
+            project.finish_install(dest_dir, project_files,
+                                   components=components,
+                                   split_debug=split_debug)
+            installed.extend(project_files)
         return installed
 
 
     @need_configure
-    def deploy(self, url, split_debug=False, with_tests=False, install_tc_packages=True):
-        """ Deploy the project and the packages it depends to a remote url """
+    def deploy(self, url, **kwargs):
+        """ Deploy the project and the packages it depends to a remote url
+        See :py:meth:`deploy_to_urls`
+
+        """
+        self.deploy_to_urls([url], **kwargs)
+
+    @need_configure
+    def deploy_to_urls(self, urls, split_debug=False, with_tests=False,
+                       install_tc_packages=True, checksum=False,
+                       num_workers=None):
+        """ Deploy the project and the packages it depends to several
+        remote urls
+
+        Everything is installed once, and then sent to at most
+        ``num_workers`` urls at the same time (default: all of them).
+        Only the files that changed since the last deploy to each url are
+        sent, unless ``checksum`` is True
+
+        """
 
         # Deploy packages: install all of them in the same temp dir, then
         # deploy this temp dir to the target
@@ -327,46 +410,29 @@ Or configure the project with no config
             ui.info(ui.green, "and the following packages")
             for package in sorted(dep_packages, key=operator.attrgetter("name")):
                 ui.info(ui.green, " *", ui.reset, ui.blue, package.name)
-        ui.info(ui.green, "will be deployed to", ui.blue, url.as_string)
+        ui.info(ui.green, "will be deployed to", ui.blue,
+                ", ".join(x.as_string for x in urls))
 
         if dep_packages:
             print
             ui.info(ui.green, ":: ", "Deploying packages")
-            for i, package in enumerate(dep_packages):
-                ui.info_count(i, len(dep_packages),
-                    ui.green, "Deploying package", ui.blue, package.name,
-                    ui.green, "to", ui.blue, url.as_string,
-                    update_title=True)
-                # Install package in local deploy dir
-                files = package.install(deploy_dir, components=components)
-                to_deploy.extend(files)
+            # Install packages in local deploy dir
+            files = self._install_packages(dep_packages, deploy_dir,
+                                           components=components,
+                                           verb="Deploying package")
+            to_deploy.extend(files)
 
         print
         ui.info(ui.green, ":: ", "Deploying projects")
         # Deploy projects: install them inside a 'deploy' dir in the worktree
         # root, then deploy this dir to the target
-
-        for (i, project) in enumerate(dep_projects):
-            ui.info_count(i, len(dep_projects),
-                    ui.green, "Deploying project", ui.blue, project.name,
-                    ui.green, "to", ui.blue, url.as_string,
-                    update_title=True)
-            if project.meta:
-                ui.info("Meta project, skipping deploy")
-                continue
-
-            if with_tests:
-                to_deploy.append("qitest.json")
-            # Install project in local deploy dir
-            installed = project.install(deploy_dir, components=components,
-                                        split_debug=split_debug)
-            to_deploy.extend(installed)
-        # Add debugging scripts
-        for project in self.projects:
-            scripts = qibuild.deploy.generate_debug_scripts(self, deploy_dir,
-                                                            project.name, url)
-            if scripts:
-                to_deploy.extend(scripts)
+        if with_tests and any(not x.meta for x in dep_projects):
+            to_deploy.append("qitest.json")
+        installed = self._install_projects(dep_projects, deploy_dir,
+                                           components=components,
+                                           split_debug=split_debug,
+                                           verb="Deploying project")
+        to_deploy.extend(installed)
 
         # Write the list of files to be deployed
         with open(deploy_manifest, "a") as f:
@@ -375,13 +441,139 @@ Or configure the project with no config
             to_deploy.sort()
             f.write("\n".join(to_deploy))
 
-        print
-        ui.info(ui.green, "::", "Syncing to url", ui.reset, ui.bold,
-                url.as_string, update_title=True)
-        qisys.remote.deploy(deploy_dir, url, filelist=deploy_manifest)
+        manifest_dir = os.path.join(self.build_worktree.root, ".qi",
+                                    "deploy-manifests", deploy_name)
+
+        def deploy_to_url(url, progress=True):
+            print
+            ui.info(ui.green, "::", "Syncing to url", ui.reset, ui.bold,
+                    url.as_string, update_title=True)
+            qisys.remote.deploy(deploy_dir, url, filelist=deploy_manifest,
+                                manifest_dir=manifest_dir, checksum=checksum,
+                                progress=progress)
+            # Debugging scripts depend on the url, so they are generated
+            # in a separate directory for each url
+            url_key = qisys.remote.get_url_key(url)
+            scripts_dir = os.path.join(self.build_worktree.root, ".qi",
+                                       deploy_name + "-scripts", url_key)
+            qisys.sh.mkdir(scripts_dir, recursive=True)
+            scripts = list()
+            for project in self.projects:
+                project_scripts = qibuild.deploy.generate_debug_scripts(
+                    self, scripts_dir, project.name, url)
+                if project_scripts:
+                    scripts.extend(project_scripts)
+            if scripts:
+                qisys.remote.deploy(scripts_dir, url,
+                                    manifest_dir=os.path.join(manifest_dir,
+                                                              "scripts"),
+                                    checksum=checksum, progress=progress)
+
+        qisys.remote.deploy_to_urls(urls, deploy_to_url,
+                                    num_workers=num_workers)
 
         print
 
+# Files installed by every project, always with the same contents,
+# so installing them at the same time is harmless
+SHARED_INSTALL_FILES = ["share/qi/path.conf"]
+
+def install_in_parallel(jobs, num_jobs=None, dest_dir=None):
+    """ Run the install jobs, at most ``num_jobs`` at the same time
+    (default: one after the other).
+
+    Each job is a tuple (name, function, files), where ``files`` is the
+    list of the files the job is expected to install, relative to
+    ``dest_dir`` (for instance read from the manifest of the previous
+    install), or None if it is not known.
+    Each function must return the list of the files it installed.
+
+    Return the lists of installed files, in the same order as the jobs.
+
+    Jobs expected to install the same files are run one after the other,
+    in order, once the other jobs are done, so that the result is the same
+    as with a sequential install. If jobs run at the same time installed
+    the same files anyway, those files are removed from ``dest_dir``
+    and the last of the jobs is run again.
+
+    """
+    if not num_jobs or num_jobs < 2 or len(jobs) < 2:
+        return [function() for (_, function, _) in jobs]
+    conflicts = find_install_conflicts([files for (_, _, files) in jobs])
+    serial = sorted(set(i for indexes in conflicts.itervalues()
+                          for i in indexes))
+    if serial:
+        _show_install_conflicts(jobs, conflicts)
+        ui.info(ui.brown, "Some files are installed more than once,",
+                "installing", ", ".join(jobs[i][0] for i in serial),
+                "one after the other")
+    parallel = [i for i in range(len(jobs)) if i not in serial]
+    results = [None] * len(jobs)
+    errors = list()
+    lock = threading.Lock()
+    def run_job(index):
+        if errors:
+            return
+        (_, function, _) = jobs[index]
+        try:
+            results[index] = function()
+        except Exception as e:
+            with lock:
+                errors.append(e)
+    qisys.parallel.foreach(parallel, run_job,
+                           n_jobs=max(1, min(num_jobs, len(parallel))))
+    if errors:
+        raise errors[0]
+    for i in serial:
+        results[i] = jobs[i][1]()
+
+    # Conflicts that could not be predicted
+    to_reinstall = dict()
+    for (filename, indexes) in find_install_conflicts(results).iteritems():
+        if all(i in serial for i in indexes):
+            continue
+        to_reinstall.setdefault(max(indexes), list()).append(filename)
+    if to_reinstall:
+        _show_install_conflicts(jobs, find_install_conflicts(results))
+        ui.info(ui.brown, "Some files were installed more than once,",
+                "installing", ", ".join(jobs[i][0] for i in sorted(to_reinstall)),
+                "again so that the last one wins")
+    for i in sorted(to_reinstall):
+        # Make sure the files are copied again, even if they look up-to-date
+        for filename in to_reinstall[i]:
+            qisys.sh.rm(os.path.join(dest_dir, *filename.split("/")))
+        results[i] = jobs[i][1]()
+    return results
+
+def find_install_conflicts(installed):
+    """ Given the lists of the files installed by each job (or None
+    when not known), return a dict: file -> sorted indexes of the jobs
+    installing it, for the files installed by more than one job.
+
+    :py:data:`SHARED_INSTALL_FILES` are ignored
+
+    """
+    owners = dict()
+    for (i, files) in enumerate(installed):
+        for filename in files or list():
+            owners.setdefault(filename, set()).add(i)
+    res = dict()
+    for (filename, indexes) in owners.iteritems():
+        if len(indexes) > 1 and not _is_shared_install_file(filename):
+            res[filename] = sorted(indexes)
+    return res
+
+def _is_shared_install_file(filename):
+    return any(filename == x or filename.endswith("/" + x)
+               for x in SHARED_INSTALL_FILES)
+
+def _show_install_conflicts(jobs, conflicts):
+    mess = "The following files are installed by several jobs:\n"
+    mess += "\n".join(" * %s (%s)" % (x, ", ".join(jobs[i][0] for i in indexes))
+                      for (x, indexes) in sorted(conflicts.iteritems()))
+    ui.debug(mess)
+
+
 class NotConfigured(qisys.error.Error):
     def __init__(self, project):
         self.project = project
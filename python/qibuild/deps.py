@@ -34,6 +34,27 @@ class DepsSolver(object):
                 dep_projects.append(dep_project)
         return dep_projects
 
+    def get_reverse_dep_projects(self, projects, dep_types):
+        """ Get the projects depending on the list of projects,
+        directly or not
+
+        :param: dep_types A list of dependencies types
+                (``["build"]``, ``["runtime", "test"]``, etc.)
+        :return: a list of projects in the build worktree, including
+                 the given projects
+
+        """
+        res = list(projects)
+        names = set(x.name for x in projects)
+        to_visit = projects
+        while to_visit:
+            reverse_deps = self.get_dep_projects(to_visit, dep_types,
+                                                 reverse=True)
+            to_visit = [x for x in reverse_deps if x.name not in names]
+            names.update(x.name for x in to_visit)
+            res.extend(to_visit)
+        return res
+
     def get_dep_packages(self, projects, dep_types):
         """ Solve the dependencies of the list of projects
 
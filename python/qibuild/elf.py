@@ -0,0 +1,110 @@
+## Copyright (c) 2012-2016 Aldebaran Robotics. All rights reserved.
+## Use of this source code is governed by a BSD-style license that can be
+## found in the COPYING file.
+
+""" Read the section headers of ELF files, without calling
+external tools such as ``objdump`` or ``readelf``
+
+"""
+
+import collections
+import struct
+
+ELF_MAGIC = "\x7fELF"
+ELFCLASS32 = 1
+ELFCLASS64 = 2
+ELFDATA2LSB = 1
+ELFDATA2MSB = 2
+SHT_NOBITS = 8
+NT_GNU_BUILD_ID = 3
+
+Section = collections.namedtuple("Section", ["name", "type", "offset", "size"])
+
+def read_sections(filename):
+    """ Return the list of the sections of the ELF file,
+    or None if the file is not a valid ELF file
+
+    """
+    with open(filename, "rb") as fp:
+        try:
+            return _read_sections(fp)
+        except (struct.error, IndexError):
+            return None
+
+def _read_sections(fp):
+    ident = fp.read(16)
+    if len(ident) < 16 or ident[:4] != ELF_MAGIC:
+        return None
+    elf_class = ord(ident[4])
+    endian = _get_endian(ident)
+    if elf_class == ELFCLASS64:
+        header_fmt = endian + "HHIQQQIHHHHHH"
+        section_fmt = endian + "IIQQQQIIQQ"
+    elif elf_class == ELFCLASS32:
+        header_fmt = endian + "HHIIIIIHHHHHH"
+        section_fmt = endian + "IIIIIIIIII"
+    else:
+        return None
+    header = struct.unpack(header_fmt, fp.read(struct.calcsize(header_fmt)))
+    sh_offset = header[5]
+    sh_entsize, sh_num, sh_strndx = header[10:13]
+    if not sh_offset or not sh_num:
+        return list()
+    fp.seek(sh_offset)
+    raw_sections = list()
+    for _ in range(sh_num):
+        raw = fp.read(sh_entsize)
+        values = struct.unpack(section_fmt, raw[:struct.calcsize(section_fmt)])
+        # name, type, offset, size
+        raw_sections.append((values[0], values[1], values[4], values[5]))
+    (_, _, names_offset, names_size) = raw_sections[sh_strndx]
+    fp.seek(names_offset)
+    names = fp.read(names_size)
+    res = list()
+    for (name_index, section_type, offset, size) in raw_sections:
+        name = names[name_index:names.find("\0", name_index)]
+        res.append(Section(name, section_type, offset, size))
+    return res
+
+def _get_endian(ident):
+    """ The struct byte order of an ELF file, from its ``EI_DATA`` byte """
+    if ord(ident[5]) == ELFDATA2MSB:
+        return ">"
+    return "<"
+
+def has_section(filename, name):
+    """ Check that the ELF file contains the given section """
+    sections = read_sections(filename) or list()
+    return any(x.name == name for x in sections)
+
+def get_build_id(filename, sections=None):
+    """ Return the GNU build-id of the ELF file, as an hex string,
+    or None if it has no build-id
+
+    ``sections`` is the result of :py:func:`read_sections`, if already known
+
+    """
+    if sections is None:
+        sections = read_sections(filename)
+    if not sections:
+        return None
+    matching = [x for x in sections if x.name == ".note.gnu.build-id"]
+    if not matching or matching[0].type == SHT_NOBITS:
+        return None
+    note = matching[0]
+    with open(filename, "rb") as fp:
+        # The endianness of the note is the one of the file
+        endian = _get_endian(fp.read(16))
+        fp.seek(note.offset)
+        data = fp.read(note.size)
+    if len(data) < 12:
+        return None
+    (name_size, desc_size, note_type) = struct.unpack(endian + "III",
+                                                      data[:12])
+    if note_type != NT_GNU_BUILD_ID:
+        return None
+    desc_start = 12 + ((name_size + 3) / 4) * 4
+    desc = data[desc_start:desc_start + desc_size]
+    if len(desc) != desc_size:
+        return None
+    return desc.encode("hex")
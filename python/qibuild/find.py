@@ -6,12 +6,20 @@
 
 """
 
+import json
 import os
 import platform
+import time
 
+from qisys import ui
 import qisys.error
 import qisys.sh
 
+# A directory modified less than this number of seconds before being
+# listed may be modified again without its mtime changing, so its
+# contents are not trusted
+RACY_DELAY = 2
+
 def find_lib(paths, name, debug=None, expect_one=True, shared=None):
     """ Find a library in a list of paths.
 
@@ -87,6 +95,29 @@ def find_bin(paths, name, debug=None, expect_one=True):
 
     return _filter_candidates(name, candidates, expect_one=expect_one)
 
+def get_binaries(paths):
+    """ Return a dict: binary name -> list of paths, for all the
+    binaries in the ``bin/`` directories of the given paths.
+
+    On Windows, the ``.exe`` and ``_d.exe`` suffixes are removed
+    from the names
+
+    """
+    index = get_index()
+    res = dict()
+    for path in paths:
+        bin_dir = os.path.join(path, "bin")
+        for filename in index.listdir(bin_dir):
+            name = filename
+            if os.name == 'nt':
+                if not filename.endswith(".exe"):
+                    continue
+                name = filename.replace("_d.exe", "").replace(".exe", "")
+            full_path = qisys.sh.to_native_path(os.path.join(bin_dir, filename))
+            res.setdefault(name, list()).append(full_path)
+    index.save()
+    return res
+
 def find(paths, name, debug=True, expect_one=True):
     """ Search a binary or a library given its name
 
@@ -162,7 +193,9 @@ def _binary_suffix(debug=True, os_name=None):
     return ""
 
 def _filter_candidates(name, candidates, expect_one=True):
-    res = [x for x in candidates if os.path.exists(x)]
+    index = get_index()
+    res = [x for x in candidates if index.exists(x)]
+    index.save()
     res = [qisys.sh.to_native_path(x) for x in res]
     if not expect_one:
         return res
@@ -173,6 +206,101 @@ def _filter_candidates(name, candidates, expect_one=True):
     return res[0]
 
 
+class DirectoryIndex(object):
+    """ Remember the contents of the ``bin/`` and ``lib/`` directories,
+    so that looking for a binary or a library does not require to
+    stat every candidate path.
+
+    A directory is listed again only when its mtime changes.
+    The index is stored in the qibuild cache, so that it is shared
+    by all the qibuild commands
+
+    """
+    def __init__(self, path=None):
+        if path is None:
+            path = qisys.sh.get_cache_path("qi", "find-index.json")
+        self.path = path
+        # directory -> (mtime, list time, set of names)
+        self._dirs = dict()
+        self._dirty = False
+        self._load()
+
+    def _load(self):
+        try:
+            with open(self.path, "r") as fp:
+                data = json.load(fp)
+        except (IOError, OSError, ValueError):
+            return
+        for (directory, (mtime, list_time, names)) in data.iteritems():
+            self._dirs[directory] = (mtime, list_time, set(names))
+
+    def save(self):
+        """ Write the index, if it changed """
+        if not self._dirty:
+            return
+        data = dict()
+        for (directory, (mtime, list_time, names)) in self._dirs.iteritems():
+            data[directory] = (mtime, list_time, sorted(names))
+        # Write then rename, so that concurrent qibuild commands
+        # never read a partial index
+        tmp_path = "%s.%i.tmp" % (self.path, os.getpid())
+        try:
+            with open(tmp_path, "w") as fp:
+                json.dump(data, fp)
+            if os.name == 'nt' and os.path.exists(self.path):
+                os.remove(self.path)
+            os.rename(tmp_path, self.path)
+        except (IOError, OSError) as e:
+            ui.debug("Could not write", self.path, ":", e)
+            return
+        self._dirty = False
+
+    def listdir(self, directory):
+        """ Return the names of the entries of the directory,
+        or an empty set if it does not exist
+
+        """
+        directory = os.path.abspath(directory)
+        try:
+            mtime = os.stat(directory).st_mtime
+        except OSError:
+            if self._dirs.pop(directory, None):
+                self._dirty = True
+            return set()
+        cached = self._dirs.get(directory)
+        if cached:
+            (cached_mtime, list_time, names) = cached
+            if cached_mtime == mtime and list_time - mtime > RACY_DELAY:
+                return names
+        list_time = time.time()
+        try:
+            names = set(os.listdir(directory))
+        except OSError:
+            names = set()
+        self._dirs[directory] = (mtime, list_time, names)
+        self._dirty = True
+        return names
+
+    def exists(self, path):
+        """ Same as ``os.path.exists``, using the index """
+        (directory, name) = os.path.split(path)
+        return name in self.listdir(directory)
+
+
+_INDEX = None
+
+def get_index():
+    """ Get the :py:class:`DirectoryIndex` shared by the
+    functions of this module
+
+    """
+    global _INDEX
+    path = qisys.sh.get_cache_path("qi", "find-index.json")
+    if _INDEX is None or _INDEX.path != path:
+        _INDEX = DirectoryIndex(path=path)
+    return _INDEX
+
+
 class NotFound(qisys.error.Error):
     def __init__(self, name):
         self.name = name
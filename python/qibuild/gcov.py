@@ -2,38 +2,214 @@
 ## Use of this source code is governed by a BSD-style license that can be
 ## found in the COPYING file.
 
+""" Generate coverage reports with ``gcovr``
+
+With ``gcovr >= 4.2``, the ``.gcda`` files of each project are only read
+once, to generate a JSON report from which the XML and HTML reports
+are rendered. The JSON reports of several projects can also be merged
+into a single report.
+
+"""
+
+import json
 import os
+import re
+import threading
+
 import qisys
+import qisys.command
+import qisys.cpu
+import qisys.parallel
+import qisys.sh
 from qisys import ui
 
-def generate_coverage_reports(project, output_dir=None, exclude_patterns=None):
+FORMATS = [("xml", ["--xml"]),
+           ("html", ["--html", "--html-details"])]
+DEFAULT_EXCLUDE_PATTERNS = [".*test.*", ".*external*", ".*example.*"]
+MERGED_REPORT_NAME = "coverage"
+
+_GCOVR_VERSION = dict()
+
+def get_gcovr_version():
+    """ Return the version of ``gcovr`` as a tuple of ints,
+    or None if it could not be found
+
+    """
+    gcovr = qisys.command.find_program("gcovr")
+    if not gcovr:
+        return None
+    if gcovr not in _GCOVR_VERSION:
+        version = None
+        try:
+            out = qisys.command.check_output([gcovr, "--version"])
+            match = re.search(r"gcovr\s+(\d+(?:\.\d+)*)", out)
+            if match:
+                version = tuple(int(x) for x in match.group(1).split("."))
+        except qisys.command.CommandFailedException:
+            pass
+        _GCOVR_VERSION[gcovr] = version
+    return _GCOVR_VERSION[gcovr]
+
+def supports_json():
+    """ Whether ``gcovr`` can write and read JSON reports """
+    version = get_gcovr_version()
+    return version is not None and version >= (4, 2)
+
+def generate_coverage_reports(project, output_dir=None, exclude_patterns=None,
+                              clean=True):
     """ Generate XML and HTML coverage reports
+
+    Return the path to the JSON report, or None if ``gcovr`` is too
+    old to generate one
+
     """
     outdir = output_dir or os.path.join(project.sdk_directory, "coverage-results")
-    sdir = project.path
-    # Make sure output dir exists and is empty:
-    qisys.sh.rm(outdir)
+    if clean:
+        # Make sure output dir exists and is empty:
+        qisys.sh.rm(outdir)
     qisys.sh.mkdir(outdir, recursive=True)
-    formats = {"xml": ["--xml"],
-               "html": ["--html", "--html-details"]}
     if exclude_patterns is None:
-        exclude_patterns = [".*test.*", ".*external*", ".*example.*"]
-    exclude_args = list()
+        exclude_patterns = DEFAULT_EXCLUDE_PATTERNS
+    if not supports_json():
+        _generate_reports_from_gcda(project, outdir, exclude_patterns)
+        return None
+    json_report = collect_coverage(project, outdir,
+                                   exclude_patterns=exclude_patterns)
+    render_reports([json_report], project.path, outdir, project.name)
+    return json_report
+
+def collect_coverage(project, output_dir, exclude_patterns=None):
+    """ Read the ``.gcda`` files of the project, and write
+    ``<project>.json`` in the output directory
+
+    """
+    if exclude_patterns is None:
+        exclude_patterns = DEFAULT_EXCLUDE_PATTERNS
+    json_report = os.path.join(output_dir, project.name + ".json")
+    cmd = _get_gcovr_cmd(project, exclude_patterns)
+    cmd += ["--json", "--output", json_report]
+    qisys.command.call(cmd, cwd=project.path, quiet=True)
+    return json_report
+
+def render_reports(json_reports, root, output_dir, name):
+    """ Render the XML and HTML reports from the given JSON reports.
+    Both formats are rendered at the same time
+
+    """
+    def render(fmt_opts):
+        (fmt, opts) = fmt_opts
+        cmd = ["gcovr", "--root", root]
+        for json_report in json_reports:
+            cmd += ["--add-tracefile", json_report]
+        cmd += opts
+        base_report = os.path.join(output_dir, name + "." + fmt)
+        cmd += ["--output", base_report]
+        qisys.command.call(cmd, cwd=root, quiet=True)
+        ui.info(ui.green, "*", ui.reset, "Generated", fmt.upper(),
+                "coverage report in", ui.reset, ui.bold, base_report)
+    _run_in_parallel(FORMATS, render)
+
+def merge_reports(json_reports, root, output_dir, name=MERGED_REPORT_NAME):
+    """ Render a single XML and HTML report from the JSON reports
+    of several projects.
+
+    The paths in each JSON report are relative to the project, so
+    they are first rewritten to be relative to ``root``
+
+    """
+    merge_dir = os.path.join(output_dir, "merge")
+    qisys.sh.rm(merge_dir)
+    qisys.sh.mkdir(merge_dir, recursive=True)
+    to_merge = list()
+    for (project_path, json_report) in json_reports:
+        prefix = os.path.relpath(project_path, root)
+        relocated = os.path.join(merge_dir, os.path.basename(json_report))
+        relocate_json_report(json_report, prefix, relocated)
+        to_merge.append(relocated)
+    render_reports(to_merge, root, output_dir, name)
 
+def relocate_json_report(json_report, prefix, dest):
+    """ Prepend ``prefix`` to the path of each file of a
+    ``gcovr`` JSON report
+
+    """
+    with open(json_report, "r") as fp:
+        data = json.load(fp)
+    for file_data in data.get("files", list()):
+        path = os.path.join(prefix, file_data["file"])
+        file_data["file"] = qisys.sh.to_posix_path(os.path.normpath(path))
+    with open(dest, "w") as fp:
+        json.dump(data, fp)
+
+def generate_projects_coverage_reports(projects, output_dir=None,
+                                       exclude_patterns=None, merge=False,
+                                       root=None, num_jobs=None):
+    """ Generate the coverage reports of several projects in parallel,
+    using one job per CPU by default.
+
+    When ``merge`` is True, also generate a report for all the projects
+    in ``output_dir``, named ``coverage.xml`` and ``coverage.html``.
+    ``root`` is then the common root of the projects (usually the
+    root of the worktree)
+
+    """
+    if output_dir:
+        qisys.sh.rm(output_dir)
+        qisys.sh.mkdir(output_dir, recursive=True)
+    if num_jobs is None:
+        num_jobs = qisys.cpu.cpu_count()
+    json_reports = list()
+    def generate(project):
+        json_report = generate_coverage_reports(
+            project, output_dir=output_dir,
+            exclude_patterns=exclude_patterns, clean=not output_dir)
+        if json_report:
+            json_reports.append((project.path, json_report))
+    _run_in_parallel(projects, generate, num_jobs=num_jobs)
+    if not merge:
+        return
+    if not supports_json():
+        ui.warning("Merging coverage reports requires gcovr >= 4.2")
+        return
+    if not output_dir:
+        output_dir = os.path.join(root, ".qi", "coverage-results")
+        qisys.sh.mkdir(output_dir, recursive=True)
+    json_reports.sort()
+    merge_reports(json_reports, root, output_dir)
+
+def _get_gcovr_cmd(project, exclude_patterns):
+    cmd = ["gcovr", "--root", project.path]
+    # Add the build dir as argument for gcovr to find the .gcda files
+    # even when using out-of-worktree builds:
+    cmd.append(project.build_directory)
     for exclude_pattern in exclude_patterns:
-        exclude_args.extend(["--exclude", exclude_pattern])
-
-    for fmt, opts in formats.iteritems():
-        cmd = ["gcovr",
-                "--root", sdir,
-        ]
-        # Add the build dir as argument for gcovr to find the .gcda files
-        # even when using out-of-worktree builds:
-        cmd.append(project.build_directory)
-        cmd += exclude_args
+        cmd.extend(["--exclude", exclude_pattern])
+    return cmd
+
+def _generate_reports_from_gcda(project, outdir, exclude_patterns):
+    """ For ``gcovr < 4.2``: run ``gcovr`` once per format """
+    for fmt, opts in FORMATS:
+        cmd = _get_gcovr_cmd(project, exclude_patterns)
         cmd += opts
         base_report = os.path.join(outdir, project.name + "." + fmt)
         cmd += ["--output", base_report]
-        qisys.command.call(cmd, cwd=sdir, quiet=True)
+        qisys.command.call(cmd, cwd=project.path, quiet=True)
         ui.info(ui.green, "*", ui.reset, "Generated", fmt.upper(),
                 "coverage report in", ui.reset, ui.bold, base_report)
+
+def _run_in_parallel(items, function, num_jobs=0):
+    errors = list()
+    lock = threading.Lock()
+    def run_one(item):
+        if errors:
+            return
+        try:
+            function(item)
+        except Exception as e:
+            with lock:
+                errors.append(e)
+    if num_jobs:
+        num_jobs = max(1, min(num_jobs, len(items)))
+    qisys.parallel.foreach(items, run_one, n_jobs=num_jobs)
+    if errors:
+        raise errors[0]
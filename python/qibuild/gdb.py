@@ -8,16 +8,26 @@
 
 import os
 import subprocess
+import threading
 
 from qisys import ui
-import qisys.sh
 import qisys.command
+import qisys.cpu
+import qisys.parallel
+import qisys.sh
+import qibuild.elf
 
 
 def contains_debug_info(filename, objdump=None):
     """ Check that an elf contains debug info
 
+    The section headers are read directly, objdump is only
+    used when they cannot be parsed
+
     """
+    sections = qibuild.elf.read_sections(filename)
+    if sections is not None:
+        return any(x.name == ".debug_info" for x in sections)
     if not objdump:
         objdump = "objdump"
     retcode = subprocess.call([objdump, "-j", ".debug_info", "-h", filename],
@@ -35,19 +45,27 @@ def split_debug(src, objcopy=None, objdump=None):
 
     Also uses objcopy so that the binaries and libraries still remain
     usable with gdb
+
+    Nothing is done if the debug information is newer than
+    the binary
     """
     if objcopy is None:
         objcopy = "objcopy"
     if objdump is None:
         objdump = "objdump"
-    if not contains_debug_info(src, objdump=objdump):
-        ui.info("-- Already stripped", src)
-        return
     src_stat = os.stat(src)
     dirname, basename = os.path.split(src)
     debug_dir = os.path.join(dirname, ".debug")
+    debug_file = os.path.join(debug_dir, basename)
+    if os.path.exists(debug_file) and \
+            os.stat(debug_file).st_mtime > src_stat.st_mtime:
+        ui.info("-- Debug info up to date", src)
+        return
+    if not contains_debug_info(src, objdump=objdump):
+        ui.info("-- Already stripped", src)
+        return
     qisys.sh.mkdir(debug_dir)
-    dest = os.path.join(src, debug_dir, basename)
+    dest = debug_file
     to_run = list()
     to_run.append([objcopy, "--only-keep-debug", src, dest])
     to_run.append([objcopy, "--strip-debug", "--strip-unneeded",
@@ -64,6 +82,28 @@ def split_debug(src, objcopy=None, objdump=None):
     # So set back mtime to its previous value:
     os.utime(src, (src_stat.st_atime, src_stat.st_mtime))
 
+def split_debug_files(files, objcopy=None, objdump=None, num_jobs=None):
+    """ Call :py:func:`split_debug` on several files in parallel,
+    using one job per CPU by default
+
+    """
+    if num_jobs is None:
+        num_jobs = qisys.cpu.cpu_count()
+    errors = list()
+    lock = threading.Lock()
+    def split_one(src):
+        if errors:
+            return
+        try:
+            split_debug(src, objcopy=objcopy, objdump=objdump)
+        except Exception as e:
+            with lock:
+                errors.append(e)
+    num_jobs = max(1, min(num_jobs, len(files)))
+    qisys.parallel.foreach(files, split_one, n_jobs=num_jobs)
+    if errors:
+        raise errors[0]
+
 
 if __name__ == "__main__":
     import sys
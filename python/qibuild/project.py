@@ -13,6 +13,7 @@ from xml.etree import ElementTree as etree
 
 from qisys import ui
 import qisys.command
+import qisys.cpu
 import qisys.error
 import qisys.parsers
 import qisys.sh
@@ -339,8 +340,15 @@ set(QIBUILD_PYTHON_PATH "%s" CACHE STRING "" FORCE)
                 return True
 
     def generate_qitest_json(self):
-        """ The qitest.cmake is written from CMake """
+        """ The qitest.cmake is written from CMake.
+
+        Nothing is done if qitest.json is more recent than qitest.cmake
+
+        """
         qitest_cmake_path = os.path.join(self.build_directory, "qitest.cmake")
+        if os.path.exists(qitest_cmake_path) and os.path.exists(self.qitest_json):
+            if os.path.getmtime(self.qitest_json) > os.path.getmtime(qitest_cmake_path):
+                return
         tests = list()
         if os.path.exists(qitest_cmake_path):
             with open(qitest_cmake_path, "r") as fp:
@@ -435,6 +443,10 @@ set(QIBUILD_PYTHON_PATH "%s" CACHE STRING "" FORCE)
             # By default, use the "good" number just like Ninja
             if "Visual Studio" in cmake_generator:
                 return ["/maxcpucount"]
+            # Ninja uses all the CPUs of the machine, even when
+            # running in a container with a CPU quota
+            if "Ninja" in cmake_generator and qisys.cpu.has_cpu_limits():
+                return ["-j", str(qisys.cpu.cpu_count())]
             return list()
         if "Unix Makefiles" in cmake_generator or \
             "Ninja" in cmake_generator:
@@ -472,14 +484,28 @@ set(QIBUILD_PYTHON_PATH "%s" CACHE STRING "" FORCE)
         installed = list()
         if components is None:
             components = list()
+        destdir = qisys.sh.to_native_path(destdir)
+        self.prepare_install(destdir, prefix=prefix)
+        if components:
+            for component in components:
+                files = self.install_component(destdir, component)
+                installed.extend(files)
+        else:
+            installed.extend(self.install_component(destdir, None))
+        self.finish_install(destdir, installed, components=components,
+                            split_debug=split_debug)
+        return installed
+
+    def prepare_install(self, destdir, prefix="/"):
+        """ Make sure ``CMAKE_INSTALL_PREFIX`` is correct, and
+        that everything is ready to call :py:meth:`install_component`
+
+        """
         # DESTDIR=/tmp/foo and CMAKE_PREFIX="/usr/local" means
         # dest = /tmp/foo/usr/local
         destdir = qisys.sh.to_native_path(destdir)
         build_env = self.build_env.copy()
         build_env["DESTDIR"] = destdir
-        # Must make sure prefix is not seen as an absolute path here:
-        dest = os.path.join(destdir, prefix[1:])
-        dest = qisys.sh.to_native_path(dest)
 
         cprefix = qibuild.cmake.get_cached_var(self.build_directory,
                                                "CMAKE_INSTALL_PREFIX")
@@ -496,22 +522,54 @@ set(QIBUILD_PYTHON_PATH "%s" CACHE STRING "" FORCE)
         # Hack for http://www.cmake.org/Bug/print_bug_page.php?bug_id=13934
         if "Unix Makefiles" in self.cmake_generator:
             self.build(target="preinstall", env=build_env)
-        if components:
-            for component in components:
-                files = self._install_component(destdir, component)
-                installed.extend(files)
+
+    def install_component(self, destdir, component):
+        """ Install one component of the project (or everything
+        if ``component`` is None), and return the list of the installed
+        files, relative to ``destdir``
+
+        Installing different components of the same project at the same
+        time is fine, as long as :py:meth:`prepare_install` has been called
+
+        """
+        destdir = qisys.sh.to_native_path(destdir)
+        if component:
+            return self._install_component(destdir, component)
+        build_env = self.build_env.copy()
+        build_env["DESTDIR"] = destdir
+        self.build(target="install", env=build_env)
+        return read_install_manifest(self._get_install_manifest_path(None))
+
+    def get_install_manifest(self, component=None):
+        """ The files installed by the last install of the component
+        (or of everything if ``component`` is None), or None
+        if it was never installed
+
+        """
+        manifest_path = self._get_install_manifest_path(component)
+        if not os.path.exists(manifest_path):
+            return None
+        return read_install_manifest(manifest_path)
+
+    def _get_install_manifest_path(self, component):
+        if component:
+            name = "install_manifest_%s.txt" % component
         else:
-            self.build(target="install", env=build_env)
-            manifest_path = os.path.join(self.build_directory, "install_manifest.txt")
-            installed.extend(read_install_manifest(manifest_path))
+            name = "install_manifest.txt"
+        return os.path.join(self.build_directory, name)
+
+    def finish_install(self, destdir, installed, components=None,
+                       split_debug=False):
+        """ Called once all the components have been installed """
+        if components is None:
+            components = list()
+        destdir = qisys.sh.to_native_path(destdir)
         if "test" in components:
             self._install_qitest_json(destdir)
 
         if split_debug:
             self.split_debug(destdir, file_list=installed)
 
-        return installed
-
     def _install_component(self, destdir, component):
         build_env = self.build_env.copy()
         build_env["DESTDIR"] = destdir
@@ -523,7 +581,7 @@ set(QIBUILD_PYTHON_PATH "%s" CACHE STRING "" FORCE)
         ui.debug("Installing", component)
         qisys.command.call(["cmake"] + cmake_args, cwd=self.build_directory,
                             env=build_env)
-        manifest_path = os.path.join(self.build_directory, "install_manifest_%s.txt" % component)
+        manifest_path = self._get_install_manifest_path(component)
         installed = read_install_manifest(manifest_path)
         return installed
 
@@ -596,7 +654,8 @@ set(QIBUILD_PYTHON_PATH "%s" CACHE STRING "" FORCE)
                                                     env=self.build_env)
             tool_paths[name] = tool_path
 
-        missing = [x for x in tool_paths if not tool_paths[x]]
+        # objdump is only used for files qibuild.elf cannot read
+        missing = [x for x in ["objcopy"] if not tool_paths[x]]
         if missing:
             mess  = """\
 Could not split debug symbols from binaries for project {name}.
@@ -605,10 +664,14 @@ The following tools were not found: {missing}\
             mess = mess.format(name=self.name, missing = ", ".join(missing))
             ui.warning(mess)
             return
+        to_split = list()
         for filename in file_list:
             full_path = os.path.join(destdir, filename)
+            if os.path.islink(full_path) or not os.path.isfile(full_path):
+                continue
             if qibuild.breakpad.is_elf(full_path):
-                qibuild.gdb.split_debug(full_path, **tool_paths)
+                to_split.append(full_path)
+        qibuild.gdb.split_debug_files(to_split, **tool_paths)
 
     def get_build_dirs(self, all_configs=False):
         """Return a dictionary containing the build directory list
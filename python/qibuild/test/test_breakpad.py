@@ -4,11 +4,13 @@
 
 import os
 import sys
+import zipfile
 
 import pytest
 
 import qisys.command
 import qibuild.breakpad
+import qibuild.elf
 import qibuild.cmake_builder
 import qibuild.find
 
@@ -50,3 +52,123 @@ def test_is_exe():
     assert qibuild.breakpad.is_exe("foo.exe")
     assert qibuild.breakpad.is_exe("foo.dll")
     assert not qibuild.breakpad.is_exe("foo.lib")
+
+def test_get_binary_format(tmpdir):
+    elf = tmpdir.join("libfoo.so")
+    elf.write("\x7fELF\x02\x01", mode="wb")
+    macho = tmpdir.join("libfoo.dylib")
+    macho.write("\xcf\xfa\xed\xfe", mode="wb")
+    text = tmpdir.join("foo.txt")
+    text.write("foo")
+    assert qibuild.breakpad.get_binary_format(elf.strpath) == "elf"
+    assert qibuild.breakpad.get_binary_format(macho.strpath) == "macho"
+    assert qibuild.breakpad.get_binary_format(text.strpath) is None
+
+def fake_breakpad_tools(tmpdir, monkeypatch):
+    """ Put fake dump_syms and strip in PATH. dump_syms calls
+    are written in dump_syms.log
+
+    """
+    bin_dir = tmpdir.mkdir("bin")
+    dump_syms = bin_dir.join("dump_syms")
+    dump_syms.write("#!/bin/sh\n"
+                    "echo $1 >> %s\n"
+                    "echo MODULE Linux x86_64 ABCD `basename $1`\n"
+                    "echo FILE 0 foo.cpp\n" % tmpdir.join("dump_syms.log"))
+    strip = bin_dir.join("strip")
+    strip.write("#!/bin/sh\necho stripped > $1\n")
+    for script in [dump_syms, strip]:
+        script.chmod(0755)
+    monkeypatch.setenv("PATH", bin_dir.strpath + os.pathsep + os.environ["PATH"])
+    monkeypatch.setattr(qisys.command, "_FIND_PROGRAM_CACHE", dict())
+
+def stage_binaries(base_dir, names):
+    for name in names:
+        base_dir.ensure("lib", name).write("\x7fELF" + name)
+    base_dir.ensure("share", "foo.txt").write("not a binary")
+
+# pylint: disable-msg=E1101
+@pytest.mark.skipif(not sys.platform.startswith("linux"),
+                    reason="only for linux")
+def test_symbols_written_in_archive(tmpdir, monkeypatch):
+    fake_breakpad_tools(tmpdir, monkeypatch)
+    base_dir = tmpdir.mkdir("base")
+    stage_binaries(base_dir, ["libfoo.so", "libbar.so", "baz"])
+    output = tmpdir.join("symbols.zip").strpath
+    qibuild.breakpad.gen_symbol_archive(base_dir=base_dir.strpath,
+                                        output=output, num_workers=2)
+    archive = zipfile.ZipFile(output)
+    assert sorted(archive.namelist()) == [
+        "baz/ABCD/baz.sym",
+        "libbar.so/ABCD/libbar.so.sym",
+        "libfoo.so/ABCD/libfoo.so.sym",
+    ]
+    assert archive.read("baz/ABCD/baz.sym").startswith("MODULE Linux")
+    assert base_dir.join("lib", "libfoo.so").read() == "stripped\n"
+    assert base_dir.join("share", "foo.txt").read() == "not a binary"
+
+# pylint: disable-msg=E1101
+@pytest.mark.skipif(not sys.platform.startswith("linux"),
+                    reason="only for linux")
+def test_no_duplicate_symbols_in_archive(tmpdir, monkeypatch):
+    fake_breakpad_tools(tmpdir, monkeypatch)
+    base_dir = tmpdir.mkdir("base")
+    stage_binaries(base_dir, ["libfoo.so"])
+    base_dir.ensure("lib", "plugins", "libfoo.so").write("\x7fELF other")
+    output = tmpdir.join("symbols.zip").strpath
+    qibuild.breakpad.gen_symbol_archive(base_dir=base_dir.strpath,
+                                        output=output, num_workers=2)
+    archive = zipfile.ZipFile(output)
+    assert archive.namelist() == ["libfoo.so/ABCD/libfoo.so.sym"]
+
+# pylint: disable-msg=E1101
+@pytest.mark.skipif(not sys.platform.startswith("linux"),
+                    reason="only for linux")
+def test_unchanged_binaries_are_not_dumped_again(tmpdir, monkeypatch):
+    fake_breakpad_tools(tmpdir, monkeypatch)
+    dump_log = tmpdir.join("dump_syms.log")
+    base_dir = tmpdir.join("base")
+    output = tmpdir.join("symbols.zip").strpath
+    stage_binaries(base_dir, ["libfoo.so", "libbar.so"])
+    qibuild.breakpad.gen_symbol_archive(base_dir=base_dir.strpath,
+                                        output=output)
+    assert len(dump_log.readlines()) == 2
+
+    dump_log.remove()
+    base_dir.remove()
+    stage_binaries(base_dir, ["libfoo.so", "libbar.so"])
+    base_dir.join("lib", "libbar.so").write("\x7fELF changed")
+    qibuild.breakpad.gen_symbol_archive(base_dir=base_dir.strpath,
+                                        output=output)
+    assert dump_log.readlines() == [base_dir.join("lib", "libbar.so").strpath + "\n"]
+    archive = zipfile.ZipFile(output)
+    assert sorted(archive.namelist()) == [
+        "libbar.so/ABCD/libbar.so.sym",
+        "libfoo.so/ABCD/libfoo.so.sym",
+    ]
+
+def test_symbol_cache_key_depends_on_debug_info(tmpdir, monkeypatch):
+    cache = qibuild.breakpad.SymbolCache(path=tmpdir.join("cache").strpath)
+    binary = tmpdir.join("libfoo.so")
+    binary.write("\x7fELF")
+    sections = list()
+    monkeypatch.setattr(qibuild.elf, "read_sections", lambda x: sections)
+    monkeypatch.setattr(qibuild.elf, "get_build_id",
+                        lambda x, sections=None: "deadbeef")
+    stripped_key = cache.get_key(binary.strpath)
+    sections.append(qibuild.elf.Section(".debug_info", 1, 0, 0))
+    assert cache.get_key(binary.strpath) != stripped_key
+
+def test_symbol_cache_trim(tmpdir):
+    cache = qibuild.breakpad.SymbolCache(path=tmpdir.join("cache").strpath,
+                                         max_size=25)
+    for i, key in enumerate(["aa01", "bb02", "cc03"]):
+        cache.put(key, "x" * 10)
+        sym_path = cache._get_path(key)
+        os.utime(sym_path, (i, i))
+    # Mark the first one as used
+    assert cache.get("aa01") == "x" * 10
+    cache.trim()
+    assert cache.get("aa01")
+    assert cache.get("bb02") is None
+    assert cache.get("cc03")
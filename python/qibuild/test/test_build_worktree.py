@@ -102,6 +102,38 @@ def test_get_env(toolchains, cd_to_tmpdir):
                 os.path.join(bar_package.path, "lib"))
         assert env["DYLD_FRAMEWORK_PATH"] == bar_package.path
 
+def test_get_env_is_cached(toolchains, cd_to_tmpdir, monkeypatch):
+    toolchains.create("foo")
+    qibuild.config.add_build_config("foo", toolchain="foo")
+    build_worktree = TestBuildWorkTree()
+    build_worktree.set_active_config("foo")
+    world_proj = build_worktree.create_project("world")
+    env = build_worktree.get_env()
+    env["SPAM"] = "eggs"
+    calls = list()
+    compute_env = build_worktree._compute_env
+    def counting_compute_env():
+        calls.append(True)
+        return compute_env()
+    monkeypatch.setattr(build_worktree, "_compute_env", counting_compute_env)
+    env = build_worktree.get_env()
+    assert "SPAM" not in env
+    assert not calls
+    monkeypatch.setenv("QIBUILD_TEST_VAR", "42")
+    assert build_worktree.get_env()["QIBUILD_TEST_VAR"] == "42"
+    assert not calls
+
+    # Adding a project or a package invalidates the cache
+    build_worktree.create_project("hello")
+    build_worktree.get_env()
+    assert len(calls) == 1
+    bar_package = toolchains.add_package("foo", "bar")
+    build_worktree.toolchain.add_package(bar_package)
+    env = build_worktree.get_env()
+    assert len(calls) == 2
+    if sys.platform.startswith("linux"):
+        assert os.path.join(bar_package.path, "lib") in env["LD_LIBRARY_PATH"]
+
 def test_set_pythonhome(toolchains, cd_to_tmpdir):
     toolchains.create("foo")
     qibuild.config.add_build_config("foo", toolchain="foo")
@@ -106,3 +106,56 @@ def test_setting_loose_deps_resolution_from_manifest(git_server, qisrc_action):
     build_worktree = TestBuildWorkTree()
     cmake_builder = qibuild.cmake_builder.CMakeBuilder(build_worktree)
     assert cmake_builder.loose_deps_resolution == True
+
+def make_install_job(calls, name, files, expected="same"):
+    def job():
+        calls.append(name)
+        return files
+    if expected == "same":
+        expected = files
+    return (name, job, expected)
+
+def test_install_in_parallel_serializes_conflicting_jobs():
+    calls = list()
+    jobs = [make_install_job(calls, "a", ["lib/liba.so", "include/foo.h"]),
+            make_install_job(calls, "b", ["lib/libb.so", "share/qi/path.conf"]),
+            make_install_job(calls, "c", ["lib/libc.so", "share/qi/path.conf"]),
+            make_install_job(calls, "d", ["lib/libd.so", "include/foo.h"])]
+    results = qibuild.cmake_builder.install_in_parallel(jobs, num_jobs=4)
+    assert results == [x[2] for x in jobs]
+    # path.conf is not a conflict, a and d are run last, in order
+    assert sorted(calls[:2]) == ["b", "c"]
+    assert calls[2:] == ["a", "d"]
+
+def test_install_in_parallel_no_conflicts(record_messages):
+    calls = list()
+    jobs = [make_install_job(calls, "a", ["lib/liba.so", "share/qi/path.conf"]),
+            make_install_job(calls, "b", ["lib/libb.so", "share/qi/path.conf"])]
+    qibuild.cmake_builder.install_in_parallel(jobs, num_jobs=2)
+    assert sorted(calls) == ["a", "b"]
+    assert not record_messages.find("more than once")
+
+def test_install_in_parallel_unexpected_conflicts(tmpdir):
+    calls = list()
+    tmpdir.ensure("lib", "libfoo.so").write("torn")
+    tmpdir.ensure("lib", "liba.so").write("a")
+    jobs = [make_install_job(calls, "a", ["lib/liba.so", "lib/libfoo.so"],
+                             expected=None),
+            make_install_job(calls, "b", ["lib/libfoo.so"], expected=None),
+            make_install_job(calls, "c", ["lib/libc.so"], expected=None)]
+    qibuild.cmake_builder.install_in_parallel(jobs, num_jobs=3,
+                                              dest_dir=tmpdir.strpath)
+    # Only the last job installing libfoo.so is run again, after
+    # removing libfoo.so
+    assert sorted(calls[:3]) == ["a", "b", "c"]
+    assert calls[3:] == ["b"]
+    assert not tmpdir.join("lib", "libfoo.so").check()
+    assert tmpdir.join("lib", "liba.so").check()
+
+def test_install_in_parallel_errors():
+    def failing():
+        raise qisys.error.Error("install failed")
+    jobs = [("ok", list, list()), ("failing", failing, None)]
+    with pytest.raises(qisys.error.Error) as e:
+        qibuild.cmake_builder.install_in_parallel(jobs, num_jobs=2)
+    assert "install failed" in str(e.value)
@@ -6,6 +6,7 @@
 
 """
 
+import json
 import os
 
 import qisys.command
@@ -81,3 +82,52 @@ def test_custom_build_prefix(qibuild_action, qitest_action):
     xml_path = os.path.join(coverme_project.sdk_directory,
                             "coverage-results", "coverme.xml")
     check_cov_xml(xml_path)
+
+
+class FakeGcovr(object):
+    """ Record the calls to gcovr, and write the reports """
+    def __init__(self):
+        self.calls = list()
+
+    def __call__(self, cmd, **kwargs):
+        self.calls.append(cmd)
+        output = cmd[cmd.index("--output") + 1]
+        if "--json" in cmd:
+            data = {"files": [{"file": "src/foo.cpp", "lines": list()}]}
+            with open(output, "w") as fp:
+                json.dump(data, fp)
+        else:
+            with open(output, "w") as fp:
+                fp.write("report\n")
+
+def test_gcda_files_read_once_per_project(build_worktree, monkeypatch, tmpdir):
+    monkeypatch.setattr(qibuild.gcov, "get_gcovr_version", lambda: (5, 0))
+    fake_gcovr = FakeGcovr()
+    monkeypatch.setattr(qisys.command, "call", fake_gcovr)
+    world = build_worktree.create_project("world")
+    hello = build_worktree.create_project("hello", build_depends=["world"])
+    output_dir = tmpdir.join("out")
+    qibuild.gcov.generate_projects_coverage_reports(
+        [world, hello], output_dir=output_dir.strpath, merge=True,
+        root=build_worktree.root)
+    json_calls = [x for x in fake_gcovr.calls if "--json" in x]
+    assert len(json_calls) == 2
+    # XML and HTML are rendered from the JSON reports
+    render_calls = [x for x in fake_gcovr.calls if "--json" not in x]
+    assert len(render_calls) == 6
+    assert all("--add-tracefile" in x for x in render_calls)
+    for name in ["world", "hello", "coverage"]:
+        assert output_dir.join(name + ".xml").check(file=True)
+        assert output_dir.join(name + ".html").check(file=True)
+    # Paths in the merged report are relative to the worktree
+    merged = output_dir.join("merge", "hello.json").read()
+    assert json.loads(merged)["files"][0]["file"] == "hello/src/foo.cpp"
+
+def test_old_gcovr(build_worktree, monkeypatch):
+    monkeypatch.setattr(qibuild.gcov, "get_gcovr_version", lambda: (3, 2))
+    fake_gcovr = FakeGcovr()
+    monkeypatch.setattr(qisys.command, "call", fake_gcovr)
+    world = build_worktree.create_project("world")
+    assert qibuild.gcov.generate_coverage_reports(world) is None
+    assert len(fake_gcovr.calls) == 2
+    assert not any("--json" in x for x in fake_gcovr.calls)
@@ -134,6 +134,20 @@ def test_complex_reverse_deps(build_worktree):
         reverse=True) == [hello, libhello]
 
 
+def test_transitive_reverse_deps(build_worktree):
+    libworld = build_worktree.create_project("libworld")
+    libhello = build_worktree.create_project("libhello", build_depends=["libworld"])
+    hello = build_worktree.create_project("hello", run_depends=["libhello"])
+    hello_test = build_worktree.create_project("hello-test", test_depends=["hello"])
+    other = build_worktree.create_project("other")
+    deps_solver = DepsSolver(build_worktree)
+    assert deps_solver.get_reverse_dep_projects([libworld], ["build"]) == \
+        [libworld, libhello]
+    assert deps_solver.get_reverse_dep_projects([libworld],
+        ["build", "runtime", "test"]) == [libworld, libhello, hello, hello_test]
+    assert deps_solver.get_reverse_dep_projects([other],
+        ["build", "runtime", "test"]) == [other]
+
 def test_read_host_deps(build_worktree):
     footool_proj = build_worktree.add_test_project("footool")
     usefootool_proj = build_worktree.add_test_project("usefootool")
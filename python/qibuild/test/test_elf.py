@@ -0,0 +1,71 @@
+## Copyright (c) 2012-2016 Aldebaran Robotics. All rights reserved.
+## Use of this source code is governed by a BSD-style license that can be
+## found in the COPYING file.
+
+import struct
+import subprocess
+
+import pytest
+
+import qisys.command
+import qibuild.elf
+
+def build_exe(tmpdir, *flags):
+    src = tmpdir.join("main.c")
+    src.write("int main() { return 0; }\n")
+    exe = tmpdir.join("main").strpath
+    subprocess.check_call(["gcc", "-o", exe, src.strpath] + list(flags))
+    return exe
+
+# pylint: disable-msg=E1101
+@pytest.mark.skipif(not qisys.command.find_program("gcc"),
+                    reason="gcc not found")
+def test_build_id(tmpdir):
+    exe = build_exe(tmpdir, "-Wl,--build-id=0xdeadbeef")
+    assert qibuild.elf.get_build_id(exe) == "deadbeef"
+    assert qibuild.elf.has_section(exe, ".text")
+
+# pylint: disable-msg=E1101
+@pytest.mark.skipif(not qisys.command.find_program("gcc"),
+                    reason="gcc not found")
+def test_debug_sections(tmpdir):
+    exe = build_exe(tmpdir, "-g")
+    assert qibuild.elf.has_section(exe, ".debug_info")
+    exe = build_exe(tmpdir)
+    assert not qibuild.elf.has_section(exe, ".debug_info")
+
+def test_not_an_elf(tmpdir):
+    not_elf = tmpdir.join("foo.txt")
+    not_elf.write("foo")
+    assert qibuild.elf.read_sections(not_elf.strpath) is None
+    assert qibuild.elf.get_build_id(not_elf.strpath) is None
+    truncated = tmpdir.join("truncated")
+    truncated.write("\x7fELF\x02\x01\x01")
+    assert qibuild.elf.read_sections(truncated.strpath) is None
+
+def make_elf(path, endian):
+    """ Write a minimal 64 bits ELF file with a build-id note """
+    data = {"<" : qibuild.elf.ELFDATA2LSB, ">" : qibuild.elf.ELFDATA2MSB}[endian]
+    ident = "\x7fELF" + chr(qibuild.elf.ELFCLASS64) + chr(data) + "\x01"
+    ident += "\0" * (16 - len(ident))
+    note = struct.pack(endian + "III", 4, 4, qibuild.elf.NT_GNU_BUILD_ID)
+    note += "GNU\0" + "\xde\xad\xbe\xef"
+    names = "\0.note.gnu.build-id\0.shstrtab\0"
+    note_offset = 64
+    names_offset = note_offset + len(note)
+    sections_offset = names_offset + len(names)
+    header = struct.pack(endian + "HHIQQQIHHHHHH", 2, 62, 1, 0, 0,
+                         sections_offset, 0, 64, 0, 0, 64, 3, 2)
+    sections = struct.pack(endian + "IIQQQQIIQQ", *([0] * 10))
+    sections += struct.pack(endian + "IIQQQQIIQQ", 1, 7, 0, 0,
+                            note_offset, len(note), 0, 0, 4, 0)
+    sections += struct.pack(endian + "IIQQQQIIQQ", 20, 3, 0, 0,
+                            names_offset, len(names), 0, 0, 1, 0)
+    with open(path, "wb") as fp:
+        fp.write(ident + header + note + names + sections)
+
+def test_build_id_endianness(tmpdir):
+    for (name, endian) in [("little", "<"), ("big", ">")]:
+        path = tmpdir.join(name).strpath
+        make_elf(path, endian)
+        assert qibuild.elf.get_build_id(path) == "deadbeef"
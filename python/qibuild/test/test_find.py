@@ -56,3 +56,44 @@ def test_expect_one(tmpdir):
 
     res = qibuild.find.find_bin([b_path.strpath], "foo", expect_one=True)
     assert os.path.exists(res)
+
+def test_directory_index(tmpdir, monkeypatch):
+    index_path = tmpdir.join("index.json").strpath
+    bin_dir = tmpdir.mkdir("sdk").mkdir("bin")
+    bin_dir.ensure("foo", file=True)
+    index = qibuild.find.DirectoryIndex(path=index_path)
+    assert index.exists(bin_dir.join("foo").strpath)
+    assert not index.exists(bin_dir.join("bar").strpath)
+    index.save()
+
+    # Old enough directories are not listed again
+    old = os.stat(bin_dir.strpath).st_mtime - 10
+    os.utime(bin_dir.strpath, (old, old))
+    index = qibuild.find.DirectoryIndex(path=index_path)
+    index.listdir(bin_dir.strpath)
+    index.save()
+    listed = list()
+    monkeypatch.setattr(os, "listdir", lambda x: listed.append(x) or list())
+    index = qibuild.find.DirectoryIndex(path=index_path)
+    assert index.listdir(bin_dir.strpath) == set(["foo"])
+    assert not listed
+
+    # But they are when their mtime changes
+    monkeypatch.undo()
+    bin_dir.ensure("bar", file=True)
+    assert index.exists(bin_dir.join("bar").strpath)
+    assert not index.exists(tmpdir.join("nope", "bin", "foo").strpath)
+
+def test_get_binaries(tmpdir):
+    # No point in testing this on other OS, it's the same code
+    if platform.system() != 'Linux':
+        return
+    a_path = tmpdir.mkdir("a")
+    a_path.ensure("bin/foo", file=True)
+    a_path.ensure("bin/bar", file=True)
+    b_path = tmpdir.mkdir("b")
+    b_path.ensure("bin/foo", file=True)
+    binaries = qibuild.find.get_binaries([a_path.strpath, b_path.strpath])
+    assert sorted(binaries) == ["bar", "foo"]
+    assert sorted(binaries["foo"]) == [a_path.join("bin", "foo").strpath,
+                                       b_path.join("bin", "foo").strpath]
@@ -66,6 +66,29 @@ def test_split_debug_install(qibuild_action, tmpdir):
     assert "in foo () at " in out
     assert "main.cpp" in out
 
+# pylint: disable-msg=E1101
+@pytest.mark.skipif(not qisys.command.find_program("gcc") or
+                    not qisys.command.find_program("objcopy"),
+                    reason="gcc or objcopy not found")
+def test_split_debug_files(tmpdir, record_messages):
+    src = tmpdir.join("main.c")
+    src.write("int main() { return 0; }\n")
+    bin_dir = tmpdir.mkdir("bin")
+    binaries = list()
+    for name in ["foo", "bar", "baz"]:
+        binary = bin_dir.join(name).strpath
+        subprocess.check_call(["gcc", "-g", "-o", binary, src.strpath])
+        binaries.append(binary)
+    qibuild.gdb.split_debug_files(binaries, num_jobs=2)
+    for binary in binaries:
+        assert not qibuild.gdb.contains_debug_info(binary)
+        debug_file = bin_dir.join(".debug", os.path.basename(binary)).strpath
+        assert qibuild.gdb.contains_debug_info(debug_file)
+
+    record_messages.reset()
+    qibuild.gdb.split_debug_files(binaries[:1])
+    assert record_messages.find("Debug info up to date")
+
 def test_gdb_not_installed(qibuild_action, tmpdir, record_messages):
     if check_gdb():
         return
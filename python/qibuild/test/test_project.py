@@ -4,10 +4,13 @@
 
 import os
 
+import qisys.cpu
 import qisys.error
 import qisys.qixml
+import qisys.sh
 import qisrc.git
 import qibuild.config
+import qitest.conf
 
 from qisrc.test.conftest import git_server, qisrc_action
 from qibuild.test.conftest import TestBuildWorkTree
@@ -23,7 +26,8 @@ def test_dependencies_cmake(build_worktree):
     # cmake projects, so no other assertions here
     assert os.path.exists(dep_cmake)
 
-def test_parse_num_jobs_happy_path(build_worktree):
+def test_parse_num_jobs_happy_path(build_worktree, monkeypatch):
+    monkeypatch.setattr(qisys.cpu, "has_cpu_limits", lambda: False)
     hello = build_worktree.create_project("hello")
     assert hello.parse_num_jobs(3, cmake_generator="Unix Makefiles") ==  ["-j", "3"]
     assert hello.parse_num_jobs(2, cmake_generator="Ninja") ==  ["-j", "2"]
@@ -31,6 +35,14 @@ def test_parse_num_jobs_happy_path(build_worktree):
     assert hello.parse_num_jobs(None, cmake_generator="Ninja") == list()
     assert hello.parse_num_jobs(1, cmake_generator="Ninja") ==  ["-j", "1"]
 
+def test_parse_num_jobs_with_cpu_limits(build_worktree, monkeypatch):
+    monkeypatch.setattr(qisys.cpu, "has_cpu_limits", lambda: True)
+    monkeypatch.setattr(qisys.cpu, "cpu_count", lambda: 3)
+    hello = build_worktree.create_project("hello")
+    assert hello.parse_num_jobs(None, cmake_generator="Ninja") == ["-j", "3"]
+    assert hello.parse_num_jobs(None, cmake_generator="Unix Makefiles") == list()
+    assert hello.parse_num_jobs(2, cmake_generator="Ninja") == ["-j", "2"]
+
 def test_parse_num_jobs_unsupported_generator(build_worktree):
     hello = build_worktree.create_project("hello")
     # pylint: disable-msg=E1101
@@ -96,3 +108,24 @@ def test_get_host_sdk_dir_system(build_worktree, toolchains, fake_ctc):
     system_sdk_dir = bar_proj.sdk_directory
     build_worktree.set_active_config("fake-ctc")
     assert bar_proj.get_host_sdk_dir() == system_sdk_dir
+
+def test_generate_qitest_json_only_when_needed(build_worktree):
+    bar_proj = build_worktree.create_project("bar")
+    qisys.sh.mkdir(bar_proj.build_directory, recursive=True)
+    qisys.sh.mkdir(bar_proj.sdk_directory, recursive=True)
+    qitest_cmake = os.path.join(bar_proj.build_directory, "qitest.cmake")
+    with open(qitest_cmake, "w") as fp:
+        fp.write("/path/to/foo;--name;foo\n")
+    os.utime(qitest_cmake, (1000, 1000))
+    bar_proj.generate_qitest_json()
+    assert [x["name"] for x in qitest.conf.parse_tests(bar_proj.qitest_json)] == ["foo"]
+    with open(qitest_cmake, "w") as fp:
+        fp.write("/path/to/bar;--name;bar\n")
+    # qitest.cmake older than qitest.json: nothing to do
+    os.utime(qitest_cmake, (1000, 1000))
+    bar_proj.generate_qitest_json()
+    assert [x["name"] for x in qitest.conf.parse_tests(bar_proj.qitest_json)] == ["foo"]
+    os.utime(qitest_cmake, None)
+    os.utime(bar_proj.qitest_json, (1000, 1000))
+    bar_proj.generate_qitest_json()
+    assert [x["name"] for x in qitest.conf.parse_tests(bar_proj.qitest_json)] == ["bar"]
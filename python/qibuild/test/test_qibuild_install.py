@@ -331,3 +331,26 @@ def test_installing_tests(qibuild_action, tmpdir):
     assert not qibuild.find.find_bin([dest.strpath], "test_foo", expect_one=False)
     qibuild_action("install", "--with-tests", "installme", dest.strpath)
     assert qibuild.find.find_bin([dest.strpath], "test_foo", expect_one=True)
+
+def test_parallel_install(qibuild_action, tmpdir, record_messages):
+    qibuild_action.add_test_project("testme")
+    qibuild_action.add_test_project("world")
+    qibuild_action.add_test_project("hello")
+    qibuild_action("configure", "--all")
+    qibuild_action("make", "--all")
+    dest = tmpdir.join("dest")
+    qibuild_action("install", "--all", "--with-tests", "-j", "4", dest.strpath)
+    assert qibuild.find.find_bin([dest.strpath], "hello")
+    tests = qitest.conf.parse_tests(dest.join("qitest.json").strpath)
+    test_names = [x["name"] for x in tests]
+    assert "zero_test" in test_names
+    assert "ok" in test_names
+    # hello installs bin/hello both as a runtime and as a test:
+    # the manifests of the first install are used to predict the conflict,
+    # and share/qi/path.conf installed by every project is not one
+    world_proj = qibuild_action.build_worktree.get_build_project("world")
+    assert "lib/libworld.so" in world_proj.get_install_manifest("runtime")
+    record_messages.reset()
+    qibuild_action("install", "--all", "--with-tests", "-j", "4", dest.strpath)
+    assert record_messages.find(r"installing hello \(\w+\), hello \(\w+\) one after")
+    assert not record_messages.find("were installed more than once")
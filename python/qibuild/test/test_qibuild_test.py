@@ -92,6 +92,17 @@ def test_do_not_overwrite_xml_when_test_fails(qibuild_action):
         contents = fp.read()
     assert contents == "<gtest>FAKE_RESULTS</gtest>\n"
 
+def test_output_written_to_log(qibuild_action):
+    qibuild_action.add_test_project("testme")
+    qibuild_action("configure", "testme")
+    qibuild_action("make", "testme")
+    qibuild_action("test", "testme", "-k", "fail", retcode=True)
+    result_dir = get_result_dir()
+    assert "fail.log" in os.listdir(result_dir)
+    with open(os.path.join(result_dir, "fail.log"), "r") as fp:
+        contents = fp.read()
+    assert contents == "fail\n"
+
 def test_setting_output_dir_with_project(qitest_action, qibuild_action, tmpdir):
     test_out = tmpdir.join("test-out", "testme")
     qibuild_action.add_test_project("testme")
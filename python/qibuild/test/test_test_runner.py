@@ -4,30 +4,60 @@
 
 import qitest.project
 import qisys.command
+import qisys.qixml
 import qibuild.test_runner
 
-from qibuild.test_runner import get_cpu_list
-
-def test_get_cpu_list():
-    # 4 cpus, 2 cpus per test, -j 2:
-    worker_1_opts = get_cpu_list(4, 2, 0)
-    worker_2_opts = get_cpu_list(4, 2, 1)
-
-    assert worker_1_opts == [0, 1]
-    assert worker_2_opts == [2, 3]
-
-    # 2 cpus, 2 cpus per test, -j 2:
-    worker_1_opts = get_cpu_list(2, 2, 0)
-    worker_2_opts = get_cpu_list(2, 2, 1)
-
-    assert worker_1_opts == [0, 1]
-    assert worker_2_opts == [0, 1]
-
-    # 8 cpus, 3 cpus per test, -j 3:
-    worker_1_opts = get_cpu_list(8, 3, 0)
-    worker_2_opts = get_cpu_list(8, 3, 1)
-    worker_3_opts = get_cpu_list(8, 3, 2)
-
-    assert worker_1_opts == [0, 1, 2]
-    assert worker_2_opts == [3, 4, 5]
-    assert worker_3_opts == [6, 7, 0]
+def test_merge_xml_results(tmpdir):
+    shard_0 = tmpdir.join("shard-0.xml")
+    shard_0.write("""\
+<testsuites tests="2" failures="1" disabled="0" errors="0" time="1.5" name="AllTests">
+  <testsuite name="Foo" tests="2" failures="1" disabled="0" errors="0" time="1.5">
+    <testcase name="one" status="run" time="0.5" classname="Foo" />
+    <testcase name="two" status="run" time="1" classname="Foo">
+      <failure message="oops" />
+    </testcase>
+  </testsuite>
+</testsuites>
+""")
+    shard_1 = tmpdir.join("shard-1.xml")
+    shard_1.write("""\
+<testsuites tests="2" failures="0" disabled="1" errors="0" time="2" name="AllTests">
+  <testsuite name="Foo" tests="1" failures="0" disabled="1" errors="0" time="1">
+    <testcase name="three" status="run" time="1" classname="Foo" />
+  </testsuite>
+  <testsuite name="Bar" tests="1" failures="0" disabled="0" errors="0" time="1">
+    <testcase name="four" status="run" time="1" classname="Bar" />
+  </testsuite>
+</testsuites>
+""")
+    merged = tmpdir.join("merged.xml")
+    qibuild.test_runner.merge_xml_results([shard_0.strpath, shard_1.strpath],
+                                          merged.strpath)
+    root = qisys.qixml.read(merged.strpath).getroot()
+    assert root.get("name") == "AllTests"
+    assert root.get("tests") == "4"
+    assert root.get("failures") == "1"
+    assert root.get("disabled") == "1"
+    assert float(root.get("time")) == 3.5
+    test_suites = root.findall("testsuite")
+    assert [x.get("name") for x in test_suites] == ["Foo", "Bar"]
+    assert test_suites[0].get("tests") == "3"
+    names = [x.get("name") for x in test_suites[0].findall("testcase")]
+    assert names == ["one", "two", "three"]
+
+def test_test_env_is_shared(tmpdir):
+    qitest_json = tmpdir.join("qitest.json")
+    qitest_json.write("[]")
+    test_project = qitest.project.TestProject(qitest_json.strpath)
+    test_runner = qibuild.test_runner.ProjectTestRunner(test_project)
+    test_runner.cwd = tmpdir.strpath
+    test_runner.env = {"PATH": "/usr/bin", "FOO": "bar"}
+    launcher = qibuild.test_runner.ProcessTestLauncher(test_runner)
+    first = {"name": "first", "timeout": 1}
+    second = {"name": "second", "timeout": 1}
+    custom = {"name": "custom", "timeout": 1, "environment": {"FOO": "baz"}}
+    for test in [first, second, custom]:
+        launcher._update_test_env(test)
+    assert first["env"] is second["env"]
+    assert first["env"]["FOO"] == "bar"
+    assert custom["env"]["FOO"] == "baz"
@@ -1,13 +1,15 @@
 ## Copyright (c) 2012-2016 Aldebaran Robotics. All rights reserved.
 ## Use of this source code is governed by a BSD-style license that can be
 ## found in the COPYING file.
+import collections
 import datetime
-import multiprocessing
 import os
 import re
+import shutil
 import signal
 import sys
 
+import qisys.cpu
 import qisys.error
 import qisys.sh
 from qisys import ui
@@ -15,6 +17,11 @@ from qisys.qixml import etree
 import qisys.command
 import qitest.conf
 import qitest.runner
+import qitest.test_queue
+
+# Only keep the beginning and the end of the output of the tests
+# in memory, the full output is written in test-results/<name>.log
+MAX_OUTPUT_SIZE = 64 * 1024
 
 
 class ProjectTestRunner(qitest.runner.TestSuiteRunner):
@@ -22,6 +29,8 @@ class ProjectTestRunner(qitest.runner.TestSuiteRunner):
 
     def __init__(self, project):
         super(ProjectTestRunner, self).__init__(project)
+        # The qibuild project the tests come from, if any
+        self.build_project = None
         self._coverage = False
         self._valgrind = False
         self.break_on_failure = False
@@ -106,6 +115,9 @@ class ProcessTestLauncher(qitest.runner.TestLauncher):
         self.project = self.suite_runner.project
         self.verbose = self.suite_runner.verbose
         self.ignore_timeouts = self.suite_runner.ignore_timeouts
+        # The environment of the tests which do not set their own
+        # variables, computed once and shared by all these tests
+        self._base_env = None
         # Make sure output dirs exist and are empty:
         for directory in self.suite_runner.perf_results_dir, \
                          self.suite_runner.test_results_dir:
@@ -120,6 +132,10 @@ class ProcessTestLauncher(qitest.runner.TestLauncher):
         return os.path.join(self.suite_runner.test_results_dir,
                             test["name"] + ".xml")
 
+    def test_log(self, test):
+        return os.path.join(self.suite_runner.test_results_dir,
+                            test["name"] + ".log")
+
     def perf_out(self, test):
         return os.path.join(self.suite_runner.perf_results_dir,
                             test["name"] + ".xml")
@@ -134,13 +150,15 @@ class ProcessTestLauncher(qitest.runner.TestLauncher):
         """
         res = qitest.result.TestResult(test)
         if not test.get("timeout"):
-            test["timeout"] = 20
+            test["timeout"] = qitest.test_queue.DEFAULT_TIMEOUT
         self._update_test(test)
         cmd = test["cmd"]
         timeout = test["timeout"]
         env = test["env"]
         cwd = test["working_directory"]
-        process = qisys.command.Process(cmd, cwd=cwd, env=env, capture=self.capture)
+        process = qisys.command.Process(cmd, cwd=cwd, env=env, capture=self.capture,
+                                        output_file=self.test_log(test),
+                                        max_output_size=MAX_OUTPUT_SIZE)
         start = datetime.datetime.now()
         if self.ignore_timeouts:
             process.run(timeout=None)
@@ -192,6 +210,33 @@ class ProcessTestLauncher(qitest.runner.TestLauncher):
         self._post_run(process, res, test)
         return res
 
+    def merge_shards(self, test, results):
+        """ Implements :py:func:`qitest.runner.TestLauncher.merge_shards`
+
+        Also merge the XML files and the logs of the shards
+        in the XML file and the log of the test
+
+        """
+        res = super(ProcessTestLauncher, self).merge_shards(test, results)
+        shards = [x.test for x in results]
+        test_out = self.test_out(test)
+        try:
+            merge_xml_results([self.test_out(x) for x in shards], test_out)
+        except qisys.error.Error as e:
+            ui.warning("Could not merge test results of %s:" % test["name"], e)
+            self._write_xml(res, test, test_out)
+        if self.capture:
+            with open(self.test_log(test), "wb") as out:
+                for shard in shards:
+                    shard_log = self.test_log(shard)
+                    if os.path.exists(shard_log):
+                        with open(shard_log, "rb") as fp:
+                            shutil.copyfileobj(fp, out)
+                        qisys.sh.rm(shard_log)
+        for shard in shards:
+            qisys.sh.rm(self.test_out(shard))
+        return res
+
     def _update_test(self, test):
         """ Update the test given the settings on the test suite """
         self._update_test_cmd_for_project(test)
@@ -234,10 +279,25 @@ class ProcessTestLauncher(qitest.runner.TestLauncher):
         cmd[0] = executable
 
     def _update_test_env(self, test):
+        test_env = test.get("environment")
+        if test_env:
+            env = self._get_test_env(test_env)
+        else:
+            if self._base_env is None:
+                self._base_env = self._get_test_env(None)
+            # Not modified by qisys.command.Process, so there is no
+            # need to copy it for each test
+            env = self._base_env
+        test["env"] = env
+
+        # Quick hack:
+        gtest_repeat = env.get("GTEST_REPEAT", "1")
+        test["timeout"] = test["timeout"] * int(gtest_repeat)
+
+    def _get_test_env(self, test_env):
         build_env = os.environ.copy()
         if self.suite_runner.env:
             build_env = self.suite_runner.env.copy()
-        test_env = test.get("environment")
         if test_env:
             build_env.update(test_env)
         envsetter = qisys.envsetter.EnvSetter(build_env=build_env)
@@ -251,12 +311,7 @@ class ProcessTestLauncher(qitest.runner.TestLauncher):
             lib_dir = os.path.join(sdk_dir, "lib")
             envsetter.prepend_directory_to_variable(lib_dir, "DYLD_LIBRARY_PATH")
             envsetter.prepend_directory_to_variable(sdk_dir, "DYLD_FRAMEWORK_PATH")
-        env = envsetter.get_build_env()
-        test["env"] =  env
-
-        # Quick hack:
-        gtest_repeat = env.get("GTEST_REPEAT", "1")
-        test["timeout"] = test["timeout"] * int(gtest_repeat)
+        return envsetter.get_build_env()
 
     def _update_test_cwd(self, test):
         cwd = self.suite_runner.cwd
@@ -280,8 +335,8 @@ class ProcessTestLauncher(qitest.runner.TestLauncher):
         test["timeout"] = test["timeout"] * 20
 
     def _with_num_cpus(self, test, num_cpus):
-        cpu_list = get_cpu_list(multiprocessing.cpu_count(),
-                                num_cpus, self.worker_index)
+        cpu_sets = qisys.cpu.get_cpu_sets(num_cpus)
+        cpu_list = cpu_sets[(self.worker_index or 0) % len(cpu_sets)]
         taskset_opts = ["-c", ",".join(str(i) for i in cpu_list)]
         test["cmd"] = ["taskset"] + taskset_opts + test["cmd"]
 
@@ -378,12 +433,47 @@ class ProcessTestLauncher(qitest.runner.TestLauncher):
                 return "[CRASHED] " + qisys.command.str_from_signal(-retcode)
 
 
-def get_cpu_list(total_cpus, num_cpus_per_test, worker_index):
-    cpu_list = list()
-    i = worker_index * num_cpus_per_test
-    cpu_list = range(i, i + num_cpus_per_test)
-    cpu_list = [i % total_cpus for i in cpu_list]
-    return cpu_list
+def merge_xml_results(xml_paths, output):
+    """ Merge JUnit XML files in one, merging the test suites
+    with the same name
+
+    """
+    counters = ["tests", "failures", "disabled", "errors"]
+    root = etree.Element("testsuites")
+    test_suites = collections.OrderedDict()
+    for xml_path in xml_paths:
+        tree = qisys.qixml.read(xml_path)
+        xml_root = tree.getroot()
+        if xml_root.tag == "testsuite":
+            elements = [xml_root]
+        else:
+            elements = xml_root.findall("testsuite")
+        for element in elements:
+            name = element.get("name")
+            test_suite = test_suites.get(name)
+            if test_suite is None:
+                test_suite = etree.SubElement(root, "testsuite")
+                test_suite.attrib.update(element.attrib)
+                test_suites[name] = test_suite
+            else:
+                _add_counters(test_suite, element, counters)
+            test_suite.extend(list(element))
+        if xml_root.tag == "testsuites":
+            for key, value in xml_root.attrib.iteritems():
+                root.attrib.setdefault(key, value)
+    for key in counters + ["time"]:
+        root.set(key, "0")
+    for test_suite in test_suites.values():
+        _add_counters(root, test_suite, counters)
+    qisys.qixml.write(root, output)
+
+def _add_counters(element, other, counters):
+    """ Add the counters and the time of ``other`` to ``element`` """
+    for key in counters:
+        value = int(element.get(key, 0)) + int(other.get(key, 0))
+        element.set(key, str(value))
+    time = float(element.get("time", 0)) + float(other.get("time", 0))
+    element.set("time", str(time))
 
 
 def parse_valgrind(valgrind_log, res):
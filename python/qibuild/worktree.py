@@ -24,6 +24,7 @@ class BuildWorkTree(qisys.worktree.WorkTreeObserver):
         self.root = self.worktree.root
         self.build_config = qibuild.build_config.CMakeBuildConfig(self)
         self.build_projects = list()
+        self._env_cache = dict()
         self._load_build_projects()
         worktree.register(self)
 
@@ -89,14 +90,43 @@ class BuildWorkTree(qisys.worktree.WorkTreeObserver):
         using libraries from the build projects and the toolchain
         packages
 
+        The variables computed from the projects and the packages are
+        cached, and only computed again when the build config, the
+        projects or the toolchain packages change
+
         """
         if extend_os_environ:
             res = os.environ.copy()
         else:
             res = dict()
+        key = self._get_env_key()
+        if key not in self._env_cache:
+            self._env_cache = {key: self._compute_env()}
+        res.update(self._env_cache[key])
+        if os.name == 'nt':
+            res["PATH"] = res["PATH"] + ";" + os.environ["PATH"]
+        return res
+
+    def _get_env_key(self):
+        """ Everything :py:meth:`_compute_env` depends on, apart
+        from the build projects, which invalidate the cache when reloaded
+
+        """
+        toolchain_key = None
+        toolchain = self.toolchain
+        if toolchain:
+            toolchain_key = (toolchain.name,
+                             frozenset((x.name, x.path)
+                                       for x in toolchain.db.packages.itervalues()))
+        return (self.build_config.build_directory(),
+                self.build_config.build_prefix,
+                toolchain_key)
+
+    def _compute_env(self):
+        res = dict()
         if os.name == 'nt':
             dlls_paths = self._get_dll_paths()
-            res["PATH"] = ";".join(dlls_paths) + ";" + os.environ["PATH"]
+            res["PATH"] = ";".join(dlls_paths)
         else:
             lib_paths = self._get_lib_paths()
             if sys.platform.startswith("linux"):
@@ -184,6 +214,7 @@ class BuildWorkTree(qisys.worktree.WorkTreeObserver):
 
         """
         self.build_projects = list()
+        self._env_cache = dict()
         for wt_project in self.worktree.projects:
             build_project = new_build_project(self, wt_project)
             if build_project:
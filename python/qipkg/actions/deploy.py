@@ -5,11 +5,13 @@
 """ Deploy a complete package on the robot. This uses rsync to be fast
 """
 
+import functools
 import os
 
 from qisys import ui
 import qisys.sh
 import qisys.parsers
+import qisys.remote
 import qipkg.parsers
 
 
@@ -26,5 +28,7 @@ def do(args):
     pml_builder = qipkg.parsers.get_pml_builder(args)
     # pylint: disable-msg=E1103
     pml_builder.install(pml_builder.stage_path)
-    for url in urls:
-        pml_builder.deploy(url)
+    deploy_function = functools.partial(pml_builder.deploy,
+                                        checksum=args.checksum)
+    qisys.remote.deploy_to_urls(urls, deploy_function,
+                                num_workers=args.num_workers)
@@ -5,6 +5,7 @@
 
 """
 
+import functools
 import os
 import sys
 import zipfile
@@ -12,6 +13,7 @@ import zipfile
 from qisys import ui
 import qisys.command
 import qisys.parsers
+import qisys.remote
 import qipkg.parsers
 import qipkg.package
 
@@ -34,18 +36,22 @@ def do(args):
     else:
         sys.exit("Please use a .pml or a .pkg as argument")
 
-    for url in urls:
-        deploy(pkg_path, url)
+    qisys.remote.deploy_to_urls(urls, functools.partial(deploy, pkg_path),
+                                num_workers=args.num_workers)
 
-def deploy(pkg_path, url):
+def deploy(pkg_path, url, progress=True):
     ui.info(ui.green, "Deploying",
             ui.reset, ui.blue, pkg_path,
             ui.reset, ui.green, "to",
             ui.reset, ui.blue, url.as_string)
     pkg_name = qipkg.package.name_from_archive(pkg_path)
-    scp_cmd = ["scp",
-                pkg_path,
-                "%s@%s:" % (url.user, url.host)]
+    ssh_options = qisys.remote.get_ssh_options(url.host, user=url.user,
+                                               port=url.port)
+    scp_cmd = ["scp"] + ssh_options
+    if not progress:
+        # Do not mix the progress bars of several deploys
+        scp_cmd.append("-q")
+    scp_cmd += [pkg_path, "%s@%s:" % (url.user, url.host)]
     qisys.command.call(scp_cmd)
 
     try:
@@ -55,7 +61,7 @@ def deploy(pkg_path, url):
         ui.error("Error was: ", e)
         sys.exit(1)
 
-    rm_cmd = ["ssh", "%s@%s" % (url.user, url.host),
+    rm_cmd = ["ssh"] + ssh_options + ["%s@%s" % (url.user, url.host),
                 "rm", os.path.basename(pkg_path)]
     qisys.command.call(rm_cmd)
 
@@ -22,4 +22,6 @@ def do(args):
     with_breakpad = args.with_breakpad
     force = args.force
     pml_builder = qipkg.parsers.get_pml_builder(args)
-    return pml_builder.package(output=output, with_breakpad=with_breakpad, force=force)
+    return pml_builder.package(output=output, with_breakpad=with_breakpad, force=force,
+                               compression_level=args.compression_level,
+                               reproducible=args.reproducible)
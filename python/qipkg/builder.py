@@ -212,11 +212,18 @@ Error when parsing {pml_path}
         pml_translator.install(destination)
 
 
-    def deploy(self, url):
+    def deploy(self, url, checksum=False, progress=True):
         """ Deploy every project to the given url """
-        qisys.remote.deploy(self.stage_path, url)
-
-    def package(self, output=None, with_breakpad=False, force=False):
+        manifest_dir = None
+        if self.worktree:
+            manifest_dir = os.path.join(self.worktree.dot_qi,
+                                        "deploy-manifests",
+                                        os.path.basename(self.stage_path))
+        qisys.remote.deploy(self.stage_path, url, manifest_dir=manifest_dir,
+                            checksum=checksum, progress=progress)
+
+    def package(self, output=None, with_breakpad=False, force=False,
+                compression_level=None, reproducible=False):
         """ Generate a package containing every project.
 
         :param: with_breakpad generate debug symbols for usage
@@ -225,6 +232,11 @@ Error when parsing {pml_path}
         :param: force make package even if it does not satisfy
                                default package requirements
 
+        :param: compression_level zlib compression level of the package
+
+        :param: reproducible use fixed timestamps and permissions in
+                               the package
+
         """
 
         # If the package is not valid, do not go further
@@ -247,7 +259,9 @@ Error when parsing {pml_path}
 
         ui.info(ui.bold, "-> Compressing package ...")
         qisys.archive.compress(self.stage_path, output=output, flat=True,
-                               display_progress=True)
+                               display_progress=True,
+                               compression_level=compression_level,
+                               reproducible=reproducible)
 
         symbols_archive = None
         if with_breakpad and self.build_project:
@@ -48,15 +48,16 @@ class MetaPMLBuilder(object):
                     "Installing", pml_builder.pml_path)
             pml_builder.install(dest)
 
-    def deploy(self, url):
+    def deploy(self, url, checksum=False, progress=True):
         """ Deploy every project to the given url """
         n = len(self.pml_builders)
         for i, pml_builder in enumerate(self.pml_builders):
             ui.info(ui.green, "::", ui.reset, ui.bold, "[%i/%i]" % ((i + 1), n),
                     "Deploying", pml_builder.pml_path)
-            pml_builder.deploy(url)
+            pml_builder.deploy(url, checksum=checksum, progress=progress)
 
-    def package(self, with_breakpad=False, output=None, force=False):
+    def package(self, with_breakpad=False, output=None, force=False,
+                compression_level=None, reproducible=False):
         """ Generate a package containing every package.
 
         :param: with_breakpad generate debug symbols for usage
@@ -68,7 +69,9 @@ class MetaPMLBuilder(object):
         for i, pml_builder in enumerate(self.pml_builders):
             ui.info(ui.green, "::", ui.reset, ui.bold, "[%i/%i]" % ((i + 1), n),
                     "Making package from", pml_builder.pml_path)
-            packages = pml_builder.package(with_breakpad=with_breakpad, force=force)
+            packages = pml_builder.package(with_breakpad=with_breakpad, force=force,
+                                           compression_level=compression_level,
+                                           reproducible=reproducible)
             if isinstance(packages, list):
                 all_packages.extend(packages)
             else:
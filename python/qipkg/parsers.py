@@ -23,7 +23,13 @@ def pml_parser(parser):
 def pkg_parser(parser):
     parser.add_argument("--with-breakpad", action="store_true")
     parser.add_argument("--force", action="store_true")
-    parser.set_defaults(with_breakpad=False, force=False)
+    parser.add_argument("--compression-level", type=int,
+                        help="zlib compression level, from 0 (store only) "
+                             "to 9. Default: 6")
+    parser.add_argument("--reproducible", action="store_true",
+                        help="Use fixed timestamps and permissions, so "
+                             "that the same content gives the same package")
+    parser.set_defaults(with_breakpad=False, force=False, reproducible=False)
 
 def get_pml_builder(args):
     worktree = qisys.parsers.get_worktree(args, raises=False)
@@ -9,8 +9,10 @@ import sys
 import qisys.command
 import qisys.error
 import qisys.qixml
+import qisys.remote
 from qisys.qixml import etree
 import qibuild.find
+import qipkg.actions.deploy_package
 import qipkg.builder
 import qipkg.package
 
@@ -290,3 +292,19 @@ def test_deploy_package_from_pml(qipkg_action, tmpdir, local_url):
 
     expected_path = os.path.expanduser("~/d-0.1.pkg")
     assert os.path.exists(expected_path)
+
+def test_deploy_package_without_progress(tmpdir, monkeypatch):
+    pkg_path = tmpdir.ensure("d-0.1.pkg").strpath
+    calls = list()
+    monkeypatch.setattr(qisys.command, "call", lambda cmd, **kwargs: calls.append(cmd))
+    monkeypatch.setattr(qisys.remote, "get_ssh_options", lambda *a, **k: [])
+    monkeypatch.setattr(qipkg.actions.deploy_package, "_install_package",
+                        lambda *args: None)
+    monkeypatch.setattr(qipkg.package, "name_from_archive", lambda x: "d")
+    url = qisys.remote.URL("john@robot:deployed")
+    qipkg.actions.deploy_package.deploy(pkg_path, url, progress=False)
+    assert calls[0][0] == "scp"
+    assert "-q" in calls[0]
+    calls[:] = list()
+    qipkg.actions.deploy_package.deploy(pkg_path, url, progress=True)
+    assert "-q" not in calls[0]
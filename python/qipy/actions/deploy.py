@@ -26,5 +26,5 @@ def do(args):
     projects = qipy.parsers.get_python_projects(python_worktree, args)
     python_builder.projects = projects
     urls = qisys.parsers.get_deploy_urls(args)
-    for url in urls:
-        python_builder.deploy(url)
+    python_builder.deploy_to_urls(urls, checksum=args.checksum,
+                                  num_workers=args.num_workers)
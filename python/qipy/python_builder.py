@@ -80,10 +80,24 @@ exec python "$@"
             fp.write(to_write)
         os.chmod(python_wrapper, 0755)
 
-    def deploy(self, url):
+    def deploy(self, url, checksum=False):
         """ Deploy scripts, modules and packages to the remote url
 
         """
+        self.deploy_to_urls([url], checksum=checksum)
+
+    def deploy_to_urls(self, urls, checksum=False, num_workers=None):
+        """ Deploy scripts, modules and packages to several remote urls,
+        installing them only once.
+        See :py:func:`qisys.remote.deploy_to_urls`
+
+        """
+        manifest_dir = os.path.join(self.python_worktree.worktree.dot_qi,
+                                    "deploy-manifests", "qipy")
         with qisys.sh.TempDir() as tmp:
             self.install(tmp)
-            qisys.remote.deploy(tmp, url)
+            def deploy_to_url(url, progress=True):
+                qisys.remote.deploy(tmp, url, manifest_dir=manifest_dir,
+                                    checksum=checksum, progress=progress)
+            qisys.remote.deploy_to_urls(urls, deploy_to_url,
+                                        num_workers=num_workers)
@@ -485,6 +485,25 @@ class Git(object):
         return True, "Fast-forwarded %s. Feel free to rebase on %s" % \
                                         ((master_branch.name,) * 2)
 
+    def get_changed_files(self, ref):
+        """ Return the list of the files changed since the given ref,
+        including the changes not committed yet. Untracked files are
+        ignored (build directories are often untracked).
+        Paths are relative to the top of the repository.
+
+        Return None if the ref does not exist
+
+        """
+        rc, _ = self.call("rev-parse", "--verify", "--quiet",
+                          "%s^{commit}" % ref, raises=False)
+        if rc != 0:
+            return None
+        rc, out = self.call("diff", "--name-only", "--no-renames", ref,
+                            raises=False)
+        if rc != 0:
+            return None
+        return sorted(out.splitlines())
+
     def get_log(self, before_ref, after_ref):
         """ Return a list of commits between two refspecs, in
         natural order (most recent commits last)
@@ -15,6 +15,7 @@ import qisrc.git
 import qisys.interact
 import qibuild.config
 import qisys.command
+import qisys.remote
 
 
 def fetch_gerrit_hook_ssh(path, username, server, port=None):
@@ -33,9 +34,10 @@ def fetch_gerrit_hook_ssh(path, username, server, port=None):
     scp = qisys.command.find_program("scp", raises=False)
     if not scp:
         return False, "Could not find scp executable"
-    cmd = [scp, "-P" , str(port),
-        "%s@%s:hooks/commit-msg" % (username, server),
-        git_hooks_dir]
+    cmd = [scp, "-P" , str(port)]
+    cmd.extend(qisys.remote.get_ssh_options(server, user=username, port=port))
+    cmd.extend(["%s@%s:hooks/commit-msg" % (username, server),
+                git_hooks_dir])
     process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
     (out, _) = process.communicate()
     if process.returncode == 0:
@@ -46,9 +48,10 @@ def fetch_gerrit_hook_ssh(path, username, server, port=None):
 
 def check_gerrit_connection(username, server, ssh_port=29418):
     """ Check that the user can connect to gerrit with ssh """
-    cmd = ["ssh", "-p", str(ssh_port),
-        "%s@%s" % (username, server),
-        "gerrit", "version"]
+    cmd = ["ssh", "-p", str(ssh_port)]
+    cmd.extend(qisys.remote.get_ssh_options(server, user=username,
+                                            port=ssh_port))
+    cmd.extend(["%s@%s" % (username, server), "gerrit", "version"])
     try:
         qisys.command.call(cmd, quiet=True)
     except qisys.command.CommandFailedException:
@@ -196,9 +199,10 @@ def set_reviewers(refs, reviewers, username, server, ssh_port):
     :param reviewers: A list of Gerrit reviewers, username or group name,
                       no e-mails
     """
-    cmd = ["ssh", "-p", str(ssh_port),
-    "%s@%s" % (username, server),
-    "gerrit", "set-reviewers"]
+    cmd = ["ssh", "-p", str(ssh_port)]
+    cmd.extend(qisys.remote.get_ssh_options(server, user=username,
+                                            port=ssh_port))
+    cmd.extend(["%s@%s" % (username, server), "gerrit", "set-reviewers"])
     cmd.extend(refs)
     for reviewer in reviewers:
         cmd.append("--add %s" % reviewer)
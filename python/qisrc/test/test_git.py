@@ -69,6 +69,20 @@ def test_changelog(cd_to_tmpdir):
     assert commits[0]["message"] == message_1
     assert commits[1]["message"] == message_2
 
+def test_get_changed_files(cd_to_tmpdir):
+    git = TestGit()
+    git.initialize()
+    git.commit_file("foo.txt", "foo\n")
+    git.commit_file("bar.txt", "bar\n")
+    git.root.ensure("spam", dir=True)
+    git.commit_file("spam/eggs.txt", "eggs\n")
+    assert git.get_changed_files("HEAD") == list()
+    assert git.get_changed_files("HEAD~2") == ["bar.txt", "spam/eggs.txt"]
+    git.write_file("foo.txt", "changed\n")
+    git.write_file("untracked.txt", "untracked\n")
+    assert git.get_changed_files("HEAD~1") == ["foo.txt", "spam/eggs.txt"]
+    assert git.get_changed_files("no-such-ref") is None
+
 def test_get_repo_root(tmpdir):
     root = tmpdir.ensure("CrazyCase", dir=True)
     git = TestGit(root.strpath)
@@ -6,9 +6,10 @@
 
 This module can manipulate:
 
-* ``*.zip`` archives on all platforms
-* ``*.tar.gz`` and ``*.tar.bz2`` archives on UNIX
-* ``*.tar.xz`` archive is only supported on Linux
+* ``*.zip``, ``*.tar``, ``*.tar.gz`` and ``*.tar.bz2`` archives on all
+  platforms
+* ``*.tar.xz`` and ``*.tar.zst`` archives, provided the ``xz`` or ``zstd``
+  programs are installed
 
 The default archive format is zip, to ensure platform interoperability,
 and also because this is the qiBuild package format.
@@ -30,18 +31,76 @@ To enforce platform interoperability :
 import os
 import re
 import sys
+import bz2
+import copy
 import posixpath
 import operator
+import shutil
+import stat
+import struct
 import subprocess
+import tarfile
+import tempfile
+import threading
+import time
 import zipfile
+import zlib
 
+import qisys.cpu
 import qisys.error
+import qisys.parallel
 import qisys.sh
 import qisys.command
 from qisys import ui
 
 
-KNOWN_ALGOS = ["zip", "tar", "gzip", "bzip2", "xz"]
+KNOWN_ALGOS = ["zip", "tar", "gzip", "bzip2", "xz", "zstd"]
+
+# algo -> mode suffix for tarfile.open()
+TARFILE_MODES = {
+    "tar": "",
+    "gzip": ":gz",
+    "bzip2": ":bz2",
+}
+
+# algo -> (decompressor factory, magic bytes of a new stream)
+DECOMPRESSORS = {
+    "gzip": (lambda: zlib.decompressobj(16 + zlib.MAX_WBITS), "\x1f\x8b"),
+    "bzip2": (bz2.BZ2Decompressor, "BZh"),
+}
+
+# algos without support in the standard library:
+# algo -> arguments to compress to stdout
+COMPRESS_PROGRAMS = {
+    "xz": ["--compress", "--stdout"],
+    "zstd": ["--compress", "--stdout", "--quiet"],
+}
+
+# Size of the buffers used when writing extracted files
+COPY_BUFFER_SIZE = 1024 * 1024
+
+# Below this amount of uncompressed data, compressing or
+# extracting from several threads is not worth it
+PARALLEL_MIN_SIZE = 4 * 1024 * 1024
+
+# Maximum number of threads used when compressing or extracting
+MAX_WORKERS = 8
+
+# zlib compression level used for zip archives by default
+DEFAULT_COMPRESSION_LEVEL = 6
+
+# Files which are already compressed, and thus always
+# stored as is in zip archives
+STORED_EXTENSIONS = (".zip", ".gz", ".tgz", ".bz2", ".xz", ".7z",
+                     ".jpg", ".jpeg", ".png", ".ogg", ".mp3", ".mp4")
+
+# Date used for every member of reproducible archives
+# (this is the smallest date supported by the zip format)
+REPRODUCIBLE_DATE_TIME = (1980, 1, 1, 0, 0, 0)
+
+# Above this size or offset, zip64 extensions are used
+# (same value as in the zipfile module)
+ZIP64_LIMIT = (1 << 31) - 1
 
 class InvalidArchive(qisys.error.Error):
     """Just a custom exception """
@@ -69,12 +128,24 @@ def _check_algo(algo):
 #
 # http://www.mail-archive.com/python-list@python.org/msg34223.html
 def _compress_zip(directory, quiet=True, verbose=False, display_progress=False,
-                  flat=False, output=None):
+                  flat=False, output=None, compression_level=None,
+                  reproducible=False, num_workers=None):
     """Compress directory in a .zip file
 
-    :param directory:        directory to add to the archive
-    :param archive_basepath: output archive basepath (without extension)
-    :param quiet:            quiet mode (print nothing)
+    Files are deflated in parallel into temporary buffers, and then
+    written in the archive sorted by name, so the order of the
+    entries does not depend on the file system.
+
+    :param directory:         directory to add to the archive
+    :param archive_basepath:  output archive basepath (without extension)
+    :param quiet:             quiet mode (print nothing)
+    :param compression_level: zlib compression level, from 0 (store only)
+                              to 9 (default: 6)
+    :param reproducible:      use fixed timestamps and permissions, so that
+                              the same content always gives the same archive
+    :param num_workers:       number of threads used to deflate the files
+                              (default: guessed from the number of CPUs,
+                              0 is the same as 1)
 
     :return: path to the generated archive (archive_basepath.zip)
 
@@ -85,6 +156,10 @@ def _compress_zip(directory, quiet=True, verbose=False, display_progress=False,
 Please set only one of these two options to 'True'
 """
         raise ValueError(mess)
+    if compression_level is None:
+        compression_level = DEFAULT_COMPRESSION_LEVEL
+    if compression_level not in range(0, 10):
+        raise ValueError("compression_level should be between 0 and 9")
     ui.debug("Compressing", directory, "to", output)
     # a list of tuple src, arcname to be added in the archive
     to_add = list()
@@ -102,44 +177,264 @@ Please set only one of these two options to 'True'
             else:
                 arcname = os.path.join(os.path.basename(directory), rel_path)
             to_add.append((full_path, arcname))
-    # ZipFile() creates an empty .zip file on disk, to call
-    # after to_add has been populated
-    archive = zipfile.ZipFile(output, "w", zipfile.ZIP_DEFLATED)
-    for i, (full_path, arcname) in enumerate(to_add):
-        if os.path.islink(full_path):
-            content = os.readlink(full_path)
-            attr = zipfile.ZipInfo(arcname)
-            attr.create_system = 3
-            # long type of hex val of '0xA1ED0000L',
-            # say, symlink attr magic..
-            attr.external_attr = 0xa1ed0000
-            zip_call = archive.writestr
-        elif os.path.isdir(full_path):
-            continue
-        else:
-            attr = full_path
-            content = arcname
-            zip_call = archive.write
-        if not quiet and not display_progress:
-            rel_path  = os.path.relpath(full_path, directory)
-            sys.stdout.write("adding {0}\n".format(rel_path))
-            sys.stdout.flush()
-        if display_progress:
-            ui.info_progress(i, len(to_add), "Done")
-        zip_call(attr, content)
+    to_add.sort(key=operator.itemgetter(1))
+    if num_workers is None:
+        num_workers = _get_num_workers(
+            os.path.getsize(x) for (x, _) in to_add if os.path.isfile(x))
+    # Deflating without a limit would keep every file in memory
+    num_workers = max(1, num_workers)
+    # Create the .zip file on disk after to_add has been populated
+    archive = _ZipWriter(output)
+    deflater = _ZipDeflater(compression_level, reproducible)
+    # Deflate the files by batches, so that no more than a
+    # few buffers are kept in memory at the same time
+    batch_size = num_workers * 16
+    for batch_start in range(0, len(to_add), batch_size):
+        batch = to_add[batch_start:batch_start + batch_size]
+        qisys.parallel.foreach(batch, deflater.deflate, n_jobs=num_workers)
+        if deflater.errors:
+            archive.close()
+            raise deflater.errors[0]
+        for i, (full_path, arcname) in enumerate(batch, start=batch_start):
+            if os.path.islink(full_path):
+                content = os.readlink(full_path)
+                attr = zipfile.ZipInfo(arcname)
+                attr.create_system = 3
+                if reproducible:
+                    attr.date_time = REPRODUCIBLE_DATE_TIME
+                # long type of hex val of '0xA1ED0000L',
+                # say, symlink attr magic..
+                attr.external_attr = 0xa1ed0000
+                attr.compress_type = zipfile.ZIP_STORED
+                attr.file_size = attr.compress_size = len(content)
+                attr.CRC = zlib.crc32(content) & 0xffffffff
+                archive.write(attr, content)
+            elif full_path in deflater.deflated:
+                zinfo, data = deflater.deflated.pop(full_path)
+                try:
+                    archive.write(zinfo, data)
+                finally:
+                    data.close()
+            else:
+                continue
+            if not quiet and not display_progress:
+                rel_path  = os.path.relpath(full_path, directory)
+                sys.stdout.write("adding {0}\n".format(rel_path))
+                sys.stdout.flush()
+            if display_progress:
+                ui.info_progress(i, len(to_add), "Done")
 
     archive.close()
     return output
 
+class _ZipWriter(object):
+    """ Write a zip archive from members which are already compressed.
+
+    The zipfile module can only write members it compresses itself,
+    so the local headers, the central directory and the zip64
+    extensions are written here, following the zip specification.
+    Only the public attributes of the ``ZipInfo`` objects are used
+
+    """
+    def __init__(self, path):
+        self.fp = open(path, "wb")
+        self.members = list()
+
+    def write(self, zinfo, data):
+        """ Add a member. ``zinfo`` must have its sizes and its CRC set,
+        ``data`` is the compressed data, as a string or a file-like object
+
+        """
+        zinfo.header_offset = self.fp.tell()
+        (file_size, compress_size, extra) = self._get_sizes(zinfo)
+        version = 45 if extra else 20
+        (dos_date, dos_time) = _get_dos_date_time(zinfo.date_time)
+        (filename, flags) = _encode_filename(zinfo.filename)
+        header = struct.pack("<4s5H3L2H", "PK\x03\x04", version, flags,
+                             zinfo.compress_type, dos_time, dos_date,
+                             zinfo.CRC, compress_size, file_size,
+                             len(filename), len(extra))
+        self.fp.write(header + filename + extra)
+        if isinstance(data, str):
+            self.fp.write(data)
+        else:
+            data.seek(0)
+            shutil.copyfileobj(data, self.fp, COPY_BUFFER_SIZE)
+        self.members.append(zinfo)
+
+    @staticmethod
+    def _get_sizes(zinfo):
+        """ Return the sizes to write in the local header, and the
+        zip64 extra field to use, if any
+
+        """
+        if zinfo.file_size > ZIP64_LIMIT or zinfo.compress_size > ZIP64_LIMIT:
+            extra = struct.pack("<2H2Q", 1, 16, zinfo.file_size,
+                                zinfo.compress_size)
+            return (0xffffffff, 0xffffffff, extra)
+        return (zinfo.file_size, zinfo.compress_size, "")
+
+    def close(self):
+        """ Write the central directory and close the archive """
+        if self.fp is None:
+            return
+        cd_offset = self.fp.tell()
+        for zinfo in self.members:
+            self.fp.write(self._central_directory_header(zinfo))
+        cd_size = self.fp.tell() - cd_offset
+        num_members = len(self.members)
+        if num_members > 0xffff or cd_offset > ZIP64_LIMIT or \
+                cd_size > ZIP64_LIMIT:
+            zip64_offset = self.fp.tell()
+            self.fp.write(struct.pack("<4sQ2H2L4Q", "PK\x06\x06", 44, 45, 45,
+                                      0, 0, num_members, num_members,
+                                      cd_size, cd_offset))
+            self.fp.write(struct.pack("<4sLQL", "PK\x06\x07", 0,
+                                      zip64_offset, 1))
+            num_members = min(num_members, 0xffff)
+            cd_size = min(cd_size, 0xffffffff)
+            cd_offset = min(cd_offset, 0xffffffff)
+        self.fp.write(struct.pack("<4s4H2LH", "PK\x05\x06", 0, 0,
+                                  num_members, num_members, cd_size,
+                                  cd_offset, 0))
+        self.fp.close()
+        self.fp = None
+
+    @staticmethod
+    def _central_directory_header(zinfo):
+        # Only the values which do not fit go in the zip64 extra field,
+        # in this order
+        zip64_values = list()
+        file_size = zinfo.file_size
+        compress_size = zinfo.compress_size
+        header_offset = zinfo.header_offset
+        if file_size > ZIP64_LIMIT or compress_size > ZIP64_LIMIT:
+            zip64_values = [file_size, compress_size]
+            file_size = compress_size = 0xffffffff
+        if header_offset > ZIP64_LIMIT:
+            zip64_values.append(header_offset)
+            header_offset = 0xffffffff
+        extra = ""
+        version = 20
+        if zip64_values:
+            extra = struct.pack("<2H%iQ" % len(zip64_values), 1,
+                                8 * len(zip64_values), *zip64_values)
+            version = 45
+        (dos_date, dos_time) = _get_dos_date_time(zinfo.date_time)
+        (filename, flags) = _encode_filename(zinfo.filename)
+        header = struct.pack("<4s6H3L5H2L", "PK\x01\x02",
+                             (zinfo.create_system << 8) | version, version,
+                             flags, zinfo.compress_type, dos_time, dos_date,
+                             zinfo.CRC, compress_size, file_size,
+                             len(filename), len(extra), 0, 0, 0,
+                             zinfo.external_attr & 0xffffffff, header_offset)
+        return header + filename + extra
+
+def _encode_filename(filename):
+    """ Return the name to write in the archive, and the flags to use """
+    if isinstance(filename, unicode):
+        # Bit 11: the name is encoded in UTF-8
+        return (filename.encode("utf-8"), 0x800)
+    return (filename, 0)
+
+def _get_dos_date_time(date_time):
+    (year, month, day, hour, minute, second) = date_time
+    dos_date = (year - 1980) << 9 | month << 5 | day
+    dos_time = hour << 11 | minute << 5 | (second // 2)
+    return (dos_date, dos_time)
+
+
+class _ZipDeflater(object):
+    """ Deflate files from several threads.
+
+    Results are stored in ``self.deflated`` (full path -> (zipinfo, data)),
+    where data is a file-like object, kept in memory for small files
+
+    """
+    def __init__(self, compression_level, reproducible):
+        self.compression_level = compression_level
+        self.reproducible = reproducible
+        self.deflated = dict()
+        self.errors = list()
+        self._lock = threading.Lock()
+
+    def deflate(self, item):
+        """ Deflate one file. Errors are stored in ``self.errors``
+        because they cannot be raised from the worker threads
+
+        """
+        full_path, arcname = item
+        if self.errors:
+            return
+        if os.path.islink(full_path) or os.path.isdir(full_path):
+            return
+        try:
+            res = self._deflate(full_path, arcname)
+        except Exception as e:
+            with self._lock:
+                self.errors.append(e)
+            return
+        with self._lock:
+            self.deflated[full_path] = res
+
+    def _deflate(self, full_path, arcname):
+        st = os.stat(full_path)
+        if self.reproducible:
+            date_time = REPRODUCIBLE_DATE_TIME
+            if st.st_mode & stat.S_IXUSR:
+                mode = stat.S_IFREG | 0755
+            else:
+                mode = stat.S_IFREG | 0644
+        else:
+            date_time = time.localtime(st.st_mtime)[0:6]
+            mode = st.st_mode
+        zinfo = zipfile.ZipInfo(arcname, date_time)
+        zinfo.external_attr = (mode & 0xFFFF) << 16L
+        store = self.compression_level == 0 or \
+                arcname.lower().endswith(STORED_EXTENSIONS)
+        if store:
+            zinfo.compress_type = zipfile.ZIP_STORED
+            compressor = None
+        else:
+            zinfo.compress_type = zipfile.ZIP_DEFLATED
+            compressor = zlib.compressobj(self.compression_level,
+                                          zlib.DEFLATED, -15)
+        data = tempfile.SpooledTemporaryFile(max_size=COPY_BUFFER_SIZE)
+        crc = 0
+        file_size = 0
+        with open(full_path, "rb") as fp:
+            while True:
+                chunk = fp.read(COPY_BUFFER_SIZE)
+                if not chunk:
+                    break
+                file_size += len(chunk)
+                crc = zlib.crc32(chunk, crc)
+                if compressor:
+                    chunk = compressor.compress(chunk)
+                data.write(chunk)
+        if compressor:
+            data.write(compressor.flush())
+        zinfo.file_size = file_size
+        zinfo.compress_size = data.tell()
+        zinfo.CRC = crc & 0xffffffff
+        return zinfo, data
+
 
 # pylint: disable-msg=R0914
-def _extract_zip(archive, directory, quiet, verbose, strict_mode=True):
+def _extract_zip(archive, directory, quiet, verbose, strict_mode=True,
+                 num_workers=None):
     """Extract a zip archive into directory
 
-    :param archive:   path of the archive
-    :param directory: extract location
-    :param quiet:     quiet mode (print nothing)
-    :param verbose:   verbose mode (print all the archive content)
+    The directory tree is created first, then the files are
+    decompressed in parallel (each worker using its own handle on
+    the archive), and symlinks and permissions are applied last.
+
+    :param archive:     path of the archive
+    :param directory:   extract location
+    :param quiet:       quiet mode (print nothing)
+    :param verbose:     verbose mode (print all the archive content)
+    :param num_workers: number of threads used to decompress the files
+                        (default: guessed from the number of CPUs)
 
     :return: path to the extracted archive (directory/topdir)
 
@@ -163,9 +458,13 @@ Please set only one of these two options to 'True'
     ##    zipped ro files do not appears as members, so the following
     ##    stratement failed if the whole content of the archive is read-only.
     orig_topdir = members[0].filename.split(posixpath.sep)[0]
-    size = len(members)
     directories = list()
+    symlinks = list()
+    files = list()
     for (i, member) in enumerate(members):
+        if not _is_safe_path(member.filename):
+            ui.warning("Skipping", member.filename, "from", archive)
+            continue
         member_top_dir = member.filename.split(posixpath.sep)[0]
         if i != 0 and member_top_dir != orig_topdir:
             # something wrong: members do not have the
@@ -175,49 +474,64 @@ Please set only one of these two options to 'True'
                 (orig_topdir, member_top_dir)
             if strict_mode:
                 raise InvalidArchive(mess)
-
-        new_path = os.path.join(directory, member.filename)
-        # Show no mercy and always remove destination
-        # This will prevent crash is it's a symlink that already exists,
-        # or a read-only file
-        qisys.sh.rm(new_path)
-        qisys.sh.mkdir(os.path.dirname(new_path), recursive=True)
         if member.external_attr in [0xa1ed0000, 0xa1ff0000]:
-            target = archive_.read(member.filename)
-            os.symlink(target, new_path)
+            symlinks.append(member)
+        elif member.filename.endswith("/"):
+            directories.append(member)
         else:
-            archive_.extract(member, path=directory)
-            # Fix permision on extracted file unless it is a directory
-            # or if we are on windows
-            if member.filename.endswith("/"):
-                directories.append(member)
-                qisys.sh.mkdir(new_path)
-                new_st = 0777
-            else:
-                new_st = member.external_attr >> 16L
-            # permissions are meaningless on windows, here only the exension counts
-            if not sys.platform.startswith("win"):
-                if new_st != 0:
-                    os.chmod(new_path, new_st)
-
-            if not quiet:
-                qisys.ui.info_progress(i, size, "Done")
-            elif verbose and sys.stdout.isatty():
-                sys.stdout.write(member)
-                sys.stdout.flush()
-
-    # Reverse sort directories, and then fix perm on these
-    directories.sort(key=operator.attrgetter('filename'))
-    directories.reverse()
+            files.append(member)
+
+    # Create the whole directory tree once.
+    # Show no mercy and always remove destination
+    # This will prevent crash is it's a symlink that already exists,
+    # or a read-only file
+    to_create = set()
+    for member in directories:
+        new_path = _get_member_path(directory, member)
+        qisys.sh.rm(new_path)
+        to_create.add(new_path)
+    for member in files + symlinks:
+        new_path = _get_member_path(directory, member)
+        to_create.add(os.path.dirname(new_path))
+    for new_dir in sorted(to_create):
+        qisys.sh.mkdir(new_dir, recursive=True)
+
+    # Decompress the files, biggest first so that the workers
+    # finish at about the same time
+    files.sort(key=operator.attrgetter("file_size"), reverse=True)
+    if num_workers is None:
+        num_workers = _get_num_workers(x.file_size for x in files)
+    extractor = _ZipExtractor(archive, directory, len(files),
+                              quiet=quiet, verbose=verbose)
+    try:
+        qisys.parallel.foreach(files, extractor.extract, n_jobs=num_workers)
+    finally:
+        extractor.close()
+    if extractor.errors:
+        raise extractor.errors[0]
+
+    # Then apply symlinks and permissions
+    for member in symlinks:
+        new_path = _get_member_path(directory, member)
+        qisys.sh.rm(new_path)
+        target = archive_.read(member.filename)
+        os.symlink(target, new_path)
+    archive_.close()
 
-    for zipinfo in directories:
-        dirpath = os.path.join(directory, zipinfo.filename)
-        new_st = zipinfo.external_attr >> 16L
-        if not sys.platform.startswith("win"):
+    # permissions are meaningless on windows, here only the exension counts
+    if not sys.platform.startswith("win"):
+        for member in files:
+            new_st = member.external_attr >> 16L
+            if new_st != 0:
+                os.chmod(_get_member_path(directory, member), new_st)
+        # Reverse sort directories, and then fix perm on these
+        directories.sort(key=operator.attrgetter('filename'))
+        directories.reverse()
+        for zipinfo in directories:
+            new_st = zipinfo.external_attr >> 16L
             if new_st != 0:
-                os.chmod(dirpath, new_st)
+                os.chmod(_get_member_path(directory, zipinfo), new_st)
 
-    archive_.close()
     ui.debug(archive, "extracted in", directory)
     if strict_mode:
         res = os.path.join(directory, orig_topdir)
@@ -225,51 +539,108 @@ Please set only one of these two options to 'True'
         res = directory
     return res
 
+def _get_member_path(directory, member):
+    """ Where to extract the zip member, making sure it is
+    inside the destination directory
 
-# pylint: disable-msg=R0913
-def _get_tar_command(action, algo, filename, directory, quiet, add_opts=None):
-    """Generate a tar command line
+    """
+    if not _is_safe_path(member.filename):
+        raise InvalidArchive("Invalid member: %s" % member.filename)
+    parts = [x for x in member.filename.split("/") if x not in ("", ".")]
+    return os.path.join(directory, *parts)
 
-    :param action:    compression/exctraction switch [compress|extract]
-    :param algo:      compression method
-    :param filename:  archive path
-    :param directory: directory to add to the archive in case of compression,
-                      or extract location in case of extraction
-    :param quiet:     quiet mode
-    :param add_opts:  list of additional options directly added to the
-                      generated tar command line
+def _is_safe_path(name):
+    """ Whether an archive member name is a relative path which
+    stays inside the destination directory
 
-    :return: the list containing the whole tar commnand
+    """
+    name = name.replace("\\", "/")
+    if name.startswith("/") or re.match(r"^[A-Za-z]:", name):
+        return False
+    return ".." not in name.split("/")
+
+def _get_num_workers(sizes):
+    """ Only use threads when there is enough data to process """
+    sizes = list(sizes)
+    if len(sizes) < 2 or sum(sizes) < PARALLEL_MIN_SIZE:
+        return 1
+    num_cpus = qisys.cpu.cpu_count()
+    return max(1, min(num_cpus, len(sizes), MAX_WORKERS))
+
+
+class _ZipExtractor(object):
+    """ Extract zip members from several threads.
+
+    Each thread gets its own ``ZipFile`` object, so that
+    decompression (which releases the GIL) can happen concurrently
 
     """
-    cmd  = [qisys.command.find_program("tar", raises=True)]
-    if not quiet:
-        cmd += ["--verbose"]
-    if add_opts is not None:
-        cmd += add_opts
-    if action == "compress":
-        cmd += ["--create"]
-        cwd  = os.path.dirname(directory)
-        data = os.path.basename(directory)
-    elif action == "extract":
-        cmd += ["--extract"]
-        cwd  = directory
-        data = None
-    if algo != "tar":
-        cmd += ["--{0}".format(algo)]
-    cmd += ["--file", filename]
-    if cwd == "":
-        cwd = "."
-    cmd += ["--directory", cwd]
-    if data is not None:
-        cmd += [data]
-    return cmd
+    def __init__(self, archive, directory, size, quiet=False, verbose=False):
+        self.archive = archive
+        self.directory = directory
+        self.size = size
+        self.quiet = quiet
+        self.verbose = verbose
+        self.errors = list()
+        self._done = 0
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._handles = list()
+
+    def _get_handle(self):
+        handle = getattr(self._local, "handle", None)
+        if handle is None:
+            handle = zipfile.ZipFile(self.archive)
+            self._local.handle = handle
+            with self._lock:
+                self._handles.append(handle)
+        return handle
+
+    def extract(self, member):
+        """ Extract one member. Errors are stored in ``self.errors``
+        because they cannot be raised from the worker threads
+
+        """
+        if self.errors:
+            return
+        try:
+            self._extract(member)
+        except Exception as e:
+            with self._lock:
+                self.errors.append(e)
+            return
+        with self._lock:
+            self._done += 1
+            if not self.quiet:
+                ui.info_progress(self._done, self.size, "Done")
+            elif self.verbose and sys.stdout.isatty():
+                sys.stdout.write(member.filename + "\n")
+                sys.stdout.flush()
+
+    def _extract(self, member):
+        new_path = _get_member_path(self.directory, member)
+        qisys.sh.rm(new_path)
+        handle = self._get_handle()
+        source = handle.open(member)
+        try:
+            with open(new_path, "wb") as dest:
+                shutil.copyfileobj(source, dest, COPY_BUFFER_SIZE)
+        finally:
+            source.close()
+
+    def close(self):
+        for handle in self._handles:
+            handle.close()
 
 
 def _compress_tar(directory, output=None, algo=None,
                   quiet=True, verbose=False):
     """Compress directory in a .tar.* archive
 
+    gzip and bzip2 compression is done in process, xz and zstd
+    compressions are done by piping the archive to the ``xz`` or
+    ``zstd`` programs.
+
     :param directory:        directory to add to the archive
     :param archive_basepath: output archive basepath (without extension)
     :param algo:             compression method
@@ -285,16 +656,43 @@ Please set only one of these two options to 'True'
 """
         raise ValueError(mess)
     ui.debug("Compressing", directory, "to", output)
-    cmd = _get_tar_command("compress", algo, output, directory, quiet)
+    process = None
     try:
-        if verbose:
-            printed = qisys.command.check_output(cmd, stderr=subprocess.STDOUT)
-        else:
-            unused_output, printed = qisys.command.check_output_error(cmd)
-    except qisys.command.CommandFailedException as err:
+        try:
+            if algo in COMPRESS_PROGRAMS:
+                program = qisys.command.find_program(algo, raises=True)
+                cmd = [program] + COMPRESS_PROGRAMS[algo]
+                with open(output, "wb") as fp:
+                    process = subprocess.Popen(cmd, stdin=subprocess.PIPE,
+                                               stdout=fp, stderr=subprocess.PIPE)
+                tar = tarfile.open(fileobj=process.stdin, mode="w|",
+                                   bufsize=COPY_BUFFER_SIZE)
+            else:
+                tar = tarfile.open(output, "w" + TARFILE_MODES[algo])
+            def on_add(tarinfo):
+                if verbose:
+                    sys.stdout.write(tarinfo.name + "\n")
+                return tarinfo
+            tar.add(directory, arcname=os.path.basename(directory),
+                    filter=on_add)
+            tar.close()
+            if process:
+                process.stdin.close()
+                err = process.stderr.read()
+                process.wait()
+                if process.returncode != 0:
+                    raise qisys.error.Error("%s failed: %s" % (algo, err))
+        except:
+            # Do not leave a compressor running nor a partial archive
+            if process and process.returncode is None:
+                process.kill()
+                process.wait()
+            qisys.sh.rm(output)
+            raise
+    except (tarfile.TarError, EnvironmentError, qisys.error.Error) as err:
         mess  = "Could not compress directory %s\n" % directory
         mess += "(algo: %s)\n" % algo
-        mess += "Calling tar failed\n"
+        mess += "Creating tar failed\n"
         mess += str(err)
         raise qisys.error.Error(mess)
     return output
@@ -303,6 +701,10 @@ Please set only one of these two options to 'True'
 def _extract_tar(archive, directory, algo, quiet, verbose, output_filter=None):
     """Extract a .tar.* archive into directory
 
+    The archive is read only once: the top directory is guessed
+    from the first member, while the next ones are being
+    decompressed by an other thread (or process)
+
     :param archive:   path of the archive
     :param directory: extract location
     :param algo:      uncompression method
@@ -318,57 +720,221 @@ def _extract_tar(archive, directory, algo, quiet, verbose, output_filter=None):
 Please set only one of these two options to 'True'
 """
         raise ValueError(mess)
-    # Because "zip" is the standard qiBuild archive format,
-    # do no fancy things but calling "tar", with its default
-    # outputs (no progress bar).
     ui.debug("Extracting", archive, "to", directory)
-    # first, list the archive and check the topdir of its content
-    tar       = qisys.command.find_program("tar")
-    list_cmd  = [tar, "--list", "--file", archive]
-    process   = subprocess.Popen(list_cmd, stdout=subprocess.PIPE,
-                                 stderr=subprocess.PIPE)
-    line      = process.stdout.readline().split(os.sep, 1)[0]
-    topdir    = line.split(os.sep, 1)[0]
-    archroot  = None
-    opts      = list()
-    while line:
-        if line[0] in ["/", "."] or topdir != line[0]:
-            if process.poll() is None:
-                process.terminate()
-            if line[0] in ["/", "."]:
-                opts.append("--strip-components=1")
-                archroot = os.path.basename(archive)
-                archroot = archroot.rsplit(".", 1)[0]
-                if archroot.endswith(".tar"):
-                    archroot = archroot.rsplit(".tar", 1)[0]
-            break
-        line = process.stdout.readline().split(os.sep, 1)[0]
-    if archroot is not None:
-        directory = os.path.join(directory, archroot)
-        destdir   = directory
-    else:
-        destdir   = os.path.join(directory, topdir)
-    cmd = _get_tar_command("extract", algo, archive, directory, quiet, add_opts=opts)
-    qisys.sh.mkdir(directory)
+    destdir = directory
+    directories = list()
     try:
-        if verbose:
-            printed = qisys.command.check_output(cmd, stderr=subprocess.STDOUT)
-        else:
-            unused_output, printed = qisys.command.check_output_error(cmd)
-    except qisys.command.CommandFailedException as err:
+        stream = _TarInputStream(archive, algo)
+    except qisys.error.Error as err:
         mess  = "Could not extract %s to %s\n" % (archive, directory)
-        mess += "Calling tar failed\n"
+        mess += "Extracting tar failed\n"
         mess += str(err)
         raise qisys.error.Error(mess)
-    if not quiet:
-        for line in str(printed).split("\n"):
-            if not output_filter or not re.search(output_filter, line):
-                print line.strip()
+    error = None
+    # Symlinks extracted so far: members going through them are
+    # skipped, so that a link cannot be used to write outside the
+    # destination
+    links = set()
+    try:
+        tar = tarfile.open(fileobj=stream.fileobj, mode="r|",
+                           bufsize=COPY_BUFFER_SIZE)
+        strip = False
+        for (i, member) in enumerate(tar):
+            if i == 0:
+                # If the archive has no top dir, strip the first
+                # component, and use the name of the archive instead
+                if member.name.startswith(("/", ".")):
+                    strip = True
+                    archroot = os.path.basename(archive)
+                    archroot = archroot.rsplit(".", 1)[0]
+                    if archroot.endswith(".tar"):
+                        archroot = archroot.rsplit(".tar", 1)[0]
+                    directory = os.path.join(directory, archroot)
+                    destdir = directory
+                else:
+                    topdir = member.name.split("/")[0]
+                    destdir = os.path.join(directory, topdir)
+                qisys.sh.mkdir(directory, recursive=True)
+            if strip:
+                member.name = _strip_first_component(member.name)
+                if member.islnk():
+                    member.linkname = _strip_first_component(member.linkname)
+            if not member.name:
+                continue
+            if not _is_safe_member(member) or \
+                    _goes_through_link(member.name, links):
+                ui.warning("Skipping", member.name, "from", archive)
+                continue
+            if member.issym():
+                links.add(member.name.rstrip("/"))
+            else:
+                links.discard(member.name.rstrip("/"))
+            if member.isdir():
+                # Set the permissions of the directories at the end,
+                # in case they are read-only
+                directories.append(member)
+                member = copy.copy(member)
+                member.mode = 0700
+            else:
+                qisys.sh.rm(os.path.join(directory, member.name))
+            tar.extract(member, directory)
+            if not quiet:
+                line = member.name
+                if member.isdir():
+                    line += "/"
+                if not output_filter or not re.search(output_filter, line):
+                    print line
+
+        directories.sort(key=operator.attrgetter("name"))
+        directories.reverse()
+        for member in directories:
+            dirpath = os.path.join(directory, member.name)
+            try:
+                tar.chown(member, dirpath)
+                tar.utime(member, dirpath)
+                tar.chmod(member, dirpath)
+            except tarfile.ExtractError as err:
+                ui.debug(err)
+        tar.close()
+    except (tarfile.TarError, EnvironmentError) as err:
+        error = err
+    stream_error = stream.close()
+    if stream_error:
+        error = stream_error
+    if error:
+        mess  = "Could not extract %s to %s\n" % (archive, directory)
+        mess += "Extracting tar failed\n"
+        mess += str(error)
+        raise qisys.error.Error(mess)
     return destdir
 
+def _strip_first_component(name):
+    parts = name.lstrip("/").split("/", 1)
+    if len(parts) == 1:
+        return ""
+    return parts[1]
+
+def _is_safe_member(member):
+    """ Make sure the member is extracted inside the destination """
+    if not _is_safe_path(member.name):
+        return False
+    if member.islnk() and not _is_safe_path(member.linkname):
+        return False
+    return True
+
+def _goes_through_link(name, links):
+    """ Whether one of the parent directories of ``name``
+    is one of the given symlinks
+
+    """
+    parts = name.rstrip("/").split("/")
+    for i in range(1, len(parts)):
+        if "/".join(parts[:i]) in links:
+            return True
+    return False
+
+
+class _TarInputStream(object):
+    """ Decompress a tar archive in the background.
+
+    gzip and bzip2 archives are decompressed by a thread writing
+    to a pipe, xz and zstd archives are decompressed by the ``xz``
+    or ``zstd`` programs. Either way, decompression happens while
+    the extracted files are written to the disk.
+
+    """
+    def __init__(self, archive, algo):
+        self.fileobj = None
+        self._process = None
+        self._thread = None
+        if algo in COMPRESS_PROGRAMS:
+            program = qisys.command.find_program(algo, raises=True)
+            cmd = [program, "--decompress", "--stdout", archive]
+            self._process = subprocess.Popen(cmd, stdout=subprocess.PIPE,
+                                             stderr=subprocess.PIPE)
+            self.fileobj = self._process.stdout
+        elif algo in DECOMPRESSORS:
+            (read_fd, write_fd) = os.pipe()
+            self.fileobj = os.fdopen(read_fd, "rb")
+            self._thread = _DecompressThread(archive, algo, write_fd)
+            self._thread.start()
+        else:
+            self.fileobj = open(archive, "rb")
+
+    def close(self):
+        """ Wait for the decompression to finish, and return the error
+        that occurred, if any
+
+        """
+        # Drain what is left after the end of the tar archive,
+        # so that the decompressor does not fail with a broken pipe
+        try:
+            while self.fileobj.read(COPY_BUFFER_SIZE):
+                pass
+        except EnvironmentError:
+            pass
+        self.fileobj.close()
+        if self._thread:
+            self._thread.join()
+            return self._thread.error
+        if self._process:
+            err = self._process.stderr.read()
+            self._process.wait()
+            if self._process.returncode != 0:
+                return err.strip()
+        return None
+
+
+class _DecompressThread(threading.Thread):
+    """ Decompress a gzip or bzip2 file into a pipe.
+
+    Concatenated streams are supported, and garbage after the
+    end of the last stream is ignored, as ``tar`` does.
+
+    """
+    def __init__(self, archive, algo, write_fd):
+        threading.Thread.__init__(self, name="decompress-%s" % algo)
+        self.daemon = True
+        self.archive = archive
+        self.algo = algo
+        self.write_fd = write_fd
+        self.error = None
+
+    def run(self):
+        try:
+            with open(self.archive, "rb") as fp:
+                with os.fdopen(self.write_fd, "wb") as out:
+                    self._decompress(fp, out)
+        except Exception as e:
+            self.error = e
+
+    def _decompress(self, fp, out):
+        (new_decompressor, magic) = DECOMPRESSORS[self.algo]
+        decompressor = new_decompressor()
+        chunk = fp.read(COPY_BUFFER_SIZE)
+        while chunk:
+            try:
+                data = decompressor.decompress(chunk)
+                unused = decompressor.unused_data
+            except EOFError:
+                # bzip2 stream ended exactly at the end of the previous chunk
+                data = ""
+                unused = chunk
+            out.write(data)
+            if unused:
+                if len(unused) < len(magic):
+                    unused += fp.read(COPY_BUFFER_SIZE)
+                if not unused.startswith(magic):
+                    return
+                decompressor = new_decompressor()
+                chunk = unused
+            else:
+                chunk = fp.read(COPY_BUFFER_SIZE)
+
 
 def compress(directory, algo="zip", output=None, flat=False,
-            quiet=False, verbose=False, display_progress=False):
+            quiet=False, verbose=False, display_progress=False,
+            compression_level=None, reproducible=False):
     """Compress directory in an archive
 
     :param directory: directory to add to the archive
@@ -379,6 +945,10 @@ def compress(directory, algo="zip", output=None, flat=False,
                       (default: False)
     :param flat:      if false, put all files in a common top dir
                       (default: False)
+    :param compression_level: zip only: from 0 (store only) to 9
+                              (default: 6)
+    :param reproducible: zip only: use fixed timestamps and permissions
+                         (default: False)
 
     :return: path to the generated archive
 
@@ -396,7 +966,9 @@ Please set only one of these two options to 'True'
     if algo == "zip":
         archive_path = _compress_zip(directory, quiet=quiet, verbose=verbose,
                                      display_progress=display_progress,
-                                     output=output, flat=flat)
+                                     output=output, flat=flat,
+                                     compression_level=compression_level,
+                                     reproducible=reproducible)
     else:
         archive_path = _compress_tar(directory, quiet=quiet, verbose=verbose,
                                      output=output, algo=algo)
@@ -412,6 +984,8 @@ def get_default_output(directory, algo):
         res += ".tar.bz2"
     elif algo == "xz":
         res += ".tar.xz"
+    elif algo == "zstd":
+        res += ".tar.zst"
     elif algo == "zip":
         res += ".zip"
     return res
@@ -469,6 +1043,8 @@ def guess_algo(archive):
         algo = "bzip2"
     elif "xz" in extension:
         algo = "xz"
+    elif "zst" in extension:
+        algo = "zstd"
     else:
         algo = extension
     return algo
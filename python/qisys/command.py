@@ -8,10 +8,14 @@
 
 import os
 import sys
+import collections
 import contextlib
+import errno
+import select
 import subprocess
 import signal
 import threading
+import time
 import Queue
 
 from qisys import ui
@@ -41,6 +45,11 @@ class Process(object):
     * Process.INTERRUPTED (exit code is < 0)
     * Process.NOT_RUN (could not start the process)
     * Process.ZOMBIE (could not kill process after it timed out)
+
+    When ``output_file`` is given, the whole output is also written
+    there. When ``max_output_size`` is given, only the beginning and the
+    end of the output are kept in ``Process.out``, so that chatty
+    processes do not use too much memory.
     """
 
     OK          = 0
@@ -50,11 +59,15 @@ class Process(object):
     INTERRUPTED = 4
     NOT_RUN     = 5
 
-    def __init__(self, cmd, cwd=None, env=None, capture=True):
+    def __init__(self, cmd, cwd=None, env=None, capture=True,
+                 output_file=None, max_output_size=None):
         self.cmd = cmd
         self.cwd = cwd
         self.env = env
         self.out = ""
+        self.output_file = output_file
+        self.max_output_size = max_output_size
+        self.output_size = 0
         self.returncode = None
         self._process = None
         self.exception = None
@@ -62,20 +75,56 @@ class Process(object):
         self.capture = capture
 
     def run(self, timeout=None):
+        """ Run the process, and wait for it to finish or time out.
+
+        On POSIX, the output of the process is read and the timeout
+        is enforced by a single background thread shared by all the
+        processes, so that running many processes in parallel is
+        cheap, and the end of the process is noticed right away.
+
+        """
+        if os.name != "posix":
+            return self._run_with_threads(timeout=timeout)
+        ui.debug("Calling:", subprocess.list2cmdline(self.cmd))
+        kwargs = {
+                "cwd": self.cwd,
+                "env" : self.env,
+                "preexec_fn": os.setsid,
+                "close_fds": True,
+        }
+        if self.capture:
+            kwargs["stdout"] = subprocess.PIPE
+            kwargs["stderr"] = subprocess.STDOUT
+        self._output = self._get_output_buffer()
+        try:
+            self._process = subprocess.Popen(self.cmd, **kwargs)
+        except Exception, e:
+            self._output.close()
+            self.exception = e
+            self.return_type = Process.NOT_RUN
+            return
+        self._done = threading.Event()
+        _get_process_monitor().add(self, timeout)
+        if isinstance(threading.current_thread(), threading._MainThread):
+            # Waiting without a timeout would make the main thread
+            # deaf to KeyboardInterrupt
+            while not self._done.is_set():
+                self._done.wait(1)
+        else:
+            self._done.wait()
+
+    def _run_with_threads(self, timeout=None):
+        """ Implementation of run() for Windows, where pipes
+        cannot be used with select()
+
+        """
         def target():
             ui.debug("Starting thread.")
             ui.debug("Calling:", subprocess.list2cmdline(self.cmd))
             try:
-                opts = dict()
-                if os.name == 'posix':
-                    opts = {
-                        'preexec_fn': os.setsid,
-                        'close_fds': True
-                    }
-                elif os.name == 'nt':
-                    opts = {
-                        'creationflags': subprocess.CREATE_NEW_PROCESS_GROUP,
-                    }
+                opts = {
+                    'creationflags': subprocess.CREATE_NEW_PROCESS_GROUP,
+                }
                 kwargs = {
                         "cwd": self.cwd,
                         "env" : self.env
@@ -90,7 +139,19 @@ class Process(object):
                 self.return_type = Process.NOT_RUN
                 return
             def read_target():
-                self.out = self._process.communicate()[0]
+                output = self._get_output_buffer()
+                try:
+                    if self._process.stdout:
+                        while True:
+                            data = self._process.stdout.read(OutputBuffer.CHUNK_SIZE)
+                            if not data:
+                                break
+                            output.write(data)
+                    self._process.wait()
+                finally:
+                    output.close()
+                    self.out = output.getvalue()
+                    self.output_size = output.size
             self._should_stop_reading = False
             self._reading_thread = threading.Thread(target=read_target)
             # Allow Python to exit even if the reading thread is still alive
@@ -120,6 +181,13 @@ class Process(object):
             ui.debug("Process timed out")
             self._kill_subprocess()
 
+    def _get_output_buffer(self):
+        output_file = None
+        if self.capture:
+            output_file = self.output_file
+        return OutputBuffer(max_size=self.max_output_size,
+                            output_file=output_file)
+
     def _kill_subprocess(self):
         if self._thread and self._process:
             self.return_type = Process.TIME_OUT
@@ -151,6 +219,283 @@ class Process(object):
         self._should_stop_reading = True
         self._thread.join()
 
+
+class OutputBuffer(object):
+    """ Store the output of a process.
+
+    Only the first and last ``max_size / 2`` bytes are kept in
+    memory, and the whole output is written to ``output_file``
+    if it is not None.
+
+    """
+    CHUNK_SIZE = 64 * 1024
+
+    def __init__(self, max_size=None, output_file=None):
+        self.max_size = max_size
+        self.output_file = output_file
+        self.size = 0
+        self._head = list()
+        self._head_size = 0
+        self._tail = collections.deque()
+        self._tail_size = 0
+        self._fp = None
+        if output_file:
+            self._fp = open(output_file, "wb")
+
+    def write(self, data):
+        """ Add some output """
+        self.size += len(data)
+        if self._fp:
+            self._fp.write(data)
+        if self.max_size is None:
+            self._head.append(data)
+            return
+        half = self.max_size / 2
+        if self._head_size < half:
+            head_data = data[:half - self._head_size]
+            self._head.append(head_data)
+            self._head_size += len(head_data)
+            data = data[len(head_data):]
+        if not data:
+            return
+        self._tail.append(data)
+        self._tail_size += len(data)
+        while self._tail_size - len(self._tail[0]) >= half:
+            self._tail_size -= len(self._tail.popleft())
+
+    def close(self):
+        if self._fp:
+            self._fp.close()
+            self._fp = None
+
+    def getvalue(self):
+        """ The output that was kept in memory, with a marker
+        where some output was skipped
+
+        """
+        head = "".join(self._head)
+        if self.max_size is None:
+            return head
+        tail = "".join(self._tail)
+        skipped = self.size - len(head) - len(tail)
+        tail_size = self.max_size - self.max_size / 2
+        if len(tail) > tail_size:
+            skipped += len(tail) - tail_size
+            tail = tail[-tail_size:]
+        if not skipped:
+            return head + tail
+        marker = "\n[... %i bytes skipped" % skipped
+        if self.output_file:
+            marker += ", see %s" % self.output_file
+        marker += " ...]\n"
+        return head + marker + tail
+
+
+class _ProcessMonitor(threading.Thread):
+    """ A single thread reading the output of all the running
+    :py:class:`Process` instances and enforcing their timeouts,
+    using ``select()``
+
+    """
+    # Seconds to wait after SIGTERM before killing the process group
+    KILL_DELAY = 5
+    # How often to check processes which cannot be watched
+    # with select() (not captured, or output already closed)
+    POLL_INTERVAL = 0.01
+    # How often to check for SIGINT_EVENT
+    SIGINT_INTERVAL = 1
+
+    def __init__(self):
+        super(_ProcessMonitor, self).__init__(name="ProcessMonitor")
+        self.daemon = True
+        self._lock = threading.Lock()
+        self._watched = list()
+        (self._wakeup_read, self._wakeup_write) = os.pipe()
+
+    def add(self, process, timeout):
+        """ Start watching a process """
+        watched = _WatchedProcess(process, timeout)
+        with self._lock:
+            self._watched.append(watched)
+        os.write(self._wakeup_write, "x")
+
+    def run(self):
+        while True:
+            with self._lock:
+                watched = list(self._watched)
+            try:
+                self._run_once(watched)
+            except Exception as e:
+                # Do not let an unexpected error kill the monitor:
+                # the processes it was watching would never be
+                # reported as finished
+                for item in watched:
+                    if not item.done:
+                        self._fail(item, e)
+
+    def _run_once(self, watched):
+        now = time.time()
+        for item in watched:
+            try:
+                self._check(item, now)
+            except Exception as e:
+                self._fail(item, e)
+        watched = [x for x in watched if not x.done]
+        fds = dict((x.fd, x) for x in watched if x.fd is not None)
+        readable = _wait_readable([self._wakeup_read] + fds.keys(),
+                                  self._get_timeout(watched, now))
+        for fd in readable:
+            if fd == self._wakeup_read:
+                os.read(fd, 4096)
+                continue
+            item = fds[fd]
+            try:
+                item.read()
+            except Exception as e:
+                self._fail(item, e)
+
+    def _get_timeout(self, watched, now):
+        if not watched:
+            return None
+        res = self.SIGINT_INTERVAL
+        for item in watched:
+            if item.fd is None:
+                res = min(res, self.POLL_INTERVAL)
+            for deadline in item.deadline, item.kill_deadline:
+                if deadline is not None:
+                    res = min(res, max(deadline - now, 0))
+        return res
+
+    def _check(self, item, now):
+        process = item.process
+        if SIGINT_EVENT.is_set():
+            item.kill_group()
+            process.return_type = Process.INTERRUPTED
+            self._finish(item)
+            return
+        if item.fd is None and process._process.poll() is not None:
+            if process.returncode is None:
+                process.returncode = process._process.returncode
+            if process.return_type == Process.FAILED and process.returncode == 0:
+                ui.debug("Setting return code to Process.OK")
+                process.return_type = Process.OK
+            self._finish(item)
+            return
+        if item.deadline is not None and now >= item.deadline:
+            ui.debug("Process timed out")
+            item.deadline = None
+            item.kill_deadline = now + self.KILL_DELAY
+            process.return_type = Process.TIME_OUT
+            ui.debug("Terminating process")
+            try:
+                process._process.terminate()
+            except OSError:
+                pass
+        elif item.kill_deadline is not None and now >= item.kill_deadline:
+            ui.debug("Killing zombies")
+            item.kill_group()
+            process.return_type = Process.ZOMBIE
+            self._finish(item)
+
+    def _fail(self, item, error):
+        """ Kill a process which could not be watched, and
+        release the threads waiting for it
+
+        """
+        ui.debug("Error while watching process:", error)
+        process = item.process
+        process.exception = error
+        process.return_type = Process.FAILED
+        item.kill_group()
+        try:
+            process.returncode = process._process.wait()
+        except OSError:
+            pass
+        self._finish(item)
+
+    def _finish(self, item):
+        if item.done:
+            return
+        item.done = True
+        try:
+            item.close()
+        except (IOError, OSError):
+            pass
+        output = item.process._output
+        output.close()
+        item.process.out = output.getvalue()
+        item.process.output_size = output.size
+        with self._lock:
+            self._watched.remove(item)
+        item.process._done.set()
+
+
+class _WatchedProcess(object):
+    """ State of a process watched by the :py:class:`_ProcessMonitor` """
+    def __init__(self, process, timeout):
+        self.process = process
+        self.done = False
+        self.fd = None
+        if process._process.stdout:
+            self.fd = process._process.stdout.fileno()
+        self.deadline = None
+        if timeout is not None:
+            self.deadline = time.time() + timeout
+        self.kill_deadline = None
+
+    def read(self):
+        """ Read what is available from the output of the process """
+        data = os.read(self.fd, OutputBuffer.CHUNK_SIZE)
+        if data:
+            self.process._output.write(data)
+        else:
+            self.close()
+
+    def close(self):
+        if self.fd is not None:
+            self.process._process.stdout.close()
+            self.fd = None
+
+    def kill_group(self):
+        try:
+            os.killpg(self.process._process.pid, signal.SIGKILL)
+        except OSError:
+            pass
+
+
+def _wait_readable(fds, timeout):
+    """ Wait for some of the file descriptors to be readable """
+    if hasattr(select, "poll"):
+        poller = select.poll()
+        for fd in fds:
+            poller.register(fd, select.POLLIN | select.POLLHUP)
+        if timeout is not None:
+            timeout = timeout * 1000
+        while True:
+            try:
+                return [fd for (fd, unused_event) in poller.poll(timeout)]
+            except select.error as e:
+                if e.args[0] != errno.EINTR:
+                    raise
+    while True:
+        try:
+            return select.select(fds, [], [], timeout)[0]
+        except select.error as e:
+            if e.args[0] != errno.EINTR:
+                raise
+
+_PROCESS_MONITOR = None
+_PROCESS_MONITOR_LOCK = threading.Lock()
+
+def _get_process_monitor():
+    """ Get the process monitor, starting it if needed """
+    global _PROCESS_MONITOR
+    with _PROCESS_MONITOR_LOCK:
+        if _PROCESS_MONITOR is None or not _PROCESS_MONITOR.is_alive():
+            _PROCESS_MONITOR = _ProcessMonitor()
+            _PROCESS_MONITOR.start()
+    return _PROCESS_MONITOR
+
 def str_from_signal(code):
     """ Return a description about what happened when the
     retcode of a program is less than zero
@@ -0,0 +1,169 @@
+## Copyright (c) 2012-2016 Aldebaran Robotics. All rights reserved.
+## Use of this source code is governed by a BSD-style license that can be
+## found in the COPYING file.
+
+""" Find out which CPUs can really be used by the current process,
+taking into account the CPU affinity, the cgroup CPU quotas (when
+running inside a container) and the NUMA nodes (Linux only)
+
+"""
+
+import math
+import multiprocessing
+import os
+import re
+
+import qisys.error
+
+PROC_STATUS = "/proc/self/status"
+NUMA_NODES_DIR = "/sys/devices/system/node"
+# cgroup v2, then cgroup v1
+CGROUP_CPU_MAX = "/sys/fs/cgroup/cpu.max"
+CGROUP_CFS_QUOTA = "/sys/fs/cgroup/cpu/cpu.cfs_quota_us"
+CGROUP_CFS_PERIOD = "/sys/fs/cgroup/cpu/cpu.cfs_period_us"
+
+def parse_cpu_list(text):
+    """ Parse a list of CPUs as written by the Linux kernel
+
+    >>> parse_cpu_list("0-3,8,10-11")
+    [0, 1, 2, 3, 8, 10, 11]
+
+    """
+    res = list()
+    for part in text.strip().split(","):
+        if not part:
+            continue
+        if "-" in part:
+            (start, end) = part.split("-")
+            res.extend(range(int(start), int(end) + 1))
+        else:
+            res.append(int(part))
+    return res
+
+def _read_file(path):
+    try:
+        with open(path, "r") as fp:
+            return fp.read()
+    except (IOError, OSError):
+        return None
+
+def _get_total_cpus():
+    try:
+        return multiprocessing.cpu_count()
+    except NotImplementedError:
+        return 1
+
+def get_allowed_cpus():
+    """ The list of the CPUs this process is allowed to run on """
+    status = _read_file(PROC_STATUS)
+    if status:
+        match = re.search(r"^Cpus_allowed_list:\s*(\S+)", status, re.MULTILINE)
+        if match:
+            res = parse_cpu_list(match.group(1))
+            if res:
+                return res
+    return range(_get_total_cpus())
+
+def get_cpu_quota():
+    """ The number of CPUs allowed by the cgroup CPU quota, as a float,
+    or None if there is no quota
+
+    """
+    cpu_max = _read_file(CGROUP_CPU_MAX)
+    if cpu_max:
+        values = cpu_max.split()
+        if len(values) == 2 and values[0] != "max":
+            return _get_quota(values[0], values[1])
+        return None
+    quota = _read_file(CGROUP_CFS_QUOTA)
+    period = _read_file(CGROUP_CFS_PERIOD)
+    if quota and period:
+        return _get_quota(quota, period)
+    return None
+
+def _get_quota(quota, period):
+    try:
+        quota = int(quota)
+        period = int(period)
+    except ValueError:
+        return None
+    if quota <= 0 or period <= 0:
+        return None
+    return float(quota) / period
+
+def cpu_count():
+    """ The number of CPUs this process can really use: the number
+    of allowed CPUs, limited by the cgroup CPU quota
+
+    """
+    res = len(get_allowed_cpus())
+    quota = get_cpu_quota()
+    if quota is not None:
+        res = min(res, int(math.ceil(quota)))
+    return max(res, 1)
+
+def has_cpu_limits():
+    """ Whether this process can use less CPUs than the
+    machine has, because of its affinity or of a cgroup CPU quota
+
+    """
+    return cpu_count() < _get_total_cpus()
+
+def get_numa_nodes(allowed_cpus=None):
+    """ The list of the allowed CPUs of each NUMA node.
+    When there is no NUMA information, all the CPUs are
+    considered to be on the same node
+
+    """
+    if allowed_cpus is None:
+        allowed_cpus = get_allowed_cpus()
+    res = list()
+    if os.path.isdir(NUMA_NODES_DIR):
+        node_names = [x for x in os.listdir(NUMA_NODES_DIR)
+                      if re.match(r"^node\d+$", x)]
+        node_names.sort(key=lambda x: int(x[4:]))
+        for node_name in node_names:
+            cpu_list = _read_file(os.path.join(NUMA_NODES_DIR, node_name, "cpulist"))
+            if cpu_list is None:
+                continue
+            cpus = [x for x in parse_cpu_list(cpu_list) if x in allowed_cpus]
+            if cpus:
+                res.append(cpus)
+    known = set(x for node in res for x in node)
+    others = [x for x in allowed_cpus if x not in known]
+    if others:
+        res.append(others)
+    return res
+
+def get_cpu_sets(num_cpus, nodes=None):
+    """ Split the CPUs in sets of ``num_cpus`` CPUs, each set being
+    on a single NUMA node when possible.
+
+    Sets are ordered so that consecutive sets are on different nodes,
+    spreading the load across the nodes.
+
+    """
+    if num_cpus <= 0:
+        raise qisys.error.Error("Invalid number of CPUs: %i" % num_cpus)
+    if nodes is None:
+        nodes = get_numa_nodes()
+    per_node = list()
+    for cpus in nodes:
+        sets = [cpus[i:i + num_cpus] for i in range(0, len(cpus), num_cpus)]
+        per_node.append([x for x in sets if len(x) == num_cpus])
+    res = list()
+    for i in range(max(len(x) for x in per_node)):
+        for sets in per_node:
+            if i < len(sets):
+                res.append(sets[i])
+    if res:
+        return res
+    # Nodes too small: do not care about NUMA
+    all_cpus = [x for cpus in nodes for x in cpus]
+    # Never put the same CPU twice in a set
+    set_size = min(num_cpus, len(all_cpus))
+    res = list()
+    for i in range(0, len(all_cpus), set_size):
+        cpu_set = [all_cpus[(i + j) % len(all_cpus)] for j in range(set_size)]
+        res.append(cpu_set)
+    return res
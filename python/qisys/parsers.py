@@ -6,9 +6,9 @@
 
 import abc
 import argparse
-import multiprocessing
 import os
 
+import qisys.cpu
 import qisys.error
 import qisys.sh
 import qisys.worktree
@@ -23,22 +23,33 @@ class SetHome(argparse.Action):
         qisys.sh.set_home(values)
 
 def cpu_count():
-    try:
-        default = multiprocessing.cpu_count()
-    except NotImplementedError:
-        default = 1
+    """ The number of CPUs really available, see :py:func:`qisys.cpu.cpu_count` """
+    return qisys.cpu.cpu_count()
 
-def parallel_parser(parser, default=cpu_count()):
+def parallel_parser(parser, default="auto"):
     """Given a parser, add the -j option.
 
     Sets variable 'num_jobs'.
-    Use the number of processors as the default
+    Use the number of available processors as the default
+    (see :py:func:`cpu_count`), computed only when the command
+    line is parsed
     """
-
+    help_default = "%(default)s"
+    if default == "auto":
+        help_default = "number of available CPUs"
     parser.add_argument("-j", "--njobs",
-        dest="num_jobs", type=int, default=default, metavar='N',
+        dest="num_jobs", type=_num_jobs, default=default, metavar='N',
         help="Specify the number of jobs to run simultaneously "
-             "(default: %(default)s)")
+             "(default: %s)" % help_default)
+
+def _num_jobs(value):
+    """ Type of the -j option. argparse only converts string defaults,
+    so the "auto" default is only resolved when it is used
+
+    """
+    if value == "auto":
+        return cpu_count()
+    return int(value)
 
 def log_parser(parser):
     """Given a parser, add the options controlling log."""
@@ -106,6 +117,18 @@ def deploy_parser(parser):
     group = parser.add_argument_group("deploy options")
     group.add_argument("--url", dest="urls", action="append",
                        help="deploy to each given url.", required=True)
+    group.add_argument("--checksum", action="store_true",
+                       help="compare every file with the ones on the target, "
+                            "instead of only sending the files that changed "
+                            "since the last deploy to this url. This is also "
+                            "done when the target was deployed to from "
+                            "somewhere else since the last deploy, which is "
+                            "detected with the files written in .qi-deploy/ "
+                            "on the target")
+    group.add_argument("-J", "--num-workers", dest="num_workers", type=int,
+                       help="number of urls to deploy to at the same time. "
+                            "Default: all of them")
+    parser.set_defaults(checksum=False)
 
 def get_deploy_urls(args):
     return [qisys.remote.URL(x) for x in args.urls]
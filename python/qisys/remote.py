@@ -7,17 +7,27 @@ downloading package or reading configs from URLs
 
 """
 
+import atexit
 import os
+import posixpath
 import re
 import sys
 import ftplib
+import hashlib
+import json
+import pipes
 import urlparse
 import urllib2
 import StringIO
+import subprocess
+import tempfile
+import threading
+import time
 
 from qisys import ui
 import qisys.error
 import qisys.command
+import qisys.parallel
 import qisys.sh
 
 import qibuild.config
@@ -57,10 +67,12 @@ def get_ftp_access(server_name):
         return (access.username, access.password, access.root)
 
 
-def authenticated_urlopen(location):
+def authenticated_urlopen(location, headers=None):
     """ A wrapper around urlopen adding authentication information
     if provided by the user.
 
+    :param headers: a dict of additional HTTP headers to send
+
     """
     passman = urllib2.HTTPPasswordMgrWithDefaultRealm()
     #pylint: disable-msg=E1103
@@ -73,8 +85,10 @@ def authenticated_urlopen(location):
             passman.add_password(None, location, user, password)
     authhandler = urllib2.HTTPBasicAuthHandler(passman)
     opener = urllib2.build_opener(authhandler)
-    urllib2.install_opener(opener)
-    return urllib2.urlopen(location)
+    # Do not use urllib2.install_opener() here: this function
+    # may be called from several threads at once
+    request = urllib2.Request(location, headers=headers or dict())
+    return opener.open(request)
 
 def open_remote_location(location, timeout=10):
     """ Open a file from an url
@@ -205,21 +219,68 @@ def download(url, output_dir, output_name=None,
 
     return dest_name
 
-def deploy(local_directory, remote_url, filelist=None):
-    """Deploy a local directory to a remote url."""
+# Directory written in the remote directory by deploy(), containing
+# the hash of the manifest of the last deploy of each manifest directory
+DEPLOY_MARKERS_DIR = ".qi-deploy"
+
+def deploy(local_directory, remote_url, filelist=None, manifest_dir=None,
+           checksum=False, progress=True):
+    """Deploy a local directory to a remote url.
+
+    :param filelist: a file containing the list of the paths to deploy,
+                     relative to ``local_directory``
+    :param manifest_dir: if set, a manifest of the deployed files is kept
+                         in this directory for each URL, and only the files
+                         that changed since the last deploy are sent.
+                         The hash of the manifest is also written on the
+                         target (see :py:func:`get_deploy_marker_path`):
+                         when it is missing or does not match, the target
+                         was changed by someone else, and every file is
+                         compared, as with ``checksum``
+    :param checksum: compare every file with the ones on the remote
+                     (slower), instead of using the manifest
+    :param progress: display the progress of the transfer of each file
+
+    """
     # ensure destination directory exist before deploying data
     if not (remote_url.host and remote_url.remote_directory):
         message = "Remote URL is invalid; host and remote directory must be specified"
         raise qisys.error.Error(message)
 
     user = "%s@" % remote_url.user if remote_url.user else ""
-
-    cmd = ["ssh"]
+    ssh_options = get_ssh_options(remote_url.host, user=remote_url.user,
+                                  port=remote_url.port)
+    ssh_cmd = ["ssh"] + ssh_options
     if remote_url.port:
-        cmd.extend(["-p", str(remote_url.port)])
-
-    cmd.extend(["%s%s" % (user, remote_url.host)])
-    cmd.extend(["mkdir", "-p", remote_url.remote_directory])
+        ssh_cmd.extend(["-p", str(remote_url.port)])
+    ssh_cmd.extend(["%s%s" % (user, remote_url.host)])
+
+    manifest_path = None
+    previous = dict()
+    if manifest_dir:
+        manifest_path = get_deploy_manifest_path(manifest_dir, remote_url)
+        marker_path = get_deploy_marker_path(manifest_dir, remote_url)
+        if not checksum:
+            previous = read_deploy_manifest(manifest_path)
+        if previous:
+            marker = _read_deploy_marker(ssh_cmd, marker_path)
+            if marker != get_deploy_manifest_hash(previous):
+                ui.info(ui.brown, "The target changed since the last deploy to",
+                        ui.blue, remote_url.as_string + ",", ui.reset,
+                        ui.brown, "comparing every file")
+                previous = dict()
+        current = get_deploy_manifest(local_directory, filelist=filelist,
+                                      previous=previous)
+        if previous:
+            delta = get_deploy_delta(previous, current)
+            if not delta:
+                ui.info(ui.green, "Nothing changed since the last deploy to",
+                        ui.blue, remote_url.as_string)
+                return
+            ui.info(ui.green, "Deploying", len(delta), "changed file(s) to",
+                    ui.blue, remote_url.as_string)
+
+    cmd = ssh_cmd + ["mkdir", "-p", remote_url.remote_directory]
     qisys.command.call(cmd)
     # This is required for rsync to do the right thing,
     # otherwise the basename of local_directory gets
@@ -231,17 +292,333 @@ def deploy(local_directory, remote_url, filelist=None):
         "--perms",
         "--times",
         "--specials",
-        "--progress", # print a progress bar
-        "--checksum", # verify checksum instead of size and date
         "--exclude=.debug/"]
+    if progress:
+        cmd.append("--progress") # print a progress bar
+    if previous:
+        # Only send the delta, which is known to have changed
+        cmd.append("--ignore-times")
+    else:
+        cmd.append("--checksum") # verify checksum instead of size and date
+    rsh = ["ssh"] + ssh_options
     if remote_url.port:
-        cmd.extend(["-e", "ssh -p %d" % remote_url.port])
+        rsh.extend(["-p", str(remote_url.port)])
+    if len(rsh) > 1:
+        cmd.extend(["-e", " ".join(rsh)])
+    with qisys.sh.TempDir() as tmp:
+        if previous:
+            filelist = os.path.join(tmp, "delta.txt")
+            with open(filelist, "w") as fp:
+                fp.write("\n".join(delta))
+        if filelist:
+            cmd.append("--files-from=%s" % filelist)
+        cmd.append(local_directory)
+        cmd.append("%s%s:%s" % (user, remote_url.host, remote_url.remote_directory))
+        qisys.command.call(cmd)
+
+    if manifest_path:
+        marker_cmd = "mkdir -p %s && echo %s > %s" % (
+            pipes.quote(posixpath.dirname(marker_path)),
+            get_deploy_manifest_hash(current), pipes.quote(marker_path))
+        qisys.command.call(ssh_cmd + [marker_cmd])
+        write_deploy_manifest(manifest_path, current)
+
+def _read_deploy_marker(ssh_cmd, marker_path):
+    """ Read the hash of the manifest of the last deploy from the
+    target, or None if there is none
+
+    """
+    cmd = ssh_cmd + ["cat %s 2>/dev/null" % pipes.quote(marker_path)]
+    try:
+        return qisys.command.check_output(cmd).strip()
+    except qisys.command.CommandFailedException:
+        return None
+
+# How long to wait for the master connection to be established
+SSH_MASTER_TIMEOUT = 10
+
+_SSH_MASTERS = dict()
+_SSH_MASTERS_LOCK = threading.Lock()
+_SSH_CONTROL_DIR = None
+
+def get_ssh_options(host, user=None, port=None):
+    """ Get the options to give to ssh or scp (or to ssh in ``rsync -e``),
+    so that they use a master connection (ControlMaster) shared by all
+    the connections to the same (user, host, port).
+
+    The master connection is started on the first call, and closed when
+    the command exits. When it cannot be started (for instance because a
+    password is required), an empty list is returned and every ssh call
+    opens its own connection, as usual.
+
+    """
+    if os.name == "nt" or not host:
+        return list()
+    global _SSH_CONTROL_DIR
+    key = (user, host, port)
+    with _SSH_MASTERS_LOCK:
+        master = _SSH_MASTERS.get(key)
+        if not master:
+            if not _SSH_CONTROL_DIR:
+                # Keep the path short: the length of the path of
+                # Unix sockets is limited
+                _SSH_CONTROL_DIR = tempfile.mkdtemp(prefix="qi-ssh-")
+                atexit.register(close_ssh_connections)
+            name = hashlib.sha1("%s@%s:%s" % key).hexdigest()[:12]
+            control_path = os.path.join(_SSH_CONTROL_DIR, name)
+            master = SSHMaster(host, user=user, port=port,
+                               control_path=control_path)
+            _SSH_MASTERS[key] = master
+    # Do not hold the global lock while connecting, so that
+    # masters to several hosts can be started in parallel
+    if not master.start():
+        return list()
+    return ["-o", "ControlPath=%s" % master.control_path]
+
+def close_ssh_connections():
+    """ Close all the master connections """
+    global _SSH_CONTROL_DIR
+    with _SSH_MASTERS_LOCK:
+        for master in _SSH_MASTERS.values():
+            master.stop()
+        _SSH_MASTERS.clear()
+        if _SSH_CONTROL_DIR:
+            qisys.sh.rm(_SSH_CONTROL_DIR)
+            _SSH_CONTROL_DIR = None
+
+
+class SSHMaster(object):
+    """ A ssh master connection, listening on ``control_path`` """
+    def __init__(self, host, user=None, port=None, control_path=None):
+        self.host = host
+        self.user = user
+        self.port = port
+        self.control_path = control_path
+        self.process = None
+        self.ok = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        """ Start the master connection if needed, and return
+        True if it can be used
+
+        """
+        with self._lock:
+            if self.ok is None:
+                self.ok = self._start()
+            return self.ok
+
+    def _start(self):
+        cmd = ["ssh", "-M", "-N",
+               # Never ask for a password in the background
+               "-o", "BatchMode=yes",
+               "-o", "ControlPath=%s" % self.control_path]
+        if self.port:
+            cmd.extend(["-p", str(self.port)])
+        if self.user:
+            cmd.append("%s@%s" % (self.user, self.host))
+        else:
+            cmd.append(self.host)
+        ui.debug("Starting ssh master connection:", cmd)
+        devnull = open(os.devnull, "r+")
+        try:
+            self.process = subprocess.Popen(cmd, stdin=devnull, stdout=devnull,
+                                            stderr=devnull, close_fds=True)
+        except OSError as e:
+            ui.debug("Could not start ssh master connection:", e)
+            return False
+        finally:
+            devnull.close()
+        deadline = time.time() + SSH_MASTER_TIMEOUT
+        while time.time() < deadline:
+            if os.path.exists(self.control_path):
+                return True
+            if self.process.poll() is not None:
+                ui.debug("ssh master connection to", self.host, "failed")
+                return False
+            time.sleep(0.05)
+        ui.debug("Timeout while starting ssh master connection to", self.host)
+        self.stop()
+        return False
+
+    def stop(self):
+        if self.process and self.process.poll() is None:
+            self.process.terminate()
+            self.process.wait()
+        self.process = None
+
+
+def deploy_to_urls(urls, deploy_function, num_workers=None):
+    """ Call ``deploy_function(url, progress=...)`` for each url, deploying
+    to at most ``num_workers`` urls at the same time (default: all of them).
+
+    When there are several urls, a summary is displayed at the end, and
+    an error is raised if any deploy failed
+
+    """
+    if len(urls) == 1:
+        deploy_function(urls[0], progress=True)
+        return
+    if not num_workers:
+        num_workers = len(urls)
+    num_workers = max(1, min(num_workers, len(urls)))
+    # Progress bars of several rsync processes would be mixed up
+    progress = (num_workers == 1)
+    results = dict()
+    lock = threading.Lock()
+    def deploy_one(url):
+        start = time.time()
+        error = None
+        try:
+            deploy_function(url, progress=progress)
+        # SystemExit would silently stop the thread
+        except (Exception, SystemExit) as e:
+            error = e
+            ui.error("Deploy to", url.as_string, "failed:", e)
+        else:
+            ui.info(ui.green, "Deploy to", ui.blue, url.as_string,
+                    ui.green, "done")
+        with lock:
+            results[url.as_string] = (error, time.time() - start)
+    qisys.parallel.foreach(urls, deploy_one, n_jobs=num_workers)
+
+    ui.info(ui.bold, "Deploy summary:")
+    max_len = max(len(x.as_string) for x in urls)
+    failed = list()
+    for url in urls:
+        (error, elapsed) = results[url.as_string]
+        name = url.as_string.ljust(max_len + 2)
+        if error:
+            failed.append(url.as_string)
+            ui.info(" ", ui.red, "[FAIL]", ui.reset, name, error)
+        else:
+            ui.info(" ", ui.green, "[OK]  ", ui.reset, name,
+                    "%.1fs" % elapsed)
+    if failed:
+        raise qisys.error.Error("Deploy failed for %i url(s): %s" % (
+                                len(failed), ", ".join(failed)))
+
+def get_url_key(remote_url):
+    """ A key identifying the remote url, usable as a file name """
+    key = "%s@%s:%s/%s" % (remote_url.user, remote_url.host, remote_url.port,
+                           remote_url.remote_directory)
+    return hashlib.sha1(key).hexdigest()[:16]
+
+def get_deploy_manifest_path(manifest_dir, remote_url):
+    """ Path of the manifest of the files deployed to the given URL """
+    return os.path.join(manifest_dir, "%s.json" % get_url_key(remote_url))
+
+def read_deploy_manifest(manifest_path):
+    """ Read a deploy manifest, returning an empty dict when it
+    does not exist or is invalid
+
+    """
+    if not os.path.exists(manifest_path):
+        return dict()
+    try:
+        with open(manifest_path, "r") as fp:
+            return json.load(fp)["files"]
+    except (ValueError, KeyError, TypeError):
+        ui.warning("Ignoring invalid deploy manifest:", manifest_path)
+        return dict()
+
+def write_deploy_manifest(manifest_path, files):
+    qisys.sh.mkdir(os.path.dirname(manifest_path), recursive=True)
+    with open(manifest_path, "w") as fp:
+        json.dump({"files" : files}, fp, indent=2, sort_keys=True)
+
+def get_deploy_marker_path(manifest_dir, remote_url):
+    """ Path on the target of the file containing the hash of the
+    manifest of the last deploy.
+
+    The name of the file only depends on the path of the manifest
+    directory relative to the ``.qi`` directory, so that deploying the
+    same thing from another worktree or another machine changes it
+
+    """
+    parts = os.path.normpath(manifest_dir).split(os.sep)
+    if ".qi" in parts:
+        parts = parts[len(parts) - parts[::-1].index(".qi"):]
+    name = hashlib.sha1("/".join(parts)).hexdigest()[:16]
+    return posixpath.join(remote_url.remote_directory, DEPLOY_MARKERS_DIR, name)
+
+def get_deploy_manifest_hash(files):
+    """ A hash of the manifest of the deployed files, written on
+    the target after each deploy
+
+    """
+    data = json.dumps(files, sort_keys=True)
+    return hashlib.sha1(data).hexdigest()
+
+def get_deploy_manifest(local_directory, filelist=None, previous=None):
+    """ Get the manifest of the files to deploy:
+    a dict relative path -> {"size", "mtime", "hash"}
+
+    Files are only hashed when their size or mtime differ from
+    the ones in the previous manifest
+
+    """
+    if previous is None:
+        previous = dict()
     if filelist:
-        cmd.append("--files-from=%s" % filelist)
-    cmd.append(local_directory)
-    cmd.append("%s%s:%s" % (user, remote_url.host, remote_url.remote_directory))
-    qisys.command.call(cmd)
+        with open(filelist, "r") as fp:
+            rel_paths = [x.strip() for x in fp.read().splitlines() if x.strip()]
+    else:
+        rel_paths = ["."]
+    res = dict()
+    for rel_path in _walk_deploy_paths(local_directory, rel_paths):
+        full_path = os.path.join(local_directory, rel_path)
+        st = os.lstat(full_path)
+        entry = {"size" : st.st_size, "mtime" : st.st_mtime}
+        old_entry = previous.get(rel_path)
+        if old_entry and old_entry.get("size") == entry["size"] and \
+                old_entry.get("mtime") == entry["mtime"]:
+            entry["hash"] = old_entry.get("hash")
+        else:
+            entry["hash"] = _hash_file(full_path)
+        res[rel_path] = entry
+    return res
+
+def get_deploy_delta(previous, current):
+    """ The sorted list of the paths whose contents changed """
+    res = list()
+    for rel_path, entry in current.iteritems():
+        old_entry = previous.get(rel_path)
+        if not old_entry or old_entry.get("hash") != entry["hash"]:
+            res.append(rel_path)
+    res.sort()
+    return res
+
+def _walk_deploy_paths(local_directory, rel_paths):
+    """ Yield the paths of the files (and links) to deploy, going through
+    the directories, like rsync --recursive --exclude=.debug/ does
 
+    """
+    for rel_path in rel_paths:
+        full_path = os.path.join(local_directory, rel_path)
+        if os.path.islink(full_path) or os.path.isfile(full_path):
+            yield os.path.normpath(rel_path).replace(os.sep, "/")
+        elif os.path.isdir(full_path):
+            for (root, directories, filenames) in os.walk(full_path):
+                directories[:] = [x for x in directories if x != ".debug"]
+                for entry in filenames + [x for x in directories
+                                          if os.path.islink(os.path.join(root, x))]:
+                    path = os.path.relpath(os.path.join(root, entry),
+                                           local_directory)
+                    yield path.replace(os.sep, "/")
+
+def _hash_file(full_path):
+    hasher = hashlib.sha1()
+    if os.path.islink(full_path):
+        hasher.update("link:" + os.readlink(full_path))
+        return hasher.hexdigest()
+    with open(full_path, "rb") as fp:
+        while True:
+            chunk = fp.read(1024 * 1024)
+            if not chunk:
+                break
+            hasher.update(chunk)
+    return hasher.hexdigest()
 
 
 class URLParseError(qisys.error.Error):
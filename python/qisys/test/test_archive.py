@@ -9,12 +9,16 @@
 import os
 import sys
 import stat
+import StringIO
+import tarfile
 import zipfile
+import zlib
 
 import pytest
 
 import qisys
 
+import qisys.command
 import qisys.error
 from qisys.archive import compress
 from qisys.archive import extract
@@ -22,9 +26,8 @@ from qisys.archive import guess_algo
 
 from qisys.test.conftest import skip_on_win
 
-# We don't use the stdlib for tar: it does not have
-# all the features `tar` has and is slower, so all tar tests
-# are disabled on Windows
+# xz and zstd archives need the `xz` and `zstd` programs,
+# which are not always installed
 
 
 def test_create_extract_zip_simple(tmpdir):
@@ -188,3 +191,197 @@ def test_returned_value_when_extracting_flat_package(tmpdir):
     dest = tmpdir.mkdir("dest")
     res = qisys.archive.extract(archive, dest.strpath, strict_mode=False)
     assert res == dest.strpath
+
+@skip_on_win
+def test_extract_zip_in_parallel(tmpdir, monkeypatch):
+    monkeypatch.setattr(qisys.archive, "PARALLEL_MIN_SIZE", 0)
+    src = tmpdir.mkdir("src")
+    for i in range(50):
+        src.ensure("lib", "lib%i.so" % i).write("lib %i\n" % i * (i + 1))
+    src.ensure("bin", "foo").write("#!/bin/sh\n")
+    src.join("bin", "foo").chmod(0755)
+    src.join("lib", "libfoo.so").mksymlinkto("lib0.so")
+    res = qisys.archive.compress(src.strpath)
+    dest = tmpdir.mkdir("dest")
+    qisys.archive.extract(res, dest.strpath)
+    for i in range(50):
+        assert dest.join("src", "lib", "lib%i.so" % i).read() == \
+            "lib %i\n" % i * (i + 1)
+    assert os.access(dest.join("src", "bin", "foo").strpath, os.X_OK)
+    assert dest.join("src", "lib", "libfoo.so").islink()
+
+@pytest.mark.parametrize("num_workers", [1, 4])
+def test_extract_zip_with_unsafe_members(tmpdir, num_workers):
+    zip_path = tmpdir.join("evil.zip").strpath
+    archive = zipfile.ZipFile(zip_path, "w")
+    archive.writestr("top/", "")
+    archive.writestr("top/ok.txt", "ok\n")
+    archive.writestr("top/../../escaped.txt", "escaped\n")
+    archive.writestr(zipfile.ZipInfo("/absolute.txt"), "absolute\n")
+    archive.close()
+    dest = tmpdir.mkdir("a").mkdir("dest")
+    qisys.archive._extract_zip(zip_path, dest.strpath, quiet=True,
+                               verbose=False, strict_mode=False,
+                               num_workers=num_workers)
+    assert dest.join("top", "ok.txt").read() == "ok\n"
+    assert not tmpdir.join("escaped.txt").check()
+    assert not tmpdir.join("a", "escaped.txt").check()
+    assert not dest.join("escaped.txt").check()
+    assert not dest.join("absolute.txt").check()
+
+def test_compress_zip_reproducible(tmpdir):
+    src = tmpdir.mkdir("src")
+    src.ensure("a", "b.txt").write("b\n")
+    src.ensure("c.txt").write("c\n")
+    first = qisys.archive.compress(src.strpath, reproducible=True,
+                                   output=tmpdir.join("first.zip").strpath)
+    src.join("c.txt").setmtime(src.join("c.txt").mtime() + 100)
+    second = qisys.archive.compress(src.strpath, reproducible=True,
+                                    output=tmpdir.join("second.zip").strpath)
+    with open(first, "rb") as fp1:
+        with open(second, "rb") as fp2:
+            assert fp1.read() == fp2.read()
+
+def test_compress_zip_compression_level(tmpdir):
+    src = tmpdir.mkdir("src")
+    src.ensure("foo.txt").write("foo\n" * 1000)
+    src.ensure("foo.png").write("png\n" * 1000)
+    stored = qisys.archive.compress(src.strpath, compression_level=0,
+                                    output=tmpdir.join("stored.zip").strpath)
+    deflated = qisys.archive.compress(src.strpath, compression_level=9,
+                                      output=tmpdir.join("deflated.zip").strpath)
+    with zipfile.ZipFile(stored) as archive:
+        assert archive.getinfo("src/foo.txt").compress_type == zipfile.ZIP_STORED
+    with zipfile.ZipFile(deflated) as archive:
+        assert archive.getinfo("src/foo.txt").compress_type == zipfile.ZIP_DEFLATED
+        # already compressed files are never deflated
+        assert archive.getinfo("src/foo.png").compress_type == zipfile.ZIP_STORED
+        assert archive.testzip() is None
+    dest = tmpdir.mkdir("dest")
+    qisys.archive.extract(deflated, dest.strpath)
+    assert dest.join("src", "foo.txt").read() == "foo\n" * 1000
+
+def test_compress_zip_in_parallel(tmpdir, monkeypatch):
+    monkeypatch.setattr(qisys.archive, "PARALLEL_MIN_SIZE", 0)
+    src = tmpdir.mkdir("src")
+    for i in range(50):
+        src.ensure("lib", "lib%i.so" % i).write("lib %i\n" % i * (i + 1))
+    res = qisys.archive.compress(src.strpath)
+    with zipfile.ZipFile(res) as archive:
+        names = archive.namelist()
+        assert names == sorted(names)
+        assert archive.testzip() is None
+        assert archive.read("src/lib/lib42.so") == "lib 42\n" * 43
+
+def test_compress_zip_zero_workers(tmpdir):
+    src = tmpdir.mkdir("src")
+    src.ensure("a.txt").write("a\n")
+    src.ensure("b.txt").write("b\n")
+    output = tmpdir.join("src.zip").strpath
+    qisys.archive._compress_zip(src.strpath, output=output, num_workers=0)
+    with zipfile.ZipFile(output) as archive:
+        assert archive.read("src/a.txt") == "a\n"
+        assert archive.read("src/b.txt") == "b\n"
+
+@pytest.mark.parametrize("algo", ["tar", "gzip", "bzip2", "xz", "zstd"])
+def test_create_extract_tar_algos(tmpdir, algo):
+    if algo in qisys.archive.COMPRESS_PROGRAMS and \
+            not qisys.command.find_program(algo):
+        pytest.skip("%s not installed" % algo)
+    src = tmpdir.mkdir("foo")
+    src.ensure("a", "b.txt").write("b\n")
+    src.ensure("bin", "foo").write("#!/bin/sh\n")
+    src.join("bin", "foo").chmod(0755)
+    res = qisys.archive.compress(src.strpath, algo=algo)
+    assert qisys.archive.guess_algo(res) == algo or algo == "tar"
+    dest = tmpdir.mkdir("dest")
+    extracted = qisys.archive.extract(res, dest.strpath, algo=algo)
+    assert extracted == dest.join("foo").strpath
+    assert dest.join("foo", "a", "b.txt").read() == "b\n"
+    assert os.access(dest.join("foo", "bin", "foo").strpath, os.X_OK)
+
+@skip_on_win
+def test_extract_tar_symlinks_and_ro_dirs(tmpdir):
+    src = tmpdir.mkdir("foo")
+    src.ensure("lib", "libfoo.so.42", file=True)
+    src.join("lib", "libfoo.so").mksymlinkto("libfoo.so.42")
+    src.join("lib").chmod(0555)
+    try:
+        res = qisys.archive.compress(src.strpath, algo="gzip")
+    finally:
+        src.join("lib").chmod(0755)
+    dest = tmpdir.mkdir("dest")
+    qisys.archive.extract(res, dest.strpath)
+    assert dest.join("foo", "lib", "libfoo.so").islink()
+    lib_mode = os.stat(dest.join("foo", "lib").strpath).st_mode
+    assert stat.S_IMODE(lib_mode) == 0555
+    dest.join("foo", "lib").chmod(0755)
+
+def test_extract_concatenated_gzip_streams(tmpdir):
+    src = tmpdir.mkdir("foo")
+    src.ensure("a.txt").write("a\n")
+    res = qisys.archive.compress(src.strpath, algo="gzip")
+    # add some trailing garbage, as in gentoo binary packages
+    with open(res, "ab") as fp:
+        fp.write(gzip_compress("") + "XPAKPACK")
+    dest = tmpdir.mkdir("dest")
+    qisys.archive.extract(res, dest.strpath)
+    assert dest.join("foo", "a.txt").read() == "a\n"
+
+def gzip_compress(data):
+    compressor = zlib.compressobj(9, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    return compressor.compress(data) + compressor.flush()
+
+def test_compress_zip64(tmpdir, monkeypatch):
+    # Force the zip64 extensions even for small files
+    monkeypatch.setattr(qisys.archive, "ZIP64_LIMIT", 0)
+    src = tmpdir.mkdir("src")
+    src.ensure("a.txt").write("a" * 1000)
+    src.ensure("b", "b.txt").write("b\n")
+    src.join("link").mksymlinkto("a.txt")
+    res = qisys.archive.compress(src.strpath)
+    archive = zipfile.ZipFile(res)
+    assert archive.testzip() is None
+    assert archive.read("src/a.txt") == "a" * 1000
+    archive.close()
+    dest = tmpdir.mkdir("dest")
+    qisys.archive.extract(res, dest.strpath)
+    assert dest.join("src", "b", "b.txt").read() == "b\n"
+    assert dest.join("src", "link").islink()
+
+@skip_on_win
+def test_extract_tar_through_symlink(tmpdir):
+    outside = tmpdir.mkdir("outside")
+    tar_path = tmpdir.join("evil.tar").strpath
+    tar = tarfile.open(tar_path, "w")
+    link = tarfile.TarInfo("top/evil")
+    link.type = tarfile.SYMTYPE
+    link.linkname = outside.strpath
+    tar.addfile(link)
+    data = "pwned\n"
+    member = tarfile.TarInfo("top/evil/passwd")
+    member.size = len(data)
+    tar.addfile(member, StringIO.StringIO(data))
+    tar.close()
+    dest = tmpdir.mkdir("dest")
+    qisys.archive.extract(tar_path, dest.strpath, algo="tar")
+    assert not outside.join("passwd").check()
+
+@skip_on_win
+def test_compress_tar_failure_cleans_up(tmpdir, monkeypatch):
+    bin_dir = tmpdir.mkdir("bin")
+    fake_xz = bin_dir.join("xz")
+    fake_xz.write("#!/bin/sh\nexec cat\n")
+    fake_xz.chmod(0755)
+    monkeypatch.setenv("PATH", bin_dir.strpath + os.pathsep + os.environ["PATH"])
+    monkeypatch.setattr(qisys.command, "_FIND_PROGRAM_CACHE", dict())
+    def failing_add(*args, **kwargs):
+        raise tarfile.TarError("disk full")
+    monkeypatch.setattr(tarfile.TarFile, "add", failing_add)
+    src = tmpdir.mkdir("src")
+    src.ensure("a.txt").write("a\n")
+    output = tmpdir.join("src.tar.xz")
+    with pytest.raises(qisys.error.Error) as e:
+        qisys.archive.compress(src.strpath, algo="xz", output=output.strpath)
+    assert "disk full" in str(e.value)
+    assert not output.check()
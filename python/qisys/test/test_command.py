@@ -0,0 +1,141 @@
+## Copyright (c) 2012-2016 Aldebaran Robotics. All rights reserved.
+## Use of this source code is governed by a BSD-style license that can be
+## found in the COPYING file.
+
+import sys
+import threading
+import time
+
+import qisys.command
+from qisys.command import Process, OutputBuffer
+
+def test_process_ok():
+    process = Process([sys.executable, "-c", "print 'hello'"])
+    process.run()
+    assert process.return_type == Process.OK
+    assert process.returncode == 0
+    assert process.out == "hello\n"
+
+def test_process_failed():
+    process = Process([sys.executable, "-c",
+                       "import sys; sys.stdout.write('oops'); sys.exit(2)"])
+    process.run()
+    assert process.return_type == Process.FAILED
+    assert process.returncode == 2
+    assert process.out == "oops"
+
+def test_process_not_run():
+    process = Process(["/does/not/exist"])
+    process.run()
+    assert process.return_type == Process.NOT_RUN
+    assert process.exception
+
+def test_process_big_output():
+    process = Process([sys.executable, "-c", "print 'x' * 1000000"])
+    process.run()
+    assert process.return_type == Process.OK
+    assert len(process.out) == 1000001
+
+def test_process_not_captured():
+    process = Process([sys.executable, "-c", "pass"], capture=False)
+    process.run()
+    assert process.return_type == Process.OK
+    assert process.out == ""
+
+def test_process_timeout():
+    process = Process([sys.executable, "-c",
+                       "import sys, time\n"
+                       "sys.stdout.write('start')\n"
+                       "sys.stdout.flush()\n"
+                       "time.sleep(60)\n"])
+    start = time.time()
+    process.run(timeout=0.5)
+    assert process.return_type == Process.TIME_OUT
+    assert process.out == "start"
+    assert time.time() - start < 5
+
+def test_process_ignoring_sigterm():
+    process = Process([sys.executable, "-c",
+                       "import signal, time\n"
+                       "signal.signal(signal.SIGTERM, signal.SIG_IGN)\n"
+                       "time.sleep(60)\n"])
+    qisys.command._get_process_monitor().KILL_DELAY = 0.5
+    try:
+        process.run(timeout=0.5)
+    finally:
+        qisys.command._get_process_monitor().KILL_DELAY = 5
+    assert process.return_type == Process.ZOMBIE
+
+def test_many_processes_in_parallel():
+    processes = [Process([sys.executable, "-c", "import time; time.sleep(0.5); print %i" % i])
+                 for i in range(10)]
+    threads = [threading.Thread(target=x.run) for x in processes]
+    start = time.time()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert time.time() - start < 5
+    for i, process in enumerate(processes):
+        assert process.return_type == Process.OK
+        assert process.out == "%i\n" % i
+
+def run_in_thread(process, timeout=None):
+    thread = threading.Thread(target=process.run, kwargs={"timeout" : timeout})
+    thread.daemon = True
+    thread.start()
+    thread.join(10)
+    assert not thread.is_alive()
+
+def test_error_while_watching_process(monkeypatch):
+    def broken_read(self):
+        raise IOError("Kaboom")
+    monkeypatch.setattr(qisys.command._WatchedProcess, "read", broken_read)
+    process = Process([sys.executable, "-c", "print 'hello'"])
+    run_in_thread(process)
+    assert process.return_type == Process.FAILED
+    assert "Kaboom" in str(process.exception)
+    monkeypatch.undo()
+    process = Process([sys.executable, "-c", "print 'hello'"])
+    run_in_thread(process)
+    assert process.return_type == Process.OK
+    assert process.out == "hello\n"
+
+def test_dead_process_monitor_is_restarted(monkeypatch):
+    dead_monitor = qisys.command._ProcessMonitor()
+    monkeypatch.setattr(qisys.command, "_PROCESS_MONITOR", dead_monitor)
+    process = Process([sys.executable, "-c", "print 'hello'"])
+    run_in_thread(process)
+    assert process.return_type == Process.OK
+    assert qisys.command._PROCESS_MONITOR is not dead_monitor
+
+def test_output_buffer_unlimited():
+    output = OutputBuffer()
+    output.write("foo")
+    output.write("bar")
+    assert output.getvalue() == "foobar"
+    assert output.size == 6
+
+def test_output_buffer_keeps_head_and_tail(tmpdir):
+    log = tmpdir.join("out.log")
+    output = OutputBuffer(max_size=18, output_file=log.strpath)
+    for i in range(100):
+        output.write("%02i\n" % i)
+    output.close()
+    value = output.getvalue()
+    assert value.startswith("00\n01\n02\n\n[... 282 bytes skipped")
+    assert value.endswith("97\n98\n99\n")
+    assert "bytes skipped, see %s" % log.strpath in value
+    assert output.size == 300
+    assert log.read() == "".join("%02i\n" % i for i in range(100))
+
+def test_process_max_output_size(tmpdir):
+    log = tmpdir.join("out.log")
+    process = Process([sys.executable, "-c", "print 'x' * 1000000 + 'end'"],
+                      output_file=log.strpath, max_output_size=1024)
+    process.run()
+    assert process.return_type == Process.OK
+    assert process.output_size == 1000004
+    assert len(process.out) < 2048
+    assert process.out.endswith("end\n")
+    assert len(log.read()) == 1000004
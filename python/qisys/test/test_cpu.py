@@ -0,0 +1,81 @@
+## Copyright (c) 2012-2016 Aldebaran Robotics. All rights reserved.
+## Use of this source code is governed by a BSD-style license that can be
+## found in the COPYING file.
+
+import qisys.cpu
+import qisys.error
+
+import pytest
+
+def test_parse_cpu_list():
+    assert qisys.cpu.parse_cpu_list("0-3,8,10-11\n") == [0, 1, 2, 3, 8, 10, 11]
+    assert qisys.cpu.parse_cpu_list("5") == [5]
+
+def test_allowed_cpus(tmpdir, monkeypatch):
+    status = tmpdir.join("status")
+    status.write("Name:\tpython\nCpus_allowed:\tf0\nCpus_allowed_list:\t4-7\n")
+    monkeypatch.setattr(qisys.cpu, "PROC_STATUS", status.strpath)
+    assert qisys.cpu.get_allowed_cpus() == [4, 5, 6, 7]
+
+def test_cpu_count_with_quota(tmpdir, monkeypatch):
+    status = tmpdir.join("status")
+    status.write("Cpus_allowed_list:\t0-15\n")
+    cpu_max = tmpdir.join("cpu.max")
+    monkeypatch.setattr(qisys.cpu, "PROC_STATUS", status.strpath)
+    monkeypatch.setattr(qisys.cpu, "CGROUP_CPU_MAX", cpu_max.strpath)
+    cpu_max.write("max 100000\n")
+    assert qisys.cpu.cpu_count() == 16
+    cpu_max.write("250000 100000\n")
+    assert qisys.cpu.get_cpu_quota() == 2.5
+    assert qisys.cpu.cpu_count() == 3
+    cpu_max.write("50000 100000\n")
+    assert qisys.cpu.cpu_count() == 1
+
+def test_cpu_count_with_cgroup_v1(tmpdir, monkeypatch):
+    status = tmpdir.join("status")
+    status.write("Cpus_allowed_list:\t0-3\n")
+    quota = tmpdir.join("cpu.cfs_quota_us")
+    period = tmpdir.join("cpu.cfs_period_us")
+    monkeypatch.setattr(qisys.cpu, "PROC_STATUS", status.strpath)
+    monkeypatch.setattr(qisys.cpu, "CGROUP_CPU_MAX",
+                        tmpdir.join("nope").strpath)
+    monkeypatch.setattr(qisys.cpu, "CGROUP_CFS_QUOTA", quota.strpath)
+    monkeypatch.setattr(qisys.cpu, "CGROUP_CFS_PERIOD", period.strpath)
+    quota.write("-1\n")
+    period.write("100000\n")
+    assert qisys.cpu.cpu_count() == 4
+    quota.write("200000\n")
+    assert qisys.cpu.cpu_count() == 2
+
+def test_numa_nodes(tmpdir, monkeypatch):
+    nodes_dir = tmpdir.mkdir("node")
+    nodes_dir.ensure("node0", "cpulist").write("0-3\n")
+    nodes_dir.ensure("node1", "cpulist").write("4-7\n")
+    nodes_dir.ensure("possible")
+    monkeypatch.setattr(qisys.cpu, "NUMA_NODES_DIR", nodes_dir.strpath)
+    nodes = qisys.cpu.get_numa_nodes(allowed_cpus=[1, 2, 3, 4, 5])
+    assert nodes == [[1, 2, 3], [4, 5]]
+
+def test_numa_nodes_not_available(tmpdir, monkeypatch):
+    monkeypatch.setattr(qisys.cpu, "NUMA_NODES_DIR",
+                        tmpdir.join("nope").strpath)
+    assert qisys.cpu.get_numa_nodes(allowed_cpus=[0, 1]) == [[0, 1]]
+
+def test_cpu_sets_stay_on_one_node():
+    nodes = [[0, 1, 2, 3, 4], [5, 6, 7, 8, 9]]
+    cpu_sets = qisys.cpu.get_cpu_sets(2, nodes=nodes)
+    assert cpu_sets == [[0, 1], [5, 6], [2, 3], [7, 8]]
+
+def test_cpu_sets_nodes_too_small():
+    nodes = [[0, 1], [2, 3]]
+    cpu_sets = qisys.cpu.get_cpu_sets(3, nodes=nodes)
+    assert cpu_sets == [[0, 1, 2], [3, 0, 1]]
+
+def test_cpu_sets_more_cpus_than_available():
+    cpu_sets = qisys.cpu.get_cpu_sets(3, nodes=[[0, 1]])
+    assert cpu_sets == [[0, 1]]
+
+def test_cpu_sets_invalid_num_cpus():
+    # pylint: disable-msg=E1101
+    with pytest.raises(qisys.error.Error):
+        qisys.cpu.get_cpu_sets(0, nodes=[[0, 1]])
@@ -2,6 +2,9 @@
 ## Use of this source code is governed by a BSD-style license that can be
 ## found in the COPYING file.
 
+import argparse
+
+import qisys.cpu
 import qisys.error
 import qisys.parsers
 import qisys.worktree
@@ -122,3 +125,13 @@ def test_non_existing_cwd(tmpdir, monkeypatch, args):
     with pytest.raises(qisys.error.Error) as e:
         qisys.parsers.get_worktree(args)
     assert "not an existing directory" in e.value.args[0]
+
+def test_default_num_jobs_is_computed_when_parsing(monkeypatch):
+    parser = argparse.ArgumentParser()
+    qisys.parsers.parallel_parser(parser)
+    monkeypatch.setattr(qisys.cpu, "cpu_count", lambda: 3)
+    assert parser.parse_args([]).num_jobs == 3
+    assert parser.parse_args(["-j", "5"]).num_jobs == 5
+    parser = argparse.ArgumentParser()
+    qisys.parsers.parallel_parser(parser, default=None)
+    assert parser.parse_args([]).num_jobs is None
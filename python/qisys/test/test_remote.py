@@ -1,8 +1,16 @@
 ## Copyright (c) 2012-2016 Aldebaran Robotics. All rights reserved.
 ## Use of this source code is governed by a BSD-style license that can be
 ## found in the COPYING file.
+import os
+import threading
+import time
+
 import pytest
 
+import qisys.command
+import qisys.error
+import qisys.remote
+import qisys.sh
 from qisys.remote import URL, URLParseError, deploy
 from qisys.test.conftest import skip_deploy
 
@@ -58,3 +66,212 @@ def test_deploy(tmpdir):
     remote = tmpdir.mkdir("remote")
 
     deploy(local.strpath, URL("ssh://localhost/" + remote.strpath))
+
+class FakeRsync(object):
+    """ Replace ssh and rsync calls, copying the files listed with
+    --files-from (or all of them) to a local directory
+
+    """
+    def __init__(self, remote):
+        self.remote = remote
+        self.calls = list()
+        self.sent = list()
+        # remote path -> contents of the deploy markers
+        self.markers = dict()
+
+    def __call__(self, cmd, **kwargs):
+        self.calls.append(cmd)
+        if cmd[0] == "ssh" and " && echo " in cmd[-1]:
+            (contents, path) = cmd[-1].split(" && echo ")[1].split(" > ")
+            self.markers[path] = contents
+            return
+        if cmd[0] != "rsync":
+            return
+        src = cmd[-2].rstrip(".")
+        files_from = [x for x in cmd if x.startswith("--files-from=")]
+        rel_paths = ["."]
+        if files_from:
+            with open(files_from[0].split("=", 1)[1]) as fp:
+                rel_paths = fp.read().splitlines()
+        for rel_path in rel_paths:
+            full_path = os.path.join(src, rel_path)
+            if os.path.isfile(full_path):
+                self.send(src, rel_path)
+            for (root, directories, filenames) in os.walk(full_path):
+                directories[:] = [x for x in directories if x != ".debug"]
+                for filename in filenames:
+                    path = os.path.relpath(os.path.join(root, filename), src)
+                    self.send(src, path)
+
+    def check_output(self, cmd, **kwargs):
+        """ Read the deploy markers """
+        path = cmd[-1].split()[1]
+        if path not in self.markers:
+            raise qisys.command.CommandFailedException(cmd, 1)
+        return self.markers[path] + "\n"
+
+    def send(self, src, rel_path):
+        qisys.sh.install(os.path.join(src, rel_path),
+                         self.remote.join(rel_path).strpath, quiet=True)
+        self.sent.append(rel_path)
+
+def test_delta_deploy(tmpdir, monkeypatch):
+    local = tmpdir.mkdir("local")
+    local.ensure("lib", "libfoo.so").write("foo")
+    local.ensure("lib", "libbar.so").write("bar")
+    local.ensure("bin", "foo").write("foo")
+    local.ensure("lib", ".debug", "libfoo.so").write("debug")
+    filelist = tmpdir.join("filelist.txt")
+    filelist.write("lib\nbin/foo\n")
+    remote = tmpdir.mkdir("remote")
+    fake_rsync = FakeRsync(remote)
+    monkeypatch.setattr(qisys.command, "call", fake_rsync)
+    monkeypatch.setattr(qisys.command, "check_output", fake_rsync.check_output)
+    monkeypatch.setattr(qisys.remote, "get_ssh_options", lambda *a, **k: [])
+    manifest_dir = tmpdir.join("manifests").strpath
+    url = URL("john@robot:deployed")
+
+    def do_deploy(checksum=False):
+        fake_rsync.calls = list()
+        fake_rsync.sent = list()
+        deploy(local.strpath, url, filelist=filelist.strpath,
+               manifest_dir=manifest_dir, checksum=checksum)
+
+    # First deploy: everything is compared by rsync
+    do_deploy()
+    assert "--checksum" in fake_rsync.calls[-2]
+    assert sorted(fake_rsync.sent) == ["bin/foo", "lib/libbar.so",
+                                       "lib/libfoo.so"]
+    assert remote.join("lib", "libbar.so").read() == "bar"
+    assert len(fake_rsync.markers) == 1
+
+    # Nothing changed: rsync is not even called
+    do_deploy()
+    assert fake_rsync.calls == list()
+
+    # Same contents, but newer mtime: nothing is sent
+    libbar = local.join("lib", "libbar.so")
+    libbar.setmtime(libbar.mtime() + 10)
+    do_deploy()
+    assert fake_rsync.calls == list()
+
+    # Only the changed file is sent, without --checksum
+    libbar.write("new bar")
+    do_deploy()
+    assert "--checksum" not in fake_rsync.calls[-2]
+    assert fake_rsync.sent == ["lib/libbar.so"]
+    assert remote.join("lib", "libbar.so").read() == "new bar"
+
+    # Full checksum pass on demand
+    do_deploy(checksum=True)
+    assert "--checksum" in fake_rsync.calls[-2]
+
+    # The target was deployed to by someone else: full checksum pass
+    marker_path = fake_rsync.markers.keys()[0]
+    fake_rsync.markers[marker_path] = "other"
+    do_deploy()
+    assert "--checksum" in fake_rsync.calls[-2]
+    assert len(fake_rsync.sent) == 3
+
+    # The target was reset: full checksum pass
+    fake_rsync.markers = dict()
+    do_deploy()
+    assert "--checksum" in fake_rsync.calls[-2]
+
+    # The manifest only contains the files of the last deploy
+    filelist.write("bin/foo\n")
+    local.join("bin", "foo").write("new foo")
+    do_deploy()
+    assert fake_rsync.sent == ["bin/foo"]
+    manifest_path = qisys.remote.get_deploy_manifest_path(manifest_dir, url)
+    assert qisys.remote.read_deploy_manifest(manifest_path).keys() == ["bin/foo"]
+
+def test_deploy_manifest_skips_debug(tmpdir):
+    local = tmpdir.mkdir("local")
+    local.ensure("lib", "libfoo.so").write("foo")
+    local.ensure("lib", ".debug", "libfoo.so").write("debug")
+    local.join("lib", "libfoo.so.1").mksymlinkto("libfoo.so")
+    manifest = qisys.remote.get_deploy_manifest(local.strpath)
+    assert sorted(manifest.keys()) == ["lib/libfoo.so", "lib/libfoo.so.1"]
+
+def test_deploy_to_urls_in_parallel():
+    urls = [URL("john@robot%i:deployed" % i) for i in range(4)]
+    lock = threading.Lock()
+    running = [0]
+    max_running = [0]
+    deployed = list()
+    def deploy_function(url, progress=True):
+        assert not progress
+        with lock:
+            running[0] += 1
+            max_running[0] = max(max_running[0], running[0])
+        time.sleep(0.05)
+        with lock:
+            running[0] -= 1
+            deployed.append(url.host)
+        if url.host == "robot2":
+            raise qisys.error.Error("robot2 is down")
+
+    # pylint: disable-msg=E1101
+    with pytest.raises(qisys.error.Error) as e:
+        qisys.remote.deploy_to_urls(urls, deploy_function, num_workers=2)
+    assert "john@robot2:deployed" in str(e.value)
+    assert sorted(deployed) == ["robot0", "robot1", "robot2", "robot3"]
+    assert max_running[0] == 2
+
+def test_deploy_to_one_url_shows_progress(tmpdir, monkeypatch):
+    local = tmpdir.mkdir("local")
+    local.ensure("foo").write("foo")
+    fake_rsync = FakeRsync(tmpdir.mkdir("remote"))
+    monkeypatch.setattr(qisys.command, "call", fake_rsync)
+    monkeypatch.setattr(qisys.remote, "get_ssh_options", lambda *a, **k: [])
+    def deploy_function(url, progress=True):
+        deploy(local.strpath, url, filelist=None, progress=progress)
+    qisys.remote.deploy_to_urls([URL("john@robot:deployed")], deploy_function)
+    assert "--progress" in fake_rsync.calls[-1]
+
+# pylint: disable-msg=E1101
+@pytest.mark.skipif(os.name == "nt", reason="no ControlMaster on Windows")
+def test_ssh_master_connection_is_shared(tmpdir, monkeypatch):
+    bin_dir = tmpdir.mkdir("bin")
+    fake_ssh = bin_dir.join("ssh")
+    # Create the control socket, then wait to be killed
+    fake_ssh.write("""#!/bin/sh
+echo "$@" >> %s
+for arg in "$@"; do
+  case $arg in
+    ControlPath=*) touch "${arg#ControlPath=}" ;;
+  esac
+done
+exec sleep 30
+""" % tmpdir.join("ssh.log"))
+    fake_ssh.chmod(0755)
+    monkeypatch.setenv("PATH", bin_dir.strpath + os.pathsep + os.environ["PATH"])
+    try:
+        options = qisys.remote.get_ssh_options("robot", user="nao", port=22)
+        assert options[0] == "-o"
+        assert options[1].startswith("ControlPath=")
+        assert qisys.remote.get_ssh_options("robot", user="nao",
+                                            port=22) == options
+        other_options = qisys.remote.get_ssh_options("robot", user="nao",
+                                                     port=2222)
+        assert other_options != options
+        # Only one master connection by (user, host, port)
+        assert len(tmpdir.join("ssh.log").readlines()) == 2
+        masters = qisys.remote._SSH_MASTERS.values()
+    finally:
+        qisys.remote.close_ssh_connections()
+    assert all(x.process is None for x in masters)
+
+# pylint: disable-msg=E1101
+@pytest.mark.skipif(os.name == "nt", reason="no ControlMaster on Windows")
+def test_ssh_master_connection_failed(tmpdir, monkeypatch):
+    bin_dir = tmpdir.mkdir("bin")
+    fake_ssh = bin_dir.join("ssh")
+    fake_ssh.write("#!/bin/sh\nexit 255\n")
+    fake_ssh.chmod(0755)
+    monkeypatch.setenv("PATH", bin_dir.strpath + os.pathsep + os.environ["PATH"])
+    try:
+        assert qisys.remote.get_ssh_options("robot") == list()
+    finally:
+        qisys.remote.close_ssh_connections()
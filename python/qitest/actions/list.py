@@ -27,8 +27,9 @@ def do(args):
     warn_type_count = 0
     for test_runner in test_runners:
         ui.info("Tests in ", test_runner.project.sdk_directory)
-        for i, test in enumerate(test_runner.tests):
-            n = len(test_runner.tests)
+        tests = test_runner.tests
+        n = len(tests)
+        for i, test in enumerate(tests):
             name = test["name"]
             name_ok = re.match(expr, name)
             type_ok = (test.get("pytest") or test.get("gtest"))
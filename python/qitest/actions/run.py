@@ -15,6 +15,7 @@ import qisys.parsers
 import qibuild.test_runner
 import qibuild.gcov
 import qitest.parsers
+import qitest.test_queue
 import qitest.actions.list
 
 def configure_parser(parser):
@@ -35,17 +36,35 @@ def do(args):
     test_runners = qitest.parsers.get_test_runners(args)
     global_res = True
     n = len(test_runners)
-    for i, test_runner in enumerate(test_runners):
-        if n != 1:
-            ui.info(ui.bold, "::", "[%i on %i]" % (i + 1, len(test_runners)),
-                    ui.reset, "Running tests in", ui.blue, test_runner.cwd)
-        res = test_runner.run()
-        if args.coverage:
-            build_worktree = qibuild.parsers.get_build_worktree(args, verbose=False)
-            build_project = qibuild.parsers.get_one_build_project(build_worktree, args)
-            qibuild.gcov.generate_coverage_reports(build_project,
-                                                   output_dir=args.coverage_output_dir,
-                                                   exclude_patterns=exclude_patterns)
-        global_res = global_res and res
+    if n != 1 and args.num_jobs > 1 and not args.repeat_until_fail:
+        # Run the tests of all the projects with the same workers
+        ui.info(ui.bold, "::", ui.reset, "Running tests in",
+                ", ".join(x.cwd for x in test_runners))
+        test_queues = [x.get_test_queue() for x in test_runners]
+        queue_group = qitest.test_queue.TestQueueGroup(test_queues)
+        global_res = queue_group.run(num_jobs=args.num_jobs)
+    else:
+        for i, test_runner in enumerate(test_runners):
+            if n != 1:
+                ui.info(ui.bold, "::", "[%i on %i]" % (i + 1, len(test_runners)),
+                        ui.reset, "Running tests in", ui.blue, test_runner.cwd)
+            res = test_runner.run()
+            global_res = global_res and res
+    if args.coverage:
+        generate_coverage_reports(args, test_runners, exclude_patterns)
     if not global_res:
         sys.exit(1)
+
+def generate_coverage_reports(args, test_runners, exclude_patterns):
+    """ Generate the coverage reports of all the projects at once """
+    build_projects = [x.build_project for x in test_runners
+                      if x.build_project]
+    if not build_projects:
+        return
+    build_worktree = build_projects[0].build_worktree
+    print
+    ui.info(ui.bold, "::", ui.reset, "Generating coverage reports")
+    qibuild.gcov.generate_projects_coverage_reports(
+        build_projects, output_dir=args.coverage_output_dir,
+        exclude_patterns=exclude_patterns, merge=args.coverage_merge,
+        root=build_worktree.root)
@@ -0,0 +1,70 @@
+## Copyright (c) 2012-2016 Aldebaran Robotics. All rights reserved.
+## Use of this source code is governed by a BSD-style license that can be
+## found in the COPYING file.
+""" Display statistics about the previous test runs:
+slowest tests, duration regressions and flaky tests
+
+"""
+
+import os
+
+from qisys import ui
+import qisys.parsers
+import qibuild.parsers
+import qitest.history
+import qitest.parsers
+
+def configure_parser(parser):
+    qitest.parsers.test_parser(parser)
+    qibuild.parsers.project_parser(parser)
+    qisys.parsers.build_parser(parser, include_worktree_parser=False)
+    group = parser.add_argument_group("stats options")
+    group.add_argument("--last-runs", type=int, default=20, metavar="N",
+                       help="Only use the last N runs, or all of them if N is 0. "
+                            "Default: %(default)s")
+    group.add_argument("--limit", type=int, default=10, metavar="N",
+                       help="Number of slowest tests to display. "
+                            "Default: %(default)s")
+
+def do(args):
+    test_runners = qitest.parsers.get_test_runners(args)
+    for test_runner in test_runners:
+        sdk_directory = test_runner.project.sdk_directory
+        db_path = os.path.join(sdk_directory, ".history.sqlite")
+        ui.info(ui.green, "Tests history in", ui.blue, sdk_directory)
+        if not os.path.exists(db_path):
+            ui.info("No tests history found")
+            continue
+        with qitest.history.open_history(db_path) as history:
+            show_stats(history, last_runs=args.last_runs, limit=args.limit)
+
+def show_stats(history, last_runs=None, limit=10):
+    """ Display the statistics of the given :py:class:`.TestHistory` """
+    num_runs = history.get_num_runs()
+    if last_runs:
+        num_runs = min(num_runs, last_runs)
+    ui.info(ui.bold, "Using the last %i runs" % num_runs)
+    slowest = history.get_slowest_tests(last_runs=last_runs, limit=limit)
+    if slowest:
+        ui.info(ui.bold, "Slowest tests (mean, max):")
+        max_len = max(len(x[0]) for x in slowest)
+        for (name, mean, max_duration) in slowest:
+            ui.info(" ", ui.blue, name.ljust(max_len + 2), ui.reset,
+                    "%.2fs" % mean, "%.2fs" % max_duration)
+    regressions = history.get_duration_regressions(last_runs=last_runs)
+    if regressions:
+        ui.info(ui.bold, "Duration regressions (median, last):")
+        max_len = max(len(x[0]) for x in regressions)
+        for (name, median, last) in regressions:
+            ui.info(" ", ui.blue, name.ljust(max_len + 2), ui.reset,
+                    "%.2fs" % median, ui.red, "%.2fs" % last)
+    flaky = history.get_flaky_tests(last_runs=last_runs)
+    if flaky:
+        ui.info(ui.bold, "Flaky tests (flake rate):")
+        max_len = max(len(x[0]) for x in flaky)
+        for (name, rate, num_runs) in flaky:
+            ui.info(" ", ui.blue, name.ljust(max_len + 2), ui.reset,
+                    ui.brown, "%i%%" % (rate * 100), ui.reset,
+                    "(%i runs)" % num_runs)
+    else:
+        ui.info(ui.green, "No flaky tests")
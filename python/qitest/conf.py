@@ -2,11 +2,15 @@
 ## Use of this source code is governed by a BSD-style license that can be
 ## found in the COPYING file.
 import argparse
+import copy
 import os
 import json
 
 import qisys.error
 
+# Cache for parse_tests(): path -> ((mtime, size), tests)
+_TESTS_CACHE = dict()
+
 def add_test(output, **kwargs):
     if not "name" in kwargs:
         raise qisys.error.Error("Should provide a test name")
@@ -26,6 +30,7 @@ def add_test(output, **kwargs):
         raise qisys.error.Error(mess)
 
     tests.append(kwargs)
+    _TESTS_CACHE.pop(output, None)
     with open(output, "w") as fp:
         json.dump(tests, fp, indent=2)
 
@@ -33,18 +38,29 @@ def parse_tests(conf_path):
     """ Parse the tests described in a qitest.json file.
     Returns a list of dictionaries
 
+    The file is only parsed again when it changes. The
+    returned tests are copies, so they can be modified
+
     """
-    res = list()
-    with open(conf_path, "r") as fp:
-        res = json.load(fp)
-    # Make sure environment is a dict string -> string
-    for test in res:
-        test_env = test.get("environment")
-        if test_env:
-            for key, value in test_env.iteritems():
-                del test_env[key]
-                test_env[key.encode("UTF-8")] = value.encode("UTF-8")
-    return res
+    stat = os.stat(conf_path)
+    key = (stat.st_mtime, stat.st_size)
+    cached = _TESTS_CACHE.get(conf_path)
+    if cached is None or cached[0] != key:
+        with open(conf_path, "r") as fp:
+            tests = json.load(fp)
+        # Make sure environment is a dict string -> string
+        for test in tests:
+            test_env = test.get("environment")
+            if test_env:
+                test["environment"] = dict((k.encode("UTF-8"), v.encode("UTF-8"))
+                                           for (k, v) in test_env.iteritems())
+        cached = (key, tests)
+        _TESTS_CACHE[conf_path] = cached
+    return [_copy_test(x) for x in cached[1]]
+
+def _copy_test(test):
+    """ Copy a test, along with its command line and environment """
+    return dict((key, copy.copy(value)) for (key, value) in test.iteritems())
 
 def write_tests(tests, conf_path, append=False):
     """ Write a list of tests to a config file
@@ -55,6 +71,7 @@ def write_tests(tests, conf_path, append=False):
         else:
             previous_tests = list()
         tests = previous_tests + tests
+    _TESTS_CACHE.pop(conf_path, None)
     with open(conf_path, "w") as fp:
         return json.dump(tests, fp, indent=2)
 
@@ -0,0 +1,198 @@
+## Copyright (c) 2012-2016 Aldebaran Robotics. All rights reserved.
+## Use of this source code is governed by a BSD-style license that can be
+## found in the COPYING file.
+
+""" Store the results of the test runs in a SQLite database, so that
+durations and flaky tests can be tracked over time
+
+"""
+
+import collections
+import contextlib
+import time
+
+try:
+    import sqlite3
+except ImportError:
+    sqlite3 = None
+
+from qisys import ui
+import qisys.error
+
+# Outcomes stored in the database
+PASS = "pass"
+FAIL = "fail"
+FLAKY = "flaky"
+ERROR = "error"
+INTERRUPTED = "interrupted"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    timestamp REAL NOT NULL,
+    num_jobs INTEGER NOT NULL,
+    elapsed_time REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS results (
+    run_id INTEGER NOT NULL REFERENCES runs(id),
+    name TEXT NOT NULL,
+    duration REAL NOT NULL,
+    outcome TEXT NOT NULL,
+    worker INTEGER,
+    retries INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS results_by_name ON results(name, run_id);
+"""
+
+def get_outcome(result):
+    """ Get the outcome to store for a :py:class:`.TestResult` """
+    if result.error:
+        return ERROR
+    if result.ok is None:
+        return INTERRUPTED
+    if result.ok:
+        if result.retries:
+            return FLAKY
+        return PASS
+    return FAIL
+
+
+class TestHistory(object):
+    """ The history of the test runs of a project """
+    def __init__(self, db_path):
+        if sqlite3 is None:
+            raise HistoryNotAvailable()
+        self.db_path = db_path
+        self._conn = sqlite3.connect(db_path)
+        self._conn.executescript(SCHEMA)
+
+    def close(self):
+        self._conn.close()
+
+    def add_run(self, results, num_jobs=1, elapsed_time=0, timestamp=None):
+        """ Add the results of a run (a list of :py:class:`.TestResult`)
+        Return the id of the run
+
+        """
+        if timestamp is None:
+            timestamp = time.time()
+        with self._conn:
+            cursor = self._conn.execute(
+                "INSERT INTO runs (timestamp, num_jobs, elapsed_time) "
+                "VALUES (?, ?, ?)", (timestamp, num_jobs, elapsed_time))
+            run_id = cursor.lastrowid
+            rows = [(run_id, x.test["name"], x.time, get_outcome(x),
+                     x.worker, x.retries)
+                    for x in results]
+            self._conn.executemany(
+                "INSERT INTO results (run_id, name, duration, outcome, "
+                "worker, retries) VALUES (?, ?, ?, ?, ?, ?)", rows)
+        return run_id
+
+    def get_num_runs(self):
+        return self._conn.execute("SELECT COUNT(*) FROM runs").fetchone()[0]
+
+    def get_results(self, last_runs=None):
+        """ Get the results of the last runs, as a dict
+        name -> list of (duration, outcome), oldest first
+
+        """
+        query = "SELECT name, duration, outcome FROM results"
+        params = ()
+        if last_runs:
+            query += " WHERE run_id IN " \
+                     "(SELECT id FROM runs ORDER BY id DESC LIMIT ?)"
+            params = (last_runs,)
+        query += " ORDER BY run_id"
+        res = collections.OrderedDict()
+        for (name, duration, outcome) in self._conn.execute(query, params):
+            res.setdefault(name, list()).append((duration, outcome))
+        return res
+
+    def get_slowest_tests(self, last_runs=None, limit=10):
+        """ Return a list of (name, mean duration, max duration),
+        slowest first
+
+        """
+        res = list()
+        for name, results in self.get_results(last_runs=last_runs).iteritems():
+            durations = [x[0] for x in results if x[1] in (PASS, FLAKY, FAIL)]
+            if not durations:
+                continue
+            mean = sum(durations) / len(durations)
+            res.append((name, mean, max(durations)))
+        res.sort(key=lambda x: x[1], reverse=True)
+        return res[:limit]
+
+    def get_duration_regressions(self, last_runs=None, factor=1.5,
+                                 min_duration=1):
+        """ Return a list of (name, median duration, last duration)
+        for the tests whose last duration is more than ``factor`` times
+        the median of the previous ones
+
+        """
+        res = list()
+        for name, results in self.get_results(last_runs=last_runs).iteritems():
+            durations = [x[0] for x in results if x[1] in (PASS, FLAKY)]
+            if len(durations) < 2:
+                continue
+            last = durations[-1]
+            previous = sorted(durations[:-1])
+            median = previous[len(previous) / 2]
+            if last >= min_duration and last > median * factor:
+                res.append((name, median, last))
+        res.sort(key=lambda x: x[2] / max(x[1], 0.001), reverse=True)
+        return res
+
+    def get_flaky_tests(self, last_runs=None):
+        """ Return a list of (name, flake rate, number of runs) for the
+        tests that were flaky, or that both passed and failed.
+
+        The flake rate is the ratio of runs where the test did
+        not pass on the first try
+
+        """
+        res = list()
+        for name, results in self.get_results(last_runs=last_runs).iteritems():
+            outcomes = [x[1] for x in results
+                        if x[1] in (PASS, FLAKY, FAIL)]
+            if not outcomes:
+                continue
+            num_flaky = outcomes.count(FLAKY)
+            num_failed = outcomes.count(FAIL)
+            if not num_flaky and not (num_failed and PASS in outcomes):
+                continue
+            rate = float(num_flaky + num_failed) / len(outcomes)
+            res.append((name, rate, len(outcomes)))
+        res.sort(key=lambda x: x[1], reverse=True)
+        return res
+
+
+class HistoryNotAvailable(qisys.error.Error):
+    """ Raised when the sqlite3 module cannot be imported """
+    def __str__(self):
+        return "sqlite3 module not found, cannot store tests history"
+
+
+@contextlib.contextmanager
+def open_history(db_path):
+    """ Open the test history, closing it when done """
+    history = TestHistory(db_path)
+    try:
+        yield history
+    finally:
+        history.close()
+
+def write_run(db_path, results, num_jobs=1, elapsed_time=0):
+    """ Add the results of a run to the history, warning
+    on errors instead of raising
+
+    """
+    try:
+        with open_history(db_path) as history:
+            history.add_run(results, num_jobs=num_jobs,
+                            elapsed_time=elapsed_time)
+    except HistoryNotAvailable as e:
+        ui.debug(e)
+    except sqlite3.Error as e:
+        ui.warning("Could not write tests history in", db_path, ":", e)
@@ -5,13 +5,17 @@
 """ Collection of parser fonctions for qitests actions
 """
 
+import collections
 import copy
 import os
 
 from qisys import ui
 import qisys.error
 import qisys.parsers
+import qibuild.deps
 import qibuild.parsers
+import qisrc.git
+import qisrc.worktree
 import qitest.project
 
 def test_parser(parser, with_num_jobs=True):
@@ -45,6 +49,9 @@ def test_parser(parser, with_num_jobs=True):
     group.add_argument("--coverage-output-dir", dest="coverage_output_dir",
                       help="Generate XML and HTML coverage reports in the given " + \
                            "directory (instead of build-<platform>/sdk/coverage-results)")
+    group.add_argument("--coverage-merge", dest="coverage_merge", action="store_true",
+                      help="Also generate a coverage report for all the projects "
+                           "together (requires gcovr >= 4.2)")
     group.add_argument("--cov-exclude", dest="cov_exclude_patterns", action="append",
                        help="Exclude the given patterns from covegare.\n"
                             "Default is: ['.*test.', '.*examples.*', '.*external.*']\n"
@@ -57,8 +64,17 @@ def test_parser(parser, with_num_jobs=True):
                        help="Ignore timeouts when running tests")
     group.add_argument("--lf", "--last-failed", dest="last_failed", action="store_true",
                        help="Run the failing test from previous run")
+    group.add_argument("--gtest-shards", dest="gtest_shards", type=int, metavar="N",
+                       help="Split each gtest test in N shards, run in parallel")
+    group.add_argument("--retries", dest="retries", type=int, metavar="N",
+                       help="Run failing tests again, at most N times. Tests "
+                            "passing after a retry are reported as flaky")
+    group.add_argument("--changed-since", dest="changed_since", metavar="REF",
+                       help="Only use the projects changed since the given git ref, "
+                            "and the projects depending on them")
     parser.set_defaults(nightly=False, capture=True, last_failed=False,
-                       ignore_timeouts=False)
+                       ignore_timeouts=False, gtest_shards=1, retries=0,
+                       coverage_merge=False)
     if with_num_jobs:
         qisys.parsers.parallel_parser(group, default=1)
 
@@ -82,6 +98,7 @@ def get_test_runner(args, build_project=None, qitest_json=None):
 
     test_runner = qibuild.test_runner.ProjectTestRunner(test_project)
     if build_project:
+        test_runner.build_project = build_project
         test_runner.cwd = build_project.sdk_directory
         test_runner.env = build_project.build_worktree.get_env()
     else:
@@ -103,6 +120,8 @@ def get_test_runner(args, build_project=None, qitest_json=None):
     test_runner.capture = args.capture
     test_runner.last_failed = args.last_failed
     test_runner.ignore_timeouts = args.ignore_timeouts
+    test_runner.gtest_shards = args.gtest_shards
+    test_runner.retries = args.retries
 
     return test_runner
 
@@ -113,9 +132,16 @@ def parse_build_projects(args):
         solve_deps = False
         if args.use_deps:
             solve_deps = True
+        changed_since = vars(args).get("changed_since")
         build_projects = qibuild.parsers.get_build_projects(
                 build_worktree,
-                args, solve_deps=solve_deps)
+                args, solve_deps=solve_deps,
+                default_all=bool(changed_since))
+        if changed_since:
+            affected = get_affected_build_projects(build_worktree, changed_since)
+            affected_names = [x.name for x in affected]
+            build_projects = [x for x in build_projects
+                              if x.name in affected_names]
         for build_project in build_projects:
             test_runner = None
             try:
@@ -160,5 +186,54 @@ def get_test_runners(args):
         return build_projects_runners
 
     if not res:
+        if vars(args).get("changed_since"):
+            ui.info(ui.green, "No project changed since", args.changed_since)
+            return res
         raise qisys.error.Error("Nothing found to test")
     return res
+
+def get_affected_build_projects(build_worktree, ref):
+    """ Get the build projects changed since the given git ref,
+    and the projects depending on them
+
+    """
+    changed = get_changed_build_projects(build_worktree, ref)
+    deps_solver = qibuild.deps.DepsSolver(build_worktree)
+    return deps_solver.get_reverse_dep_projects(changed,
+                                                ["build", "runtime", "test"])
+
+def get_changed_build_projects(build_worktree, ref):
+    """ Get the build projects containing files changed since
+    the given git ref.
+
+    Projects not in a git repository, or in a repository where
+    the ref does not exist, are considered as changed
+
+    """
+    git_worktree = qisrc.worktree.GitWorkTree(build_worktree.worktree)
+    res = list()
+    projects_by_repo = collections.OrderedDict()
+    for build_project in build_worktree.build_projects:
+        git_project = qisys.parsers.find_parent_project(git_worktree.git_projects,
+                                                        build_project.path)
+        if git_project is None:
+            res.append(build_project)
+            continue
+        projects_by_repo.setdefault(git_project.path, list()).append(build_project)
+    for repo, build_projects in projects_by_repo.iteritems():
+        git = qisrc.git.Git(repo)
+        changed_files = git.get_changed_files(ref)
+        if changed_files is None:
+            ui.warning(ref, "not found in", repo,
+                       "\nConsidering all its projects as changed")
+            res.extend(build_projects)
+            continue
+        # So that find_parent_project() returns the deepest project
+        build_projects.sort(key=lambda x: x.path)
+        for changed_file in changed_files:
+            full_path = os.path.join(repo, *changed_file.split("/"))
+            build_project = qisys.parsers.find_parent_project(build_projects,
+                                                              full_path)
+            if build_project and build_project not in res:
+                res.append(build_project)
+    return res
@@ -28,3 +28,7 @@ class TestResult:
         self.ok = False
         self.message = list()
         self.error = False
+        # Index of the worker which ran the test
+        self.worker = None
+        # Number of times the test was run again after failing
+        self.retries = 0
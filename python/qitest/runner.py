@@ -5,9 +5,11 @@ import abc
 import re
 import os
 import json
+import threading
 
 from qisys import ui
 import qisys.error
+import qitest.result
 import qitest.test_queue
 
 class TestSuiteRunner(object):
@@ -17,7 +19,9 @@ class TestSuiteRunner(object):
     def __init__(self, project):
         self.project = project
         self._patterns = list()
+        self._pattern_regexps = list()
         self._excludes = list()
+        self._exclude_regexps = list()
         self.num_jobs = 1
         self.repeat_until_fail = 0
         self.cwd = os.getcwd()
@@ -30,7 +34,11 @@ class TestSuiteRunner(object):
         self.test_output_dir = None
         self.capture = True
         self.last_failed = False
+        self.gtest_shards = 1
+        self.retries = 0
         self._tests = project.tests
+        # (selection key, selected tests), see self.tests
+        self._selected_tests = None
 
     @abc.abstractproperty
     def launcher(self):
@@ -50,26 +58,35 @@ class TestSuiteRunner(object):
         See :py:class:`.TestResult` for more details
 
         """
-        test_queue = qitest.test_queue.TestQueue(self.tests)
-        test_queue.launcher = self.launcher
-        test_queue.launcher.capture = self.capture
+        test_queue = self.get_test_queue()
         ok = test_queue.run(num_jobs=self.num_jobs,
                            repeat_until_fail=self.repeat_until_fail)
         return ok
 
+    def get_test_queue(self):
+        """ Get a :py:class:`.TestQueue` ready to run the selected tests """
+        test_queue = qitest.test_queue.TestQueue(self.tests, name=self.cwd,
+                                                 num_shards=self.gtest_shards,
+                                                 retries=self.retries)
+        test_queue.launcher = self.launcher
+        test_queue.launcher.capture = self.capture
+        return test_queue
+
     @property
     def patterns(self):
         return self._patterns
 
     @patterns.setter
     def patterns(self, value):
+        regexps = list()
         if value:
             try:
-                [re.compile(x) for x in value]
+                regexps = [re.compile(x) for x in value]
             except Exception as e:
                 raise qisys.error.Error(str(e))
 
         self._patterns = value
+        self._pattern_regexps = regexps
 
     @property
     def excludes(self):
@@ -77,16 +94,40 @@ class TestSuiteRunner(object):
 
     @excludes.setter
     def excludes(self, value):
+            regexps = list()
             if value:
-                [re.compile(x) for x in value] # just checking regexps are valid
+                regexps = [re.compile(x) for x in value]
             self._excludes = value
+            self._exclude_regexps = regexps
 
     @property
     def tests(self):
+        """ The selected tests. The selection is only computed
+        again when one of the selection settings, the list of tests
+        or the list of the tests which failed last time changes
+
+        """
+        key = (id(self._tests), len(self._tests),
+               tuple(self.patterns or ()), tuple(self.excludes or ()),
+               self.perf, self.nightly, self.last_failed)
+        if self.last_failed:
+            fail_json = self._get_failed_json()
+            mtime = None
+            if os.path.exists(fail_json):
+                mtime = os.stat(fail_json).st_mtime
+            key += (mtime,)
+        if self._selected_tests and self._selected_tests[0] == key:
+            return self._selected_tests[1]
+        res = self._select_tests()
+        self._selected_tests = (key, res)
+        return res
+
+    def _select_tests(self):
+        """ Helper for self.tests """
         res = [x for x in self._tests if
-                match_patterns(self.patterns, x["name"], default=True)]
+                match_patterns(self._pattern_regexps, x["name"], default=True)]
         res = [x for x in res if not
-                match_patterns(self.excludes, x["name"], default=False)]
+                match_patterns(self._exclude_regexps, x["name"], default=False)]
         # Perf tests are run alone
         res = [x for x in res if x.get("perf", False) == self.perf]
         # But nightly tests are run along with the normal tests
@@ -103,8 +144,7 @@ class TestSuiteRunner(object):
         """ Return the list of the test names that failed
         during the previous run
         """
-        path = self.launcher.project.sdk_directory
-        fail_json = os.path.join(path, ".failed.json")
+        fail_json = self._get_failed_json()
         names = list()
         if not os.path.exists(fail_json):
             return names
@@ -112,26 +152,69 @@ class TestSuiteRunner(object):
             names = json.load(fp)
         return names
 
+    def _get_failed_json(self):
+        path = self.launcher.project.sdk_directory
+        return os.path.join(path, ".failed.json")
+
+_WORKER_DATA = threading.local()
+
 class TestLauncher(object):
     """ Interface for a class able to launch a test. """
     __metaclass__ = abc.ABCMeta
 
     def __init__(self):
-        # Set by the test suite, the launcher may need to know about its worker
-        # index
-        self.worker_index = None
         self.capture = True
 
+    @property
+    def worker_index(self):
+        """ Set by the test worker running the test, the launcher may need
+        to know about it. The launcher is shared by all the workers, so
+        the index is stored per thread
+
+        """
+        return getattr(_WORKER_DATA, "index", None)
+
+    @worker_index.setter
+    def worker_index(self, value):
+        _WORKER_DATA.index = value
+
     @abc.abstractmethod
     def launch(self, test):
         """ Should return a :py:class:`.TestResult` """
         pass
 
+    def merge_shards(self, test, results):
+        """ Merge the results of the shards of a test (see
+        :py:func:`qitest.test_queue.split_in_shards`) in
+        one :py:class:`.TestResult`
+
+        """
+        res = qitest.result.TestResult(test)
+        res.time = sum(x.time for x in results)
+        res.error = any(x.error for x in results)
+        res.retries = max(x.retries for x in results)
+        if any(x.ok is None for x in results):
+            res.ok = None
+        else:
+            res.ok = all(x.ok for x in results)
+        res.out = "".join(getattr(x, "out", "") for x in results)
+        res.message = results[0].message
+        for result in results:
+            if not result.ok:
+                res.message = result.message
+                break
+        return res
+
 def match_patterns(patterns, name, default=True):
+    """ Whether the name matches one of the patterns. Patterns
+    may be strings or compiled regular expressions
+
+    """
     if not patterns:
         return default
     for pattern in patterns:
-        res = re.search(pattern, name)
-        if res:
+        if isinstance(pattern, basestring):
+            pattern = re.compile(pattern)
+        if pattern.search(name):
             return True
     return False
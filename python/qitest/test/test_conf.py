@@ -101,3 +101,23 @@ def test_relocate_win():
                 "cmd" : [r"bin\test_two.exe", r"c:\some\other\path"],
            }
     ]
+
+def test_parse_tests_returns_copies(tmpdir):
+    qitest_json_path = tmpdir.join("qitest.json").strpath
+    qitest.conf.add_test(qitest_json_path, environment={"FOO" : "bar"},
+                         **test_gtest_one)
+    tests = qitest.conf.parse_tests(qitest_json_path)
+    tests[0]["cmd"].append("--spam")
+    tests[0]["environment"]["FOO"] = "baz"
+    tests = qitest.conf.parse_tests(qitest_json_path)
+    assert tests[0]["cmd"] == test_gtest_one["cmd"]
+    assert tests[0]["environment"] == {"FOO" : "bar"}
+    assert isinstance(tests[0]["environment"].keys()[0], str)
+
+def test_parse_tests_when_file_changes(tmpdir):
+    qitest_json_path = tmpdir.join("qitest.json").strpath
+    qitest.conf.write_tests([test_gtest_one], qitest_json_path)
+    assert qitest.conf.parse_tests(qitest_json_path) == [test_gtest_one]
+    qitest.conf.write_tests([test_perf_one], qitest_json_path, append=True)
+    assert qitest.conf.parse_tests(qitest_json_path) == [test_gtest_one,
+                                                         test_perf_one]
@@ -0,0 +1,45 @@
+## Copyright (c) 2012-2016 Aldebaran Robotics. All rights reserved.
+## Use of this source code is governed by a BSD-style license that can be
+## found in the COPYING file.
+
+import qitest.history
+import qitest.result
+
+def make_result(name, time, ok=True, retries=0, worker=0):
+    res = qitest.result.TestResult({"name" : name})
+    res.time = time
+    res.ok = ok
+    res.retries = retries
+    res.worker = worker
+    return res
+
+def test_add_run(tmpdir):
+    db_path = tmpdir.join("history.sqlite").strpath
+    with qitest.history.open_history(db_path) as history:
+        history.add_run([make_result("foo", 1), make_result("bar", 2, ok=False)],
+                        num_jobs=2, elapsed_time=2)
+    with qitest.history.open_history(db_path) as history:
+        assert history.get_num_runs() == 1
+        results = history.get_results()
+        assert results["foo"] == [(1, "pass")]
+        assert results["bar"] == [(2, "fail")]
+
+def test_stats(tmpdir):
+    db_path = tmpdir.join("history.sqlite").strpath
+    with qitest.history.open_history(db_path) as history:
+        for i in range(5):
+            history.add_run([
+                make_result("fast", 0.1),
+                make_result("slow", 10 if i < 4 else 30),
+                make_result("flaky", 1, retries=(i == 2)),
+                make_result("sometimes_fails", 1, ok=(i != 1)),
+            ])
+        slowest = history.get_slowest_tests(limit=2)
+        assert [x[0] for x in slowest] == ["slow", "flaky"]
+        assert slowest[0][1:] == (14, 30)
+        regressions = history.get_duration_regressions()
+        assert regressions == [("slow", 10, 30)]
+        flaky = history.get_flaky_tests()
+        assert flaky == [("flaky", 0.2, 5), ("sometimes_fails", 0.2, 5)]
+        # Only the last 2 runs:
+        assert history.get_flaky_tests(last_runs=2) == list()
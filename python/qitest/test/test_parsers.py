@@ -9,6 +9,7 @@ import qisys.error
 import qitest.parsers
 
 from qibuild.test.conftest import TestBuildWorkTree
+from qisrc.test.conftest import TestGit
 
 def test_nothing_specified_json_in_cwd(args, tmpdir, monkeypatch):
     monkeypatch.chdir(tmpdir)
@@ -125,3 +126,24 @@ def test_ignore_timeouts(args, tmpdir, monkeypatch):
     assert len(test_runners) == 1
     test_runner = test_runners[0]
     assert test_runner.ignore_timeouts
+
+def test_changed_since(args, build_worktree, monkeypatch):
+    world_proj = build_worktree.create_project("world")
+    hello_proj = build_worktree.create_project("hello", build_depends=["world"])
+    other_proj = build_worktree.create_project("other")
+    for proj in world_proj, hello_proj, other_proj:
+        git = TestGit(proj.path)
+        git.initialize()
+        git.add(".")
+        git.commit("--message", "initial")
+        git.call("tag", "base")
+        proj.configure()
+    monkeypatch.chdir(build_worktree.root)
+    args.changed_since = "base"
+    assert qitest.parsers.get_test_runners(args) == list()
+
+    world_git = TestGit(world_proj.path)
+    world_git.commit_file("world.cpp", "// changed\n")
+    test_runners = qitest.parsers.get_test_runners(args)
+    sdk_dirs = [x.project.sdk_directory for x in test_runners]
+    assert sdk_dirs == [hello_proj.sdk_directory, world_proj.sdk_directory]
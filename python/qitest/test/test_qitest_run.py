@@ -8,6 +8,7 @@ import json
 
 import qisys.command
 import qisys.error
+import qisys.qixml
 import qibuild.find
 
 from qisys.test.conftest import only_linux
@@ -25,6 +26,58 @@ def test_simple_run(tmpdir, qitest_action):
     qitest_json.write(json.dumps(tests))
     qitest_action("run", cwd=tmpdir.strpath)
 
+def test_several_projects_in_parallel(tmpdir, qitest_action):
+    ls = qisys.command.find_program("ls")
+    foo_json = tmpdir.mkdir("foo").join("qitest.json")
+    foo_json.write(json.dumps([
+            {"name" : "foo_ls", "cmd" : [ls], "timeout" : 1 },
+    ]))
+    bar_json = tmpdir.mkdir("bar").join("qitest.json")
+    bar_json.write(json.dumps([
+            {"name" : "bar_ls", "cmd" : [ls], "timeout" : 1 },
+            {"name" : "bar_false", "cmd" : ["false"], "timeout" : 1 },
+    ]))
+    rc = qitest_action("run", "-j", "2",
+                       "--qitest-json", foo_json.strpath,
+                       "--qitest-json", bar_json.strpath,
+                       cwd=tmpdir.strpath, retcode=True)
+    assert rc != 0
+    assert tmpdir.join("foo", "test-results", "foo_ls.xml").check(file=True)
+    assert tmpdir.join("bar", "test-results", "bar_false.xml").check(file=True)
+    assert json.loads(tmpdir.join("foo", ".failed.json").read()) == []
+    assert json.loads(tmpdir.join("bar", ".failed.json").read()) == ["bar_false"]
+
+def test_gtest_shards(tmpdir, qitest_action):
+    fake_gtest = tmpdir.join("fake_gtest.py")
+    fake_gtest.write("""\
+import os
+import sys
+index = os.environ["GTEST_SHARD_INDEX"]
+assert os.environ["GTEST_TOTAL_SHARDS"] == "2"
+xml_path = sys.argv[1].split("xml:")[1]
+with open(xml_path, "w") as fp:
+    fp.write('''<testsuites tests="1" failures="0" disabled="0" errors="0" time="1">
+  <testsuite name="Foo" tests="1" failures="0" disabled="0" errors="0" time="1">
+    <testcase name="test_%s" status="run" time="1" classname="Foo" />
+  </testsuite>
+</testsuites>''' % index)
+print "shard", index
+""")
+    tests = [
+        {"name" : "big", "cmd" : [sys.executable, fake_gtest.strpath],
+         "gtest" : True, "timeout" : 10}
+    ]
+    qitest_json = tmpdir.join("qitest.json")
+    qitest_json.write(json.dumps(tests))
+    qitest_action("run", "-j", "2", "--gtest-shards", "2", cwd=tmpdir.strpath)
+    results_dir = tmpdir.join("test-results")
+    assert sorted(os.listdir(results_dir.strpath)) == ["big.log", "big.xml"]
+    assert results_dir.join("big.log").read() == "shard 0\nshard 1\n"
+    root = qisys.qixml.read(results_dir.join("big.xml").strpath).getroot()
+    assert root.get("tests") == "2"
+    test_cases = root.findall("testsuite/testcase")
+    assert [x.get("name") for x in test_cases] == ["test_0", "test_1"]
+
 def test_repeat_until_fail(tmpdir, qitest_action):
     ls = qisys.command.find_program("ls")
     rm = qisys.command.find_program("rm")
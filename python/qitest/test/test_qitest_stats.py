@@ -0,0 +1,53 @@
+## Copyright (c) 2012-2016 Aldebaran Robotics. All rights reserved.
+## Use of this source code is governed by a BSD-style license that can be
+## found in the COPYING file.
+
+import json
+
+import qisys.command
+import qitest.actions.stats
+import qitest.history
+
+from qitest.test.test_history import make_result
+
+def test_stats_after_runs(tmpdir, qitest_action, record_messages):
+    ls = qisys.command.find_program("ls")
+    tests = [
+        {"name" : "ls", "cmd" : [ls], "timeout" : 1},
+        {"name" : "false", "cmd" : ["false"], "timeout" : 1},
+    ]
+    qitest_json = tmpdir.join("qitest.json")
+    qitest_json.write(json.dumps(tests))
+    qitest_action("stats", cwd=tmpdir.strpath)
+    assert record_messages.find("No tests history found")
+    for i in range(2):
+        qitest_action("run", cwd=tmpdir.strpath, retcode=True)
+    assert tmpdir.join(".history.sqlite").check(file=True)
+    record_messages.reset()
+    qitest_action("stats", cwd=tmpdir.strpath)
+    assert record_messages.find("Using the last 2 runs")
+    assert record_messages.find("Slowest tests")
+    assert record_messages.find("No flaky tests")
+
+def test_stats_with_all_runs(tmpdir, record_messages):
+    db_path = tmpdir.join("history.sqlite").strpath
+    with qitest.history.open_history(db_path) as history:
+        for i in range(3):
+            history.add_run([make_result("foo", 1)])
+        qitest.actions.stats.show_stats(history)
+        assert record_messages.find("Using the last 3 runs")
+        record_messages.reset()
+        qitest.actions.stats.show_stats(history, last_runs=0)
+        assert record_messages.find("Using the last 3 runs")
+        record_messages.reset()
+        qitest.actions.stats.show_stats(history, last_runs=2)
+        assert record_messages.find("Using the last 2 runs")
+
+def test_stats_last_runs_zero(tmpdir, qitest_action, record_messages):
+    ls = qisys.command.find_program("ls")
+    tests = [{"name" : "ls", "cmd" : [ls], "timeout" : 1}]
+    tmpdir.join("qitest.json").write(json.dumps(tests))
+    qitest_action("run", cwd=tmpdir.strpath)
+    record_messages.reset()
+    qitest_action("stats", "--last-runs", "0", cwd=tmpdir.strpath)
+    assert record_messages.find("Using the last 1 runs")
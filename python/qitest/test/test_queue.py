@@ -2,6 +2,7 @@
 ## Use of this source code is governed by a BSD-style license that can be
 ## found in the COPYING file.
 
+import json
 import time
 
 from qisys import ui
@@ -123,3 +124,202 @@ def test_repeat_until_fail(tmpdir):
     test_queue.launcher = fake_launcher
     test_queue.run(repeat_until_fail=3)
     assert  test_queue.ok is False
+
+class RecordingLauncher(DummyLauncher):
+    def __init__(self, tmpdir):
+        DummyLauncher.__init__(self, tmpdir)
+        self.started = list()
+
+    def launch(self, test):
+        self.started.append(test["name"])
+        result = qitest.result.TestResult(test)
+        result.ok = True
+        result.time = test.get("time", 0)
+        result.message = (ui.green, "[OK]")
+        return result
+
+def test_longest_tests_first(tmpdir):
+    tmpdir.join(".durations.json").write(json.dumps({
+        "short" : 1, "long" : 600, "medium" : 20,
+    }))
+    tests = [
+        {"name" : "short"},
+        {"name" : "medium"},
+        {"name" : "unknown", "timeout" : 100},
+        {"name" : "long", "time" : 500},
+    ]
+    test_queue = qitest.test_queue.TestQueue(tests)
+    launcher = RecordingLauncher(tmpdir)
+    test_queue.launcher = launcher
+    test_queue.run(num_jobs=2)
+    assert test_queue.ok
+    # the two workers start with the two longest tests
+    assert sorted(launcher.started[:2]) == ["long", "unknown"]
+    durations = json.loads(tmpdir.join(".durations.json").read())
+    assert durations["long"] == 500
+    assert durations["unknown"] == 0
+
+def test_declaration_order_with_one_job(tmpdir):
+    tmpdir.join(".durations.json").write(json.dumps({"one" : 1, "two" : 2}))
+    tests = [{"name" : "one"}, {"name" : "two"}]
+    test_queue = qitest.test_queue.TestQueue(tests)
+    launcher = RecordingLauncher(tmpdir)
+    test_queue.launcher = launcher
+    test_queue.run(num_jobs=1)
+    assert launcher.started == ["one", "two"]
+
+def test_sort_tests(tmpdir):
+    tmpdir.join(".durations.json").write(json.dumps({
+        "short" : 1, "long" : 600, "medium" : 20,
+    }))
+    tests = [
+        {"name" : "short"},
+        {"name" : "unknown", "timeout" : 100},
+        {"name" : "medium"},
+        {"name" : "long"},
+        {"name" : "no_timeout"},
+    ]
+    test_queue = qitest.test_queue.TestQueue(tests)
+    test_queue.launcher = DummyLauncher(tmpdir)
+    names = [x["name"] for x in test_queue.sort_tests(tests)]
+    assert names == ["long", "unknown", "medium", "no_timeout", "short"]
+
+def test_queue_group(tmpdir):
+    foo_tests = [{"name" : "foo_one"}, {"name" : "foo_two", "time" : 2}]
+    bar_tests = [{"name" : "bar_one"}]
+    foo_queue = qitest.test_queue.TestQueue(foo_tests, name="foo")
+    foo_queue.launcher = RecordingLauncher(tmpdir.mkdir("foo"))
+    bar_queue = qitest.test_queue.TestQueue(bar_tests, name="bar")
+    bar_queue.launcher = RecordingLauncher(tmpdir.mkdir("bar"))
+    queue_group = qitest.test_queue.TestQueueGroup([foo_queue, bar_queue])
+    assert queue_group.run(num_jobs=2)
+    assert sorted(foo_queue.launcher.started) == ["foo_one", "foo_two"]
+    assert bar_queue.launcher.started == ["bar_one"]
+    assert foo_queue.ok and bar_queue.ok
+    assert sorted(foo_queue.results.keys()) == ["foo_one", "foo_two"]
+    foo_durations = json.loads(tmpdir.join("foo", ".durations.json").read())
+    assert foo_durations == {"foo_one" : 0, "foo_two" : 2}
+    bar_durations = json.loads(tmpdir.join("bar", ".durations.json").read())
+    assert bar_durations == {"bar_one" : 0}
+
+def test_queue_group_with_failures(tmpdir):
+    foo_queue = qitest.test_queue.TestQueue([{"name" : "one"}], name="foo")
+    foo_queue.launcher = DummyLauncher(tmpdir.mkdir("foo"))
+    bar_queue = qitest.test_queue.TestQueue([{"name" : "two"}], name="bar")
+    bar_queue.launcher = DummyLauncher(tmpdir.mkdir("bar"))
+    fail_result = qitest.result.TestResult({"name" : "two"})
+    fail_result.ok = False
+    fail_result.message = (ui.red, "[FAIL]")
+    bar_queue.launcher.results = {"two" : {"result" : fail_result}}
+    queue_group = qitest.test_queue.TestQueueGroup([foo_queue, bar_queue])
+    assert not queue_group.run(num_jobs=2)
+    assert foo_queue.ok
+    assert not bar_queue.ok
+    assert json.loads(tmpdir.join("bar", ".failed.json").read()) == ["two"]
+
+class InterruptingLauncher(RecordingLauncher):
+    def __init__(self, tmpdir):
+        RecordingLauncher.__init__(self, tmpdir)
+        self.to_interrupt = None
+
+    def launch(self, test):
+        self.to_interrupt.interrupt()
+        return RecordingLauncher.launch(self, test)
+
+def test_interrupted_queue_group(tmpdir):
+    foo_queue = qitest.test_queue.TestQueue([{"name" : "one"}], name="foo")
+    foo_queue.launcher = InterruptingLauncher(tmpdir.mkdir("foo"))
+    bar_queue = qitest.test_queue.TestQueue([{"name" : "two"}], name="bar")
+    bar_queue.launcher = RecordingLauncher(tmpdir.mkdir("bar"))
+    queue_group = qitest.test_queue.TestQueueGroup([foo_queue, bar_queue])
+    foo_queue.launcher.to_interrupt = queue_group
+    assert not queue_group.run(num_jobs=1)
+    assert queue_group.interrupted
+    assert foo_queue.interrupted and bar_queue.interrupted
+    assert not foo_queue.ok and not bar_queue.ok
+    assert bar_queue.launcher.started == list()
+
+def test_split_in_shards():
+    gtest = {"name" : "foo", "gtest" : True, "environment" : {"SPAM" : "1"}}
+    shards = qitest.test_queue.split_in_shards(gtest, 3)
+    assert [x["name"] for x in shards] == ["foo.shard-0", "foo.shard-1", "foo.shard-2"]
+    assert shards[1]["environment"] == {
+        "SPAM" : "1", "GTEST_TOTAL_SHARDS" : "3", "GTEST_SHARD_INDEX" : "1"
+    }
+    assert shards[1]["shard"] == {"test_name" : "foo", "index" : 1, "num_shards" : 3}
+    assert gtest["environment"] == {"SPAM" : "1"}
+    not_gtest = {"name" : "bar"}
+    assert qitest.test_queue.split_in_shards(not_gtest, 3) == [not_gtest]
+    assert qitest.test_queue.split_in_shards(gtest, 1) == [gtest]
+
+def test_queue_with_shards(tmpdir):
+    tmpdir.join(".durations.json").write(json.dumps({"big" : 30, "small" : 2}))
+    tests = [{"name" : "big", "gtest" : True}, {"name" : "small", "time" : 2}]
+    test_queue = qitest.test_queue.TestQueue(tests, num_shards=3)
+    test_queue.launcher = RecordingLauncher(tmpdir)
+    assert test_queue.run(num_jobs=3)
+    assert sorted(test_queue.launcher.started) == [
+        "big.shard-0", "big.shard-1", "big.shard-2", "small"
+    ]
+    assert test_queue.launcher.started[-1] == "small"
+    assert test_queue.results.keys() == ["big", "small"] or \
+           test_queue.results.keys() == ["small", "big"]
+    assert test_queue.results["big"].test == tests[0]
+    assert test_queue.results["big"].ok
+
+def test_queue_with_failing_shard(tmpdir):
+    tests = [{"name" : "big", "gtest" : True}]
+    test_queue = qitest.test_queue.TestQueue(tests, num_shards=2)
+    test_queue.launcher = DummyLauncher(tmpdir)
+    fail_result = qitest.result.TestResult({"name" : "big.shard-1"})
+    fail_result.ok = False
+    fail_result.message = (ui.red, "[FAIL]")
+    test_queue.launcher.results = {"big.shard-1" : {"result" : fail_result}}
+    assert not test_queue.run(num_jobs=2)
+    assert test_queue.results["big"].message == (ui.red, "[FAIL]")
+    assert json.loads(tmpdir.join(".failed.json").read()) == ["big"]
+
+class FlakyLauncher(RecordingLauncher):
+    """ Fails the first ``num_failures`` times a test is run """
+    def __init__(self, tmpdir, num_failures):
+        RecordingLauncher.__init__(self, tmpdir)
+        self.num_failures = num_failures
+        self.timeouts = list()
+
+    def launch(self, test):
+        result = RecordingLauncher.launch(self, test)
+        self.timeouts.append(test.get("timeout"))
+        test["cmd"] = test.get("cmd", list()) + ["--modified"]
+        if self.started.count(test["name"]) <= self.num_failures.get(test["name"], 0):
+            result.ok = False
+            result.message = (ui.red, "[FAIL]")
+        return result
+
+def test_retries(tmpdir):
+    tests = [
+        {"name" : "ok", "cmd" : ["ok"]},
+        {"name" : "flaky", "cmd" : ["flaky"], "timeout" : 5},
+        {"name" : "broken", "cmd" : ["broken"]},
+    ]
+    test_queue = qitest.test_queue.TestQueue(tests, retries=2)
+    launcher = FlakyLauncher(tmpdir, {"flaky" : 1, "broken" : 10})
+    test_queue.launcher = launcher
+    assert not test_queue.run(num_jobs=2)
+    assert launcher.started.count("ok") == 1
+    assert launcher.started.count("flaky") == 2
+    assert launcher.started.count("broken") == 3
+    assert test_queue.results["flaky"].ok
+    assert test_queue.results["flaky"].retries == 1
+    assert test_queue.results["flaky"].message[1] == "[FLAKY]"
+    assert test_queue.results["broken"].retries == 2
+    assert json.loads(tmpdir.join(".failed.json").read()) == ["broken"]
+    # Retries are run with a longer timeout, from the original test
+    assert sorted(launcher.timeouts)[-2:] == [40, 40]
+    assert 10 in launcher.timeouts
+
+def test_flaky_tests_do_not_fail_the_run(tmpdir, record_messages):
+    tests = [{"name" : "flaky"}]
+    test_queue = qitest.test_queue.TestQueue(tests, retries=1)
+    test_queue.launcher = FlakyLauncher(tmpdir, {"flaky" : 1})
+    assert test_queue.run(num_jobs=1)
+    assert record_messages.find("1 flaky tests")
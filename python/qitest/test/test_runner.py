@@ -2,7 +2,11 @@
 ## Use of this source code is governed by a BSD-style license that can be
 ## found in the COPYING file.
 
+import json
+import os
+
 import qisys.error
+import qitest.conf
 import qitest.project
 import qitest.runner
 
@@ -12,6 +16,54 @@ class DummyTestRunner(qitest.runner.TestSuiteRunner):
     def launcher(self, *args):
         pass
 
+def test_selection_is_cached(tmpdir):
+    tests = [{"name" : "test_foo"}, {"name" : "test_bar"}]
+    qitest_json = tmpdir.ensure("qitest.json", file=True)
+    qitest.conf.write_tests(tests, qitest_json.strpath)
+    test_project = qitest.project.TestProject(qitest_json.strpath)
+    test_runner = DummyTestRunner(test_project)
+    test_runner.patterns = ["foo"]
+    selected = test_runner.tests
+    assert selected == [{"name" : "test_foo"}]
+    assert test_runner.tests is selected
+    test_runner.excludes = ["foo"]
+    assert test_runner.tests == list()
+
+class DummyProject(object):
+    def __init__(self, sdk_directory):
+        self.sdk_directory = sdk_directory
+
+class DummyLauncher(object):
+    def __init__(self, project):
+        self.project = project
+
+class FailedTestRunner(qitest.runner.TestSuiteRunner):
+    @property
+    def launcher(self):
+        return DummyLauncher(DummyProject(self.project.sdk_directory))
+
+def test_selection_cache_is_invalidated(tmpdir):
+    tests = [{"name" : "test_foo"}, {"name" : "test_bar"}]
+    qitest_json = tmpdir.ensure("qitest.json", file=True)
+    qitest.conf.write_tests(tests, qitest_json.strpath)
+    test_project = qitest.project.TestProject(qitest_json.strpath)
+    test_runner = FailedTestRunner(test_project)
+    assert len(test_runner.tests) == 2
+    test_runner._tests.append({"name" : "test_spam"})
+    assert len(test_runner.tests) == 3
+    test_runner._tests = [{"name" : "test_eggs"}]
+    assert test_runner.tests == [{"name" : "test_eggs"}]
+
+    test_runner._tests = tests
+    test_runner.last_failed = True
+    failed_json = tmpdir.join(".failed.json")
+    failed_json.write(json.dumps(["test_foo"]))
+    os.utime(failed_json.strpath, (1000, 1000))
+    assert test_runner.tests == [{"name" : "test_foo"}]
+    failed_json.write(json.dumps(["test_bar"]))
+    os.utime(failed_json.strpath, (2000, 2000))
+    assert test_runner.tests == [{"name" : "test_bar"}]
+
 def test_match_patterns(tmpdir):
     test_foo = { "name" : "test_foo"}
     test_bar = { "name" : "test_bar"}
@@ -5,8 +5,10 @@
 import os
 import contextlib
 import collections
+import copy
 import datetime
 import json
+import operator
 import signal
 import traceback
 import time
@@ -18,22 +20,133 @@ import Queue
 from qisys import ui
 import qisys.command
 import qisys.error
+import qitest.history
 import qitest.result
 
+# Timeout used for the tests that do not specify one
+DEFAULT_TIMEOUT = 20
 
-class TestQueue(object):
-    """ A class able to run tests in parallel """
+class _TestWorkerPool(object):
+    """ Common code of :py:class:`TestQueue` and :py:class:`TestQueueGroup`:
+    run tasks with a pool of :py:class:`TestWorker` threads, measure the
+    time spent and handle ctrl+c
+
+    Sub-classes implement ``_fill_task_queue(num_jobs)`` and ``summary()``
+
+    """
     def __init__(self, tests):
-        self.tests = tests
         self.test_logger = TestLogger(tests)
         self.task_queue = Queue.Queue()
-        self.launcher = None
-        self.results = collections.OrderedDict()
         self.ok = False
-        self._interrupted = False
         self.elapsed_time = 0
+        self._interrupted = False
         self._workers = list()
 
+    @property
+    def interrupted(self):
+        """ Whether the run was interrupted by the user """
+        return self._interrupted
+
+    def interrupt(self):
+        """ Mark the run as interrupted and tell the workers to stop """
+        self._interrupted = True
+        for worker in self._workers:
+            worker.stop()
+
+    def _timed_run(self, num_jobs):
+        """ Run the tasks, then display the summary """
+        signal.signal(signal.SIGINT, self.sigint_handler)
+        start = datetime.datetime.now()
+        try:
+            self._run(num_jobs=num_jobs)
+        finally:
+            signal.signal(signal.SIGINT, signal.default_int_handler)
+        end = datetime.datetime.now()
+        delta = end - start
+        self.elapsed_time = float(delta.microseconds) / 10**6 + delta.seconds
+        self.summary()
+        return self.ok
+
+    def _run(self, num_jobs=1):
+        """ Helper function for ._timed_run """
+        if not self._fill_task_queue(num_jobs):
+            return
+        if num_jobs == 1:
+            self.test_logger.single_job = True
+
+        self._workers = start_workers(self.task_queue, num_jobs,
+                                      self.test_logger)
+        while not self.task_queue.empty() and \
+              not self._interrupted:
+            time.sleep(0.1)
+
+        for worker_thread in self._workers:
+            worker_thread.join()
+
+    def _fill_task_queue(self, num_jobs):
+        """ Put the ``(test, index, test_queue)`` tasks in the task queue.
+        Return False if there is nothing to run
+
+        """
+        raise NotImplementedError()
+
+    def summary(self):
+        """ Display the results. Sets ``self.ok`` """
+        raise NotImplementedError()
+
+    def sigint_handler(self, *args):
+        """ Called when user press ctr+c during the test suite
+
+        * Tell qisys.command to kill every process still running
+        * Mark the run as interrupted, and stop all the test workers
+        * Setup a second sigint for when killing process failed
+
+        """
+        def double_sigint(signum, frame):
+            sys.exit("Exiting main program\n"
+                     "This may leave orphan processes")
+        qisys.command.SIGINT_EVENT.set()
+        ui.warning("\n!!!",
+                   "Interrupted by user, stopping every process.\n"
+                   "This may take a few seconds")
+        self.interrupt()
+        signal.signal(signal.SIGINT, double_sigint)
+
+
+class TestQueue(_TestWorkerPool):
+    """ A class able to run tests in parallel
+
+    When ``num_shards`` is greater than 1, each gtest test is split
+    in ``num_shards`` tasks (see :py:func:`split_in_shards`), run by
+    different workers. Their results are merged by the launcher
+    once all the shards of a test are finished.
+
+    When ``retries`` is greater than 0, failing tests are run again
+    (with a longer timeout), up to ``retries`` times. Tests passing
+    after a retry are considered flaky: they are listed in the
+    summary, but do not make the run fail.
+
+    """
+    def __init__(self, tests, name=None, num_shards=1, retries=0):
+        self.tests = tests
+        self.name = name
+        self.tasks = list()
+        for test in tests:
+            self.tasks.extend(split_in_shards(test, num_shards))
+        super(TestQueue, self).__init__(self.tasks)
+        self.retries = retries
+        # The launcher modifies the tests, so keep a copy to run them again
+        self._original_tasks = dict()
+        if retries:
+            self._original_tasks = dict((x["name"], copy.deepcopy(x))
+                                        for x in self.tasks)
+        self._num_retries = dict()
+        self.launcher = None
+        self.results = collections.OrderedDict()
+        self.num_jobs = 1
+        self._shard_results = dict()
+        self._results_lock = threading.Lock()
+
     def run(self, num_jobs=1, repeat_until_fail=0):
         """ Run all the tests """
         if repeat_until_fail == 0:
@@ -57,42 +170,137 @@ class TestQueue(object):
         """ Helper for run """
         if not self.tests:
             ui.warning("No tests selected for run")
-        signal.signal(signal.SIGINT, self.sigint_handler)
-        start = datetime.datetime.now()
-        self._run(num_jobs=num_jobs)
-        signal.signal(signal.SIGINT, signal.default_int_handler)
-        end = datetime.datetime.now()
-        delta = end - start
-        self.elapsed_time = float(delta.microseconds) / 10**6 + delta.seconds
-        self.summary()
-        return self.ok
+        return self._timed_run(num_jobs)
 
-    def _run(self, num_jobs=1):
-        """ Helper function for ._run_once """
+    def _fill_task_queue(self, num_jobs):
+        """ Helper function for ._run """
         if not self.launcher:
             ui.error("test launcher not set, cannot run tests")
-            return
-        for i, test in enumerate(self.tests):
-            self.task_queue.put((test, i))
+            return False
+        self.num_jobs = num_jobs
+        self._num_retries = dict()
+        tests = self.tasks
+        if num_jobs > 1:
+            tests = self.sort_tests(tests)
+        for i, test in enumerate(tests):
+            self.task_queue.put((test, i, self))
+        return True
+
+    def sort_tests(self, tests):
+        """ Sort the tests so that the longest ones are run first.
+
+        This way, a long test declared last does not keep the
+        run going long after all the other tests are finished.
+        Durations are read from the previous runs. For tests that
+        never ran, the timeout is used instead.
 
-        if num_jobs == 1:
-            self.test_logger.single_job = True
+        """
+        durations = self.read_durations()
+        return sorted(tests, reverse=True,
+                      key=lambda x: self.expected_duration(x, durations))
 
-        for i in range(0, num_jobs):
-            worker = TestWorker(self.task_queue, i)
-            worker.launcher = self.launcher
-            worker.launcher.worker_index = i
-            worker.test_logger = self.test_logger
-            worker.results = self.results
-            self._workers.append(worker)
-            worker.start()
+    @staticmethod
+    def expected_duration(test, durations):
+        """ Guess how long a test will take, given the durations
+        of the previous runs
 
-        while not self.task_queue.empty() and \
-              not self._interrupted:
-            time.sleep(0.1)
+        """
+        shard = test.get("shard")
+        if shard:
+            res = durations.get(shard["test_name"])
+            if res is not None:
+                res = float(res) / shard["num_shards"]
+        else:
+            res = durations.get(test["name"])
+        if res is None:
+            res = test.get("timeout") or DEFAULT_TIMEOUT
+        return res
 
-        for worker_thread in self._workers:
-            worker_thread.join()
+    def get_retry(self, test, result):
+        """ Called by the workers when a test is over.
+
+        Return a copy of the test to run again if it failed
+        and may be retried, None otherwise
+
+        """
+        if result.ok is not False or result.error:
+            return None
+        name = test["name"]
+        num_retries = self._num_retries.get(name, 0)
+        if num_retries >= self.retries:
+            return None
+        self._num_retries[name] = num_retries + 1
+        retry = copy.deepcopy(self._original_tasks[name])
+        retry["timeout"] = (retry.get("timeout") or DEFAULT_TIMEOUT) * 2
+        return retry
+
+    def add_result(self, test, result):
+        """ Called by the workers when a test is over, and
+        will not be run again.
+
+        The results of the shards of a test are stored until all of
+        them are known, and then merged by the launcher
+
+        """
+        result.retries = self._num_retries.get(test["name"], 0)
+        if result.ok and result.retries:
+            result.message = (ui.brown, "[FLAKY]",
+                              "passed after %i retries" % result.retries)
+        shard = test.get("shard")
+        if not shard:
+            self.results[test["name"]] = result
+            return
+        test_name = shard["test_name"]
+        with self._results_lock:
+            shard_results = self._shard_results.setdefault(test_name, dict())
+            shard_results[shard["index"]] = result
+            if len(shard_results) != shard["num_shards"]:
+                return
+            del self._shard_results[test_name]
+        shard_results = [shard_results[i] for i in sorted(shard_results)]
+        original = [x for x in self.tests if x["name"] == test_name][0]
+        self.results[test_name] = self.launcher.merge_shards(original,
+                                                             shard_results)
+
+    def read_durations(self):
+        """ Read the durations of the tests (name -> seconds) as
+        measured during the previous runs
+
+        """
+        durations_json = self._get_durations_json()
+        if not os.path.exists(durations_json):
+            return dict()
+        try:
+            with open(durations_json, "r") as fp:
+                return json.load(fp)
+        except ValueError:
+            ui.warning("Ignoring invalid durations file", durations_json)
+            return dict()
+
+    def write_durations(self):
+        """ Update the durations of the tests with the results of this run """
+        durations = self.read_durations()
+        for name, result in self.results.iteritems():
+            # interrupted tests do not give a meaningful duration
+            if result.ok is not None and not result.error:
+                durations[name] = result.time
+        with open(self._get_durations_json(), "w") as fp:
+            json.dump(durations, fp, indent=2)
+
+    def write_history(self):
+        """ Add the results of this run to the tests history """
+        qitest.history.write_run(self._get_history_db(),
+                                 self.results.values(),
+                                 num_jobs=self.num_jobs,
+                                 elapsed_time=self.elapsed_time)
+
+    def _get_history_db(self):
+        path = self.launcher.project.sdk_directory
+        return os.path.join(path, ".history.sqlite")
+
+    def _get_durations_json(self):
+        path = self.launcher.project.sdk_directory
+        return os.path.join(path, ".durations.json")
 
     def summary(self):
         """ Display the tests results.
@@ -109,7 +317,20 @@ class TestQueue(object):
         num_failed = len(failures)
         message = "Ran %i tests in %is" % (num_tests, self.elapsed_time)
         ui.info(message)
+        if self.num_jobs > 1 and self.elapsed_time:
+            total_time = sum(x.time for x in self.results.values())
+            efficiency = total_time / (self.elapsed_time * self.num_jobs)
+            ui.info("Parallel efficiency: %i%% (%i jobs)" %
+                    (min(efficiency, 1) * 100, self.num_jobs))
         self.ok = (not failures) and not self._interrupted
+        flaky = [x for x in self.results.values() if x.ok and x.retries]
+        if flaky:
+            ui.warning(len(flaky), "flaky tests")
+            max_len = max(len(x.test["name"]) for x in flaky)
+            for i, result in enumerate(flaky):
+                ui.info_count(i, len(flaky),
+                              ui.blue, result.test["name"].ljust(max_len + 2),
+                              ui.reset, *result.message)
         if self.ok:
             ui.info(ui.green, "All pass. Congrats!")
         else:
@@ -122,32 +343,13 @@ class TestQueue(object):
                                 ui.blue, failure.test["name"].ljust(max_len + 2),
                                 ui.reset, *failure.message)
         self.write_failures(failures)
+        self.write_durations()
+        self.write_history()
         errors = [x for x in failures if x.error]
         if errors:
             # No need to display more errors
             raise qisys.error.Error("Unexpected errors occurred during tests")
 
-    def sigint_handler(self, *args):
-        """ Called when user press ctr+c during the test suite
-
-        * Tell qisys.command to kill every process still running
-        * Tell the tests_queue that is has been interrupted, and
-          stop all the test workers
-        * Setup a second sigint for when killing process failed
-
-        """
-        def double_sigint(signum, frame):
-            sys.exit("Exiting main program \n",
-                       "This may leave orphan processes")
-        qisys.command.SIGINT_EVENT.set()
-        ui.warning("\n!!!",
-                   "Interrupted by user, stopping every process.\n"
-                   "This may take a few seconds")
-        self._interrupted = True
-        for worker in self._workers:
-            worker.stop()
-        signal.signal(signal.SIGINT, double_sigint)
-
     def write_failures(self, failures):
         path = self.launcher.project.sdk_directory
         fail_json = os.path.join(path, ".failed.json")
@@ -165,18 +367,120 @@ class TestQueue(object):
         raise qisys.error.Error()
 
 
+class TestQueueGroup(_TestWorkerPool):
+    """ Run the tests of several test queues (usually one per project)
+    using the same pool of workers, so that no CPU is idle while the
+    last tests of a project are running.
+
+    Each test is still run by the launcher of its queue, so
+    environment, working directory and test results are the same
+    as when running the queues one after the other.
+
+    """
+    def __init__(self, test_queues):
+        self.test_queues = test_queues
+        all_tests = list()
+        for test_queue in test_queues:
+            all_tests.extend(test_queue.tasks)
+        super(TestQueueGroup, self).__init__(all_tests)
+
+    def run(self, num_jobs=1):
+        """ Run all the tests, then display a summary for each queue """
+        return self._timed_run(num_jobs)
+
+    def _fill_task_queue(self, num_jobs):
+        """ Helper function for ._run """
+        # Longest tests first, whatever their project
+        to_run = list()
+        for test_queue in self.test_queues:
+            test_queue.num_jobs = num_jobs
+            if not test_queue.tests:
+                continue
+            durations = test_queue.read_durations()
+            for test in test_queue.tasks:
+                expected = test_queue.expected_duration(test, durations)
+                to_run.append((expected, test, test_queue))
+        to_run.sort(key=operator.itemgetter(0), reverse=True)
+        for i, (unused_expected, test, test_queue) in enumerate(to_run):
+            self.task_queue.put((test, i, test_queue))
+        return True
+
+    def summary(self):
+        """ Display the results of each queue. Sets ``self.ok`` """
+        self.ok = not self._interrupted
+        errors = list()
+        for test_queue in self.test_queues:
+            ui.info(ui.bold, "::", ui.reset, "Results for", ui.blue,
+                    test_queue.name)
+            if not test_queue.tests:
+                ui.warning("No tests selected for run")
+            test_queue.elapsed_time = self.elapsed_time
+            if self.interrupted:
+                test_queue.interrupt()
+            try:
+                test_queue.summary()
+            except qisys.error.Error as e:
+                errors.append(e)
+            self.ok = self.ok and test_queue.ok
+        if errors:
+            raise errors[0]
+
+
+def split_in_shards(test, num_shards):
+    """ Split a gtest test in ``num_shards`` tests, using the
+    ``GTEST_TOTAL_SHARDS`` and ``GTEST_SHARD_INDEX`` environment
+    variables.
+
+    Return ``[test]`` for tests that cannot be split.
+
+    """
+    if num_shards <= 1 or not test.get("gtest") or test.get("perf"):
+        return [test]
+    res = list()
+    for i in range(num_shards):
+        shard = copy.deepcopy(test)
+        shard["name"] = "%s.shard-%i" % (test["name"], i)
+        shard["shard"] = {
+            "test_name" : test["name"],
+            "index" : i,
+            "num_shards" : num_shards,
+        }
+        environment = shard.get("environment") or dict()
+        environment["GTEST_TOTAL_SHARDS"] = str(num_shards)
+        environment["GTEST_SHARD_INDEX"] = str(i)
+        shard["environment"] = environment
+        res.append(shard)
+    return res
+
+
+def start_workers(task_queue, num_jobs, test_logger):
+    """ Start ``num_jobs`` :py:class:`TestWorker` threads consuming
+    the task queue. Return the list of workers
+
+    """
+    res = list()
+    for i in range(0, num_jobs):
+        worker = TestWorker(task_queue, i)
+        worker.test_logger = test_logger
+        res.append(worker)
+        worker.start()
+    return res
+
+
 class TestWorker(threading.Thread):
     """ Implementation of a 'worker' thread. It will consume
     the test queue, running the tests and logging the results
 
+    Items of the queue are ``(test, index, test_queue)`` tuples:
+    the test is run by the launcher of its test queue, and the
+    result is stored in the results of its test queue
+
     """
     def __init__(self, queue, worker_index):
         super(TestWorker, self).__init__(name="TestWorker#%i" % worker_index)
         self.index = worker_index
         self.queue = queue
-        self.launcher = None
         self.test_logger = None
-        self.results = dict()
         self._should_stop = False
 
     def stop(self):
@@ -186,22 +490,33 @@ class TestWorker(threading.Thread):
     def run(self):
         while not self._should_stop:
             try:
-                test, index = self.queue.get_nowait()
+                test, index, test_queue = self.queue.get_nowait()
             except Queue.Empty:
                 return
             self.test_logger.on_start(test, index)
             result = None
+            launcher = test_queue.launcher
             try:
-                result = self.launcher.launch(test)
+                launcher.worker_index = self.index
+                result = launcher.launch(test)
             except Exception, e:
                 result = qitest.result.TestResult(test)
                 result.ok = False
                 result.message = ui.message_for_exception(e,
                         "Python exception during tests")
                 result.error = True
+            result.worker = self.index
+            retry = None
             if not self._should_stop:
-                self.test_logger.on_completed(test, index, result.message)
-            self.results[test["name"]] = result
+                retry = test_queue.get_retry(test, result)
+            if retry:
+                message = tuple(result.message) + (ui.reset, "(running again)")
+                self.test_logger.on_completed(test, index, message)
+                self.queue.put((retry, index, test_queue))
+            else:
+                test_queue.add_result(test, result)
+                if not self._should_stop:
+                    self.test_logger.on_completed(test, index, result.message)
             self.queue.task_done()
 
 
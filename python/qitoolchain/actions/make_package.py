@@ -17,6 +17,13 @@ def configure_parser(parser):
     parser.add_argument("-o", "--output",
                         help="Base directory in which to create the archive. "
                              "Defaults to current working directory")
+    parser.add_argument("--compression-level", type=int,
+                        help="zlib compression level, from 0 (store only) "
+                             "to 9. Default: 6")
+    parser.add_argument("--reproducible", action="store_true",
+                        help="Use fixed timestamps and permissions, so "
+                             "that the same content gives the same package")
+    parser.set_defaults(reproducible=False)
 
 def do(args):
     input_directory = args.directory
@@ -39,6 +46,8 @@ def do(args):
 
     archive_name = "-".join(parts) + ".zip"
     output = os.path.join(output, archive_name)
-    res = qisys.archive.compress(input_directory, flat=True, output=output)
+    res = qisys.archive.compress(input_directory, flat=True, output=output,
+                                 compression_level=args.compression_level,
+                                 reproducible=args.reproducible)
     ui.info(ui.green, "Package generated in", res)
     return res
@@ -4,6 +4,8 @@
 
 """ Display info about a toolchain package """
 
+import os
+
 from qisys import ui
 import qisys.parsers
 import qitoolchain.parsers
@@ -23,3 +25,9 @@ def do(args):
     ui.info("path:", package.path)
     if package.license:
         ui.info("license:", package.license)
+    mask_names = sorted(x[:-len(".mask")] for x in os.listdir(package.path)
+                        if x.endswith(".mask"))
+    for mask_name in mask_names:
+        install_mask = package.get_install_mask(mask_name, release=False)
+        ui.info("install mask:", mask_name,
+                "(%i rules)" % len(install_mask.lines))
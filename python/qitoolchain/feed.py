@@ -7,7 +7,12 @@
 
 
 import os
+import hashlib
+import json
+import tempfile
+import urllib2
 import urlparse
+import StringIO
 try:
     # Prefer ElementTree from lxml as it will not reorder attributes when
     # writing XML.
@@ -18,12 +23,15 @@ except ImportError:
 from qisys import ui
 import qisys.archive
 import qisys.error
+import qisys.parallel
 import qisys.remote
 import qisys.sh
 import qisys.version
 import qisrc.git
 import qitoolchain
 
+# Maximum number of feeds downloaded at the same time
+MAX_CONCURRENT_FETCHES = 8
 
 def is_url(location):
     """ Check that a given location is an URL """
@@ -52,7 +60,7 @@ def tree_from_feed(feed_location):
             fp = open(feed_location, "r")
         else:
             if is_url(feed_location):
-                fp = qisys.remote.open_remote_location(feed_location)
+                fp = open_feed_url(feed_location)
             else:
                 raise qisys.error.Error(
                         "Feed location is not an existing path nor an url")
@@ -66,6 +74,90 @@ def tree_from_feed(feed_location):
             fp.close()
     return tree
 
+def open_feed_url(feed_url):
+    """ Open a feed from an url.
+
+    HTTP feeds are cached on disk, along with their ``ETag`` and
+    ``Last-Modified`` headers, so that the feed is only downloaded
+    again when it has changed on the server.
+
+    :return: a file-like object
+
+    """
+    if not feed_url.startswith(("http://", "https://")):
+        return qisys.remote.open_remote_location(feed_url)
+    cache_key = hashlib.sha1(feed_url).hexdigest()
+    cache_path = qisys.sh.get_cache_path("qi", "feeds", cache_key + ".xml")
+    info_path = os.path.splitext(cache_path)[0] + ".json"
+    headers = dict()
+    (cache_info, cached_data) = _read_feed_cache(cache_path, info_path)
+    if cache_info:
+        if cache_info.get("etag"):
+            headers["If-None-Match"] = cache_info["etag"]
+        if cache_info.get("last_modified"):
+            headers["If-Modified-Since"] = cache_info["last_modified"]
+    try:
+        url_obj = qisys.remote.authenticated_urlopen(feed_url, headers=headers)
+    except urllib2.HTTPError as e:
+        if e.code == 304 and cached_data is not None:
+            ui.debug("Using cached feed for", feed_url)
+            return StringIO.StringIO(cached_data)
+        raise
+    try:
+        data = url_obj.read()
+        url_headers = url_obj.info()
+    finally:
+        url_obj.close()
+    cache_info = {
+        "url" : feed_url,
+        "etag" : url_headers.getheader("ETag"),
+        "last_modified" : url_headers.getheader("Last-Modified"),
+        "sha1" : hashlib.sha1(data).hexdigest(),
+    }
+    if cache_info["etag"] or cache_info["last_modified"]:
+        # The .json file is written last, so that it never
+        # describes a feed that is not fully written
+        _write_cache_file(cache_path, data)
+        _write_cache_file(info_path, json.dumps(cache_info))
+    return StringIO.StringIO(data)
+
+def _read_feed_cache(cache_path, info_path):
+    """ Return the cached headers and contents of a feed,
+    or (None, None) if the cache is missing, unreadable or
+    does not match the cached headers
+
+    """
+    try:
+        with open(info_path, "r") as fp:
+            cache_info = json.load(fp)
+        with open(cache_path, "rb") as fp:
+            data = fp.read()
+    except (IOError, ValueError):
+        return (None, None)
+    if not isinstance(cache_info, dict) or \
+            cache_info.get("sha1") != hashlib.sha1(data).hexdigest():
+        ui.debug("Ignoring inconsistent feed cache", cache_path)
+        return (None, None)
+    return (cache_info, data)
+
+def _write_cache_file(path, data):
+    """ Write then rename, so that concurrent fetches never
+    read a partial file
+
+    """
+    (fd, tmp_path) = tempfile.mkstemp(dir=os.path.dirname(path),
+                                      prefix=os.path.basename(path),
+                                      suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as fp:
+            fp.write(data)
+        if os.name == 'nt' and os.path.exists(path):
+            os.remove(path)
+        os.rename(tmp_path, path)
+    except (IOError, OSError) as e:
+        ui.debug("Could not write", path, ":", e)
+        qisys.sh.rm(tmp_path)
+
 def open_git_feed(toolchain_name, feed_url, name=None, branch="master", first_pass=True):
     git_path = qisys.sh.get_share_path("qi", "toolchains", toolchain_name + ".git")
     git = qisrc.git.Git(git_path)
@@ -130,16 +222,34 @@ class ToolchainFeedParser:
 
     def iter_feeds(self, feed, branch=None, name=None):
         """Recursively parse the feed and yield all the feed paths
+        """
+        for (feed_path, unused_tree) in self.iter_trees(feed, branch, name):
+            yield feed_path
+
+    def iter_trees(self, feed, branch=None, name=None):
+        """Recursively parse the feed and yield (feed path, tree) tuples,
+        in the order the feeds are included.
+
+        Each distinct feed is only fetched and yielded once, and the
+        sub-feeds of a feed are fetched concurrently
+
         """
         if branch and name:
             feed_path = open_git_feed(self.name, feed, branch=branch, name=name)
         else:
             feed_path = feed
-
-        yield feed_path
-
-        tree = tree_from_feed(feed_path)
-
+        trees = dict()
+        self._fetch_trees([feed_path], trees)
+        seen = set()
+        for res in self._iter_trees(feed, feed_path, trees, seen):
+            yield res
+
+    def _iter_trees(self, feed, feed_path, trees, seen):
+        seen.add(feed_path)
+        tree = trees[feed_path]
+        yield (feed_path, tree)
+
+        children = list()
         feeds = tree.findall("feed")
         for feed_tree in feeds:
             child = None
@@ -156,17 +266,37 @@ class ToolchainFeedParser:
                 if feed_name:
                     child = os.path.join(os.path.dirname(feed_path), feed_name + ".xml")
 
-            if child:
-                for i in self.iter_feeds(child):
-                    yield i
+            if child and child not in seen and child not in children:
+                children.append(child)
+
+        self._fetch_trees(children, trees)
+        for child in children:
+            if child in seen:
+                continue
+            for res in self._iter_trees(child, child, trees, seen):
+                yield res
+
+    @staticmethod
+    def _fetch_trees(locations, trees):
+        """ Fetch the feeds not already in the trees dict, concurrently """
+        to_fetch = [x for x in locations if x not in trees]
+        errors = list()
+        def fetch(location):
+            try:
+                trees[location] = tree_from_feed(location)
+            except Exception as e:
+                errors.append(e)
+        num_jobs = min(len(to_fetch), MAX_CONCURRENT_FETCHES)
+        qisys.parallel.foreach(to_fetch, fetch, n_jobs=num_jobs)
+        if errors:
+            raise errors[0]
 
     def parse(self, feed, branch=None, name=None):
         """ Recursively parse the feed, filling the self.packages
 
         """
 
-        for feed_path in self.iter_feeds(feed, branch, name):
-            tree = tree_from_feed(feed_path)
+        for (feed_path, tree) in self.iter_trees(feed, branch, name):
             root = tree.getroot()
             if self.strict_feed is None:
                 self.strict_feed = qisys.qixml.parse_bool_attr(root,
@@ -187,13 +317,11 @@ class ToolchainFeedParser:
                         self.blacklist.append(name)
 
     def write_checksums(self, feed):
-        for feed_path in self.iter_feeds(feed):
+        for (feed_path, tree) in self.iter_trees(feed):
             if not os.access(feed_path, os.W_OK):
                 raise qisys.error.Error(
                     "Not a writable file, cannot update checksums: {}".format(feed_path))
 
-            tree = tree_from_feed(feed_path)
-
             package_trees = tree.findall("package")
             for package_tree in package_trees:
                 name_from_feed = package_tree.get("name")
@@ -9,6 +9,7 @@ import zipfile
 from qisys import ui
 from qisys.qixml import etree
 import qisys.error
+import qisys.sh
 import qisys.version
 import qisrc.license
 import qibuild.deps
@@ -43,6 +44,7 @@ class QiPackage(object):
         self.test_depends = set()
         self.checksum = None
         self.overriden_properties = {}
+        self._install_masks = dict()
 
     @property
     def license(self):
@@ -106,6 +108,39 @@ class QiPackage(object):
             installed_files.extend(installed_for_component)
         return installed_files
 
+    def get_install_files(self, components=None, release=True):
+        """ The files :py:meth:`install` may install, relative to the
+        destination. This may list more files than are really installed
+
+        """
+        res = set()
+        for component in components or [None]:
+            manifest_path = None
+            if component:
+                manifest_path = self._get_manifest_path(component, release=release)
+            if manifest_path and os.path.exists(manifest_path):
+                with open(manifest_path, "r") as fp:
+                    res.update(x.strip() for x in fp if x.strip())
+            elif component != "test":
+                res.update(self._list_files())
+        return sorted(qisys.sh.to_posix_path(x) for x in res)
+
+    def _list_files(self):
+        res = list()
+        for (root, directories, filenames) in os.walk(self.path):
+            for filename in filenames + [x for x in directories
+                                         if os.path.islink(os.path.join(root, x))]:
+                rel_path = os.path.relpath(os.path.join(root, filename), self.path)
+                if rel_path != "package.xml":
+                    res.append(rel_path)
+        return res
+
+    def _get_manifest_path(self, component, release=True):
+        manifest_name = "install_manifest_%s.txt" % component
+        if not release and sys.platform.startswith("win"):
+            manifest_name = "install_manifest_%s_debug.txt" % component
+        return os.path.join(self.path, manifest_name)
+
     def _install_all(self, destdir):
         def filter_fun(x):
             return x != "package.xml"
@@ -113,28 +148,22 @@ class QiPackage(object):
 
     def _install_component(self, component, destdir, release=True):
         installed_files = list()
-        manifest_name = "install_manifest_%s.txt" % component
-        if not release and sys.platform.startswith("win"):
-            manifest_name = "install_manifest_%s_debug.txt" % component
-        manifest_path = os.path.join(self.path, manifest_name)
+        manifest_path = self._get_manifest_path(component, release=release)
         if not os.path.exists(manifest_path):
             if component == "test":
                 # tests can only be listed in an install manifest
                 return list()
-            mask = self._read_install_mask(component)
-            if release:
-                mask.extend(self._read_install_mask("release"))
-            if not mask and component=="runtime":
+            install_mask = self.get_install_mask(component, release=release)
+            if install_mask is None and component=="runtime":
                 # retro-compat
                 def filter_fun(x):
                     return qisys.sh.is_runtime(x) and x != "package.xml"
                 return qisys.sh.install(self.path, destdir,
                                         filter_fun=filter_fun)
-            else:
-                # avoid install masks and package.xml
-                mask.append("exclude .*\.mask")
-                mask.append("exclude package\.xml")
-                return self._install_with_mask(destdir, mask)
+            if install_mask is None:
+                install_mask = InstallMask(list())
+            return qisys.sh.install(self.path, destdir,
+                                    filter_fun=install_mask.match)
         else:
             with open(manifest_path, "r") as fp:
                 lines = fp.readlines()
@@ -146,10 +175,40 @@ class QiPackage(object):
                     installed_files.append(line)
             return installed_files
 
+    def get_install_mask(self, component, release=True):
+        """ Get the :py:class:`InstallMask` used when installing
+        the given component, or None if the package has no mask
+        for this component.
+
+        Masks are parsed and compiled only once, and re-read only
+        when one of the mask files changes
+
+        """
+        mask_names = [component]
+        if release:
+            mask_names.append("release")
+        mask_paths = [os.path.join(self.path, x + ".mask") for x in mask_names]
+        key = tuple((x, _get_mtime(x)) for x in mask_paths)
+        res = self._install_masks.get(key)
+        if res is not None:
+            return res
+        lines = list()
+        for mask_name in mask_names:
+            lines.extend(self._read_install_mask(mask_name))
+        if not lines:
+            return None
+        res = InstallMask(lines)
+        self._install_masks[key] = res
+        return res
+
     def _read_install_mask(self, mask_name):
         mask_path = os.path.join(self.path, mask_name + ".mask")
-        if not os.path.exists(mask_path):
+        mtime = _get_mtime(mask_path)
+        if mtime is None:
             return list()
+        cached = _MASK_CACHE.get(mask_path)
+        if cached and cached[0] == mtime:
+            return list(cached[1])
         with open(mask_path, "r") as fp:
             mask = fp.readlines()
             mask = [x.strip() for x in mask]
@@ -162,29 +221,8 @@ class QiPackage(object):
                     mess += line + "\n"
                     mess += "line should start with 'include' or 'exclude'"
                     raise qisys.error.Error(mess)
-            return mask
-
-    def _install_with_mask(self, destdir, mask):
-        def get_match(line, src):
-            words = line.split()
-            regex = " ".join(words[1:])
-            return re.match(regex, src)
-
-        def filter_fun(src):
-            src = qisys.sh.to_posix_path(src)
-            positive_regexps = [x for x in mask if x.startswith("include")]
-            negative_regexps = [x for x in mask if x.startswith("exclude")]
-            for line in positive_regexps:
-                match = get_match(line, src)
-                if match:
-                    return True
-            for line in negative_regexps:
-                match = get_match(line, src)
-                if match:
-                    return False
-            return True
-
-        return qisys.sh.install(self.path, destdir, filter_fun=filter_fun)
+            _MASK_CACHE[mask_path] = (mtime, mask)
+            return list(mask)
 
     def load_package_xml(self, element=None):
         """ Load metadata from package.xml
@@ -301,6 +339,71 @@ mutually exclusive
 
         return result
 
+class InstallMask(object):
+    """ A compiled set of ``include`` and ``exclude`` rules,
+    as read from the ``<component>.mask`` files.
+
+    Rules are regular expressions matched against the beginning
+    of the posix path of the file relative to the package root.
+    ``include`` rules always win over ``exclude`` rules, and files
+    matching no rule are installed. Mask files and ``package.xml``
+    are always excluded.
+
+    """
+    def __init__(self, lines):
+        self.lines = lines
+        include_regexps = list()
+        exclude_regexps = list()
+        # avoid install masks and package.xml
+        for line in lines + ["exclude .*\\.mask", "exclude package\\.xml"]:
+            words = line.split()
+            regex = " ".join(words[1:])
+            if words[0] == "include":
+                include_regexps.append(regex)
+            else:
+                exclude_regexps.append(regex)
+        self._include = _compile_regexps(include_regexps)
+        self._exclude = _compile_regexps(exclude_regexps)
+
+    def match(self, src):
+        """ Return True if the file should be installed """
+        src = qisys.sh.to_posix_path(src)
+        if self._include(src):
+            return True
+        if self._exclude(src):
+            return False
+        return True
+
+def _compile_regexps(regexps):
+    """ Return a function telling if a path matches one of the
+    regular expressions, the way ``re.match`` would do
+
+    """
+    if not regexps:
+        return lambda x: False
+    # A combined alternation is much faster than trying every
+    # regex in turn, but it would change the meaning of back
+    # references and inline flags, so only do this when it is safe
+    if not any(_UNSAFE_RE.search(x) for x in regexps):
+        try:
+            combined = "|".join("(?:%s)" % x for x in regexps)
+            return re.compile(combined).match
+        except re.error:
+            pass
+    compiled = [re.compile(x) for x in regexps]
+    return lambda x: any(regexp.match(x) for regexp in compiled)
+
+_UNSAFE_RE = re.compile(r"\\[1-9]|\(\?P=|\(\?[iLmsux]+\)")
+
+# mask path -> (mtime, lines)
+_MASK_CACHE = dict()
+
+def _get_mtime(path):
+    try:
+        return os.stat(path).st_mtime
+    except OSError:
+        return None
+
 def from_xml(element):
     res = QiPackage(None) # need to pass an argument to the ctor
     name = element.get("name")
@@ -2,9 +2,15 @@
 ## Use of this source code is governed by a BSD-style license that can be
 ## found in the COPYING file.
 
+import BaseHTTPServer
+import hashlib
+import os
+import threading
+
 from qitoolchain.feed import *
 
 import qisys.error
+import qisys.sh
 from qisrc.test.conftest import git_server
 
 import pytest
@@ -51,3 +57,106 @@ def test_git(git_server, feed):
 
     names = [x.name for x in parser.packages]
     assert names == ["boost", "oracle-jdk"]
+
+class FeedServer(object):
+    """ Serve feeds over HTTP, recording the requests """
+    def __init__(self):
+        self.feeds = dict()
+        self.requests = list()
+        server = self
+        class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+            def do_GET(self):
+                name = self.path.lstrip("/")
+                etag = '"%s"' % hash(server.feeds[name])
+                if_none_match = self.headers.getheader("If-None-Match")
+                server.requests.append((name, if_none_match))
+                if if_none_match == etag:
+                    self.send_response(304)
+                    self.end_headers()
+                    return
+                self.send_response(200)
+                self.send_header("ETag", etag)
+                self.end_headers()
+                self.wfile.write(server.feeds[name])
+            def log_message(self, *args):
+                pass
+        self.httpd = BaseHTTPServer.HTTPServer(("127.0.0.1", 0), Handler)
+        self.url = "http://127.0.0.1:%i/" % self.httpd.server_port
+        self.thread = threading.Thread(target=self.httpd.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        self.httpd.shutdown()
+
+@pytest.fixture
+def feed_server(request):
+    res = FeedServer()
+    request.addfinalizer(res.stop)
+    return res
+
+def test_http_feeds_are_fetched_once_and_cached(feed_server):
+    feed_server.feeds["full.xml"] = """\
+<feed>
+  <feed url="oss.xml" />
+  <feed url="3rdpart.xml" />
+  <package name="foo" url="foo.zip" />
+</feed>
+"""
+    feed_server.feeds["oss.xml"] = """\
+<feed>
+  <feed url="common.xml" />
+  <package name="boost" url="boost.zip" />
+</feed>
+"""
+    feed_server.feeds["3rdpart.xml"] = """\
+<feed>
+  <feed url="common.xml" />
+  <package name="oracle-jdk" url="jdk.zip" />
+</feed>
+"""
+    feed_server.feeds["common.xml"] = """\
+<feed>
+  <package name="bar" url="bar.zip" />
+</feed>
+"""
+    parser = ToolchainFeedParser("foo")
+    parser.parse(feed_server.url + "full.xml")
+    names = [x.name for x in parser.packages]
+    assert names == ["foo", "boost", "bar", "oracle-jdk"]
+    fetched = sorted(x[0] for x in feed_server.requests)
+    assert fetched == ["3rdpart.xml", "common.xml", "full.xml", "oss.xml"]
+    assert all(x[1] is None for x in feed_server.requests)
+
+    feed_server.requests = list()
+    parser = ToolchainFeedParser("foo")
+    parser.parse(feed_server.url + "full.xml")
+    names = [x.name for x in parser.packages]
+    assert names == ["foo", "boost", "bar", "oracle-jdk"]
+    assert len(feed_server.requests) == 4
+    assert all(x[1] is not None for x in feed_server.requests)
+
+def test_corrupted_feed_cache_is_ignored(feed_server):
+    feed_server.feeds["full.xml"] = """\
+<feed>
+  <package name="foo" url="foo.zip" />
+</feed>
+"""
+    url = feed_server.url + "full.xml"
+    open_feed_url(url).close()
+    cache_key = hashlib.sha1(url).hexdigest()
+    cache_path = qisys.sh.get_cache_path("qi", "feeds", cache_key + ".xml")
+    with open(cache_path, "w") as fp:
+        fp.write("<fe")
+    feed_server.requests = list()
+    assert open_feed_url(url).read() == feed_server.feeds["full.xml"]
+    assert feed_server.requests == [("full.xml", None)]
+
+    info_path = os.path.splitext(cache_path)[0] + ".json"
+    with open(info_path, "w") as fp:
+        fp.write("{")
+    feed_server.requests = list()
+    assert open_feed_url(url).read() == feed_server.feeds["full.xml"]
+    assert feed_server.requests == [("full.xml", None)]
+    assert not [x for x in os.listdir(os.path.dirname(cache_path))
+                if x.endswith(".tmp")]
@@ -52,6 +52,19 @@ lib/libboost.so
     assert libbost_so.check(file=True)
     assert installed == ["lib/libboost.so"]
 
+def test_get_install_files(tmpdir):
+    boost_path = tmpdir.mkdir("boost")
+    boost_path.ensure("include", "boost.h", file=True)
+    boost_path.ensure("lib", "libboost.so", file=True)
+    boost_path.ensure("package.xml", file=True)
+    boost_path.ensure("install_manifest_runtime.txt").write("lib/libboost.so\n")
+    package = qitoolchain.qipackage.QiPackage("boost", path=boost_path.strpath)
+    assert package.get_install_files(components=["runtime"]) == ["lib/libboost.so"]
+    assert package.get_install_files(components=["test"]) == list()
+    assert package.get_install_files() == ["include/boost.h",
+                                           "install_manifest_runtime.txt",
+                                           "lib/libboost.so"]
+
 def test_backward_compat_runtime_install(tmpdir):
     boost_path = tmpdir.mkdir("boost")
     boost_path.ensure("include", "boost.h", file=True)
@@ -109,6 +122,35 @@ include bin/lupdate.exe
     assert dest.join("bin", "lrelease.exe").check(file=True)
     assert not dest.join("bin", "moc.exe").check(file=True)
 
+def test_install_mask_is_cached(tmpdir):
+    foo_path = tmpdir.mkdir("foo")
+    runtime_mask = foo_path.ensure("runtime.mask", file=True)
+    runtime_mask.write("exclude include/.*\n")
+    package = qitoolchain.qipackage.QiPackage("foo", path=foo_path.strpath)
+    install_mask = package.get_install_mask("runtime")
+    assert package.get_install_mask("runtime") is install_mask
+    assert not install_mask.match("include/foo.h")
+    assert not install_mask.match("runtime.mask")
+    assert not install_mask.match("package.xml")
+    assert install_mask.match("lib/libfoo.so")
+
+    runtime_mask.write("exclude lib/.*\n")
+    runtime_mask.setmtime(runtime_mask.mtime() + 10)
+    install_mask = package.get_install_mask("runtime")
+    assert install_mask.match("include/foo.h")
+    assert not install_mask.match("lib/libfoo.so")
+
+def test_install_mask_with_back_references():
+    install_mask = qitoolchain.qipackage.InstallMask([
+        r"exclude lib/(foo|bar)/\1\.so",
+        r"exclude lib/(?P<name>baz)/(?P=name)\.a",
+        r"exclude share/(\w+)/.*",
+    ])
+    assert not install_mask.match("lib/foo/foo.so")
+    assert install_mask.match("lib/foo/bar.so")
+    assert not install_mask.match("lib/baz/baz.a")
+    assert not install_mask.match("share/doc/index.html")
+
 def test_load_deps(tmpdir):
     libqi_path = tmpdir.mkdir("libqi")
     libqi_path.ensure("package.xml").write("""\
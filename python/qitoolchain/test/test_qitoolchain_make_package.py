@@ -37,3 +37,20 @@ def test_on_invalid_xml(qitoolchain_action, tmpdir, record_messages):
     rc = qitoolchain_action("make-package", tmpdir.strpath, retcode=True)
     assert rc != 0
     assert record_messages.find("Root element")
+
+def test_reproducible(qitoolchain_action, tmpdir):
+    foo = tmpdir.join("foo")
+    foo.ensure("lib", "libfoo.so", file=True)
+    foo.join("package.xml").write("""
+<package name="foo" version="0.1" target="linux64" />
+""")
+    first = qitoolchain_action("make-package", "--reproducible",
+                               "--output", tmpdir.mkdir("first").strpath,
+                               foo.strpath)
+    foo.join("lib", "libfoo.so").setmtime(0)
+    second = qitoolchain_action("make-package", "--reproducible",
+                                "--output", tmpdir.mkdir("second").strpath,
+                                foo.strpath)
+    with open(first, "rb") as fp1:
+        with open(second, "rb") as fp2:
+            assert fp1.read() == fp2.read()
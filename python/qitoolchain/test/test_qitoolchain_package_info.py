@@ -1,9 +1,19 @@
 ## Copyright (c) 2012-2016 Aldebaran Robotics. All rights reserved.
 ## Use of this source code is governed by a BSD-style license that can be
 ## found in the COPYING file.
+import os
 
 def test_simple(qitoolchain_action, toolchains, record_messages):
     toolchains.create("foo")
     toolchains.add_package("foo", "boost", package_version="1.57-r3")
     qitoolchain_action("package-info", "--toolchain", "foo", "boost")
     assert record_messages.find("boost 1.57-r3")
+
+def test_install_masks(qitoolchain_action, toolchains, record_messages):
+    toolchains.create("foo")
+    boost_package = toolchains.add_package("foo", "boost")
+    mask_path = os.path.join(boost_package.path, "runtime.mask")
+    with open(mask_path, "w") as fp:
+        fp.write("exclude include/.*\nexclude lib/.*\\.a\n")
+    qitoolchain_action("package-info", "--toolchain", "foo", "boost")
+    assert record_messages.find("install mask: runtime \(2 rules\)")